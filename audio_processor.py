@@ -1,36 +1,59 @@
 import vosk
 import logging
 import asyncio
-import io
-import numpy as np
 import discord
-import tempfile
 import os
-import json
-import wave
-from discord.ext import commands
 from discord.ext import voice_recv
 import threading
-import queue
 import time
+import functools
+import metrics
+from speaker_decoder import SpeakerDecoder
+from model_registry import download_model
+from recognizer_pool import RecognizerPool
+from second_pass import Utterance
+from transcript_log import TranscriptLog
+from message_scheduler import MessageUpdateScheduler
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
 
 logger = logging.getLogger(__name__)
 
+# Queued in place of a packet to finalize an utterance whose packets stopped arriving
+_END_OF_UTTERANCE = object()
+
+PACKET_SECONDS = 0.02  # Discord sends one 20ms Opus frame per packet
+
 class AudioProcessor:
-    def __init__(self, model_path="models/vosk-model-small-en-us-0.15"):
+    def __init__(self, model_path="models/vosk-model-small-en-us-0.15", sessions=None):
         """Initialize the audio processor with Vosk model"""
         self.model = None
         self.model_path = model_path
+        # Owning SessionManager, if any: supplies the shared model and decode pool
+        self.sessions = sessions
         self.sample_rate = 16000  # Vosk preferred sample rate
         self.is_transcribing = False
         self.text_channel = None
+        self.voice_channel = None
         self.sink = None
         # Controls whether a summary transcript file is created on stop
         self.enable_file_creation = True
+        # Optional "srt" or "vtt" subtitle file sent alongside the transcript
+        self.subtitle_format = None
+        # Model chosen with ?subbymodel (a ModelRegistry name); None uses the default
+        self.model_name = None
+        self.model_entry = None  # Registry entry held while transcribing with model_name
+        # Live captions: Discord sends/edits per second, and whether every speaker's
+        # partial shares one message (see MessageUpdateScheduler)
+        self.max_updates_per_second = 1.0
+        self.batch_partials = False
         
     async def load_model(self):
         """Load the Vosk model asynchronously"""
+        if self.sessions is not None:
+            self.model = await self.sessions.load_model()
+            return
         if self.model is None:
             logger.info(f"Loading Vosk model from: {self.model_path}")
             try:
@@ -53,47 +76,87 @@ class AudioProcessor:
         
         self.is_transcribing = True
         self.text_channel = text_channel
-        await self.load_model()
-        
-        # Pass current file-creation preference into the sink
-        self.sink = TranscriptionSink(
-            self.model,
-            self.text_channel,
-            asyncio.get_running_loop(),
-            self.sample_rate,
-            enable_file_creation=self.enable_file_creation,
-        )
-        voice_client.listen(self.sink)
+        self.voice_channel = voice_client.channel
+        recognizer_pool = self.sessions.recognizer_pool if self.sessions is not None else None
+        try:
+            await self.load_model()
+            if self.sessions is not None and self.model_name is not None:
+                # Shared with every other session using the same model
+                self.model_entry = await self.sessions.models.acquire(self.model_name)
+                self.model, recognizer_pool = self.model_entry.model, self.model_entry.pool
+
+            # Pass current file-creation preference into the sink
+            self.sink = TranscriptionSink(
+                self.model,
+                self.text_channel,
+                asyncio.get_running_loop(),
+                self.sample_rate,
+                enable_file_creation=self.enable_file_creation,
+                max_updates_per_second=self.max_updates_per_second,
+                batch_partials=self.batch_partials,
+                decode_pool=self.sessions.decode_pool if self.sessions is not None else None,
+                process_backend=self.sessions.process_backend if self.sessions is not None else None,
+                recognizer_pool=recognizer_pool,
+                transcript_dir=self.sessions.transcript_dir if self.sessions is not None else "transcripts",
+                subtitle_format=self.subtitle_format,
+                archive=self.sessions.archive if self.sessions is not None else None,
+                second_pass=self.sessions.second_pass if self.sessions is not None else None,
+            )
+            voice_client.listen(self.sink)
+        except Exception:
+            await self._abort_start()
+            raise
         
-        logger.info("Started transcription")
+        logger.info(f"Started transcription in {self.voice_channel}")
+    
+    async def _abort_start(self):
+        """Undo a start_transcription that failed part way"""
+        sink, model_entry = self.sink, self.model_entry
+        self.sink = self.model_entry = None
+        self.is_transcribing = False
+        try:
+            if sink is not None:
+                # Nothing was recorded; stop its threads and drop the empty log without posting it
+                sink.enable_file_creation = False
+                await asyncio.wrap_future(sink.stop())
+        except Exception as e:
+            logger.error(f"Error cleaning up after a failed start: {e}")
+        finally:
+            if model_entry is not None:
+                self.sessions.models.release(model_entry)
     
     async def stop_transcription(self, voice_client):
-        """Stop transcription"""
+        """Stop transcription, waiting until the last words are out and the transcript is posted"""
         if not self.is_transcribing:
             return
         
         self.is_transcribing = False
+        sink, self.sink = self.sink, None
+        model_entry, self.model_entry = self.model_entry, None
         
-        # Stop listening first to prevent new audio packets
+        # Stop listening first to prevent new audio packets; this calls
+        # sink.cleanup(), which starts the drain without blocking
         voice_client.stop_listening()
         
-        # Small delay to let existing packets finish processing
-        import asyncio
-        await asyncio.sleep(0.5)
-        
-        # Then cleanup the sink
-        if self.sink:
-            self.sink.cleanup()
-            self.sink = None
-        
-        logger.info("Stopped transcription")
+        try:
+            if sink is not None:
+                seconds = await asyncio.wrap_future(sink.stop())
+                logger.info(f"Stopped transcription in {seconds:.2f}s")
+        finally:
+            # After the drain, so the model stays put while its recognizers finish
+            if model_entry is not None:
+                self.sessions.models.release(model_entry)
     
     
     
 
 class TranscriptionSink(voice_recv.AudioSink):
     """Custom audio sink for voice transcription"""
-    def __init__(self, model, text_channel, loop, sample_rate, enable_file_creation=True):
+    def __init__(self, model, text_channel, loop, sample_rate, enable_file_creation=True,
+                 decode_workers=None, max_queue_packets=250, feed_duration=0.5,
+                 max_updates_per_second=1.0, batch_partials=False, decode_pool=None,
+                 process_backend=None, recognizer_pool=None, transcript_dir="transcripts",
+                 subtitle_format=None, archive=None, second_pass=None):
         super().__init__()
         self.model = model
         self.text_channel = text_channel
@@ -101,16 +164,97 @@ class TranscriptionSink(voice_recv.AudioSink):
         self.sample_rate = sample_rate
         # Whether to create and send a summary transcript file on cleanup
         self.enable_file_creation = enable_file_creation
-        self.user_buffers = {}
-        self.user_recognizers = {}
+        self.subtitle_format = subtitle_format  # None, "srt" or "vtt": subtitles sent with the transcript
+        self.user_decoders = {}  # Per-user SpeakerDecoder (resampler, VAD, buffer, recognizer)
         self.user_names = {}
-        self.user_messages = {}  # Store message objects for editing
-        self.user_transcripts = {}  # Store accumulated transcripts
-        self.user_last_activity = {}  # Track last activity for timeout
-        self.chunk_size_48k = int(48000 * 1.5)  # 1.5 seconds at 48kHz mono (shorter for more frequent updates)
-        self.min_chunk_48k = int(48000 * 0.5)   # 0.5 seconds at 48kHz mono
+        self.user_sentence_open = {}  # Whether the next final continues the current sentence
+        # Finals are appended to disk as they arrive instead of accumulating in memory
+        guild = getattr(text_channel, "guild", None)
+        self.transcript = TranscriptLog.create(
+            transcript_dir,
+            guild_id=guild.id if guild is not None else None,
+            channel_id=getattr(text_channel, "id", None),
+            enable_file_creation=enable_file_creation,  # Recovery after a crash honours it too
+        )
+        self.transcript_sync_interval = 5.0  # Seconds between fsyncs of the log
+        self.archive = archive  # Optional TranscriptArchive indexing every final for search
+        # Optional SecondPass: utterances are spooled to disk and re-decoded with a larger model
+        self.second_pass = second_pass
+        self.spool_dir = None
+        if second_pass is not None:
+            self.spool_dir = os.path.join(self.transcript.directory, "utterances")
+            os.makedirs(self.spool_dir)
+        self.user_last_packet = {}  # Monotonic time of each user's last packet
+        self.user_unfinished = set()  # Users with audio since their last utterance end
+        self.user_vad_stats = {}  # Per-user (frames_total, frames_skipped) from the VAD
+        self.evicted_vad_stats = [0, 0]  # The same, summed over speakers evicted since
+        # Streaming feed: contiguous, non-overlapping blocks of feed_duration
+        # seconds go to the recognizer, so every sample is decoded exactly once.
+        # Smaller blocks give fresher partials at a little more per-call overhead.
+        self.feed_duration = feed_duration
+        self.base_feed_duration = feed_duration
+        # Set by the LoadController when the bot falls behind, see set_load_level
+        self.partials = True
+        self.speaker_cap = None  # At most this many users decoded at once; others are shed
         self.cleanup_lock = threading.Lock()  # Thread safety for cleanup
+        self.stopping = False  # Set by stop(): intake is over, the drain is running
+        self._stopping = None  # Future of the drain
+        # Stop waits this long for the last audio to decode and captions to go out,
+        # then this long for the transcript upload
+        self.stop_timeout = 5.0
+        self.upload_timeout = 10.0
+        self.finishes_in_flight = 0  # Process mode: utterance ends sent to a worker, not yet reported
         self.silence_timeout = 2.0  # seconds of silence before treating as new utterance
+        self.vad_threshold_db = -50.0  # Frames quieter than this (dBFS) count as silence
+        self.vad_hangover_ms = 300  # Keep this much audio after speech so word endings survive
+        self.housekeeping_interval = 0.25
+        self.anchor_gap = 0.1  # A pause in packets longer than this re-syncs the speaker's clock
+        # Speakers silent this long give their decoder (and its recognizer) back
+        self.recognizer_idle_timeout = 30.0
+        self.remote_speakers = set()  # Process mode: users with a decoder in a worker
+
+        # Decode pipeline: write() only enqueues PCM, decode workers consume it.
+        # Each user has a bounded packet queue; when it is full the oldest packet
+        # is dropped (and counted) so a stalled decoder never blocks packet intake.
+        # Packets carry a sequence number; arrival times and utterance ends sit in
+        # a separate, unbounded marker queue keyed by the packet they precede, so
+        # overflow only ever discards audio.
+        self.max_queue_packets = max_queue_packets  # 250 packets = 5 seconds of audio
+        self.user_queues = {}  # user_id -> deque of (seq, pcm)
+        self.user_markers = {}  # user_id -> deque of (seq, arrival time or _END_OF_UTTERANCE)
+        self.user_seq = {}  # user_id -> sequence number of the next packet
+        # Held while write() touches a user's state, so eviction can drop it atomically
+        self.users_lock = threading.Lock()
+        self.dropped_packets = {}  # Packets dropped per user, on queue overflow or shed under the speaker cap
+        self.total_dropped_packets = 0
+        self.drain_batch = 50  # Packets decoded per job before yielding to other speakers
+        self.scheduled_users = set()  # Users with a decode job queued or running
+        self.schedule_lock = threading.Lock()
+        self.closed = False
+        # A shared pool (from SessionManager) outlives this sink; a private one doesn't
+        self.owns_decode_pool = decode_pool is None
+        self.decode_pool = decode_pool or ThreadPoolExecutor(
+            max_workers=decode_workers or os.cpu_count() or 1,
+            thread_name_prefix="subby-decode",
+        )
+        # Partials and finals go through a coalescing, rate-limited publisher on
+        # the event loop so decode workers never wait on Discord
+        self.updates = MessageUpdateScheduler(
+            text_channel, loop,
+            max_updates_per_second=max_updates_per_second,
+            batch_partials=batch_partials,
+        )
+        self.updates.start()
+        # Optional ProcessDecodeBackend: decoders then live in worker processes
+        # and this sink only forwards audio and publishes the results
+        self.process_backend = process_backend
+        if process_backend is not None:
+            self.session_key = process_backend.register(self)
+        elif recognizer_pool is None and model is not None:
+            recognizer_pool = RecognizerPool(model, sample_rate)
+        self.recognizer_pool = recognizer_pool
+        self.stop_event = threading.Event()
+        threading.Thread(target=self._housekeeping, name="subby-housekeeping", daemon=True).start()
         logger.info("TranscriptionSink initialized")
     
     def wants_opus(self):
@@ -118,29 +262,13 @@ class TranscriptionSink(voice_recv.AudioSink):
         return False
 
     def write(self, user, data):
-        """Handle incoming audio data"""
+        """Queue incoming audio data for the decode workers"""
         if user is None:
             return
         
-        # Check if cleanup is in progress
-        if self.cleanup_lock.locked():
+        # Check if stop is in progress
+        if self.stopping:
             return
-            
-        user_id = str(user.id)
-        
-        # Initialize user data if not exists
-        if user_id not in self.user_names:
-            self.user_names[user_id] = user.display_name
-        if user_id not in self.user_buffers:
-            self.user_buffers[user_id] = np.array([], dtype=np.int16)
-        if user_id not in self.user_recognizers:
-            self.user_recognizers[user_id] = vosk.KaldiRecognizer(self.model, self.sample_rate)
-        if user_id not in self.user_transcripts:
-            self.user_transcripts[user_id] = ""  # Initialize transcript storage
-        if user_id not in self.user_last_activity:
-            self.user_last_activity[user_id] = time.time()
-
-        buffer = self.user_buffers[user_id]
 
         # Get PCM data from VoiceData object
         if hasattr(data, 'pcm') and data.pcm:
@@ -148,172 +276,590 @@ class TranscriptionSink(voice_recv.AudioSink):
         else:
             return
 
-        # Convert stereo 48kHz PCM to mono 48kHz
-        pcm = np.frombuffer(pcm_data, dtype=np.int16)
-        if len(pcm) % 2 != 0:
-            pcm = pcm[:-1]
-        mono = pcm.reshape(-1, 2).mean(axis=1).astype(np.int16)
-        buffer = np.append(buffer, mono)
-
-        # Process available chunks with overlap to avoid packet loss
-        while len(buffer) >= self.min_chunk_48k:
-            chunk_48k = buffer[:self.chunk_size_48k]
-            # Simple decimation downsample to 16kHz (48kHz / 3 ≈ 16kHz)
-            chunk_16k = chunk_48k[::3]
-            raw_bytes = chunk_16k.astype(np.int16).tobytes()
-
-            recognizer = self.user_recognizers[user_id]
-            current_time = time.time()
-            self.user_last_activity[user_id] = current_time
-            
-            if recognizer.AcceptWaveform(raw_bytes):
-                result = json.loads(recognizer.Result())
-                text = result.get('text', '').strip()
-                if text:
-                    # Check if this is a new utterance (after silence)
-                    time_since_last = current_time - self.user_last_activity.get(user_id + '_last_utterance', 0)
-                    is_new_utterance = time_since_last > self.silence_timeout
-                    
-                    # Always accumulate to the main transcript
-                    if self.user_transcripts[user_id]:
-                        if is_new_utterance:
-                            self.user_transcripts[user_id] += ". " + text  # New sentence after pause
-                        else:
-                            self.user_transcripts[user_id] += " " + text  # Continue current sentence
-                    else:
-                        self.user_transcripts[user_id] = text
-                    
-                    self.user_last_activity[user_id + '_last_utterance'] = current_time
-                    
-                    if user_id in self.user_messages:
-                        # Edit the partial message to become final (just remove asterisk)
-                        coro = self.user_messages[user_id].edit(content=f"🎤 **{self.user_names[user_id]}**: {text}")
-                        asyncio.run_coroutine_threadsafe(coro, self.loop)
-                        del self.user_messages[user_id]  # Remove from tracking
-                    else:
-                        # Send new final message
-                        coro = self.text_channel.send(f"🎤 **{self.user_names[user_id]}**: {text}")
-                        asyncio.run_coroutine_threadsafe(coro, self.loop)
-                    logger.info(f"Transcribed {self.user_names[user_id]}: {text}")
-            else:
-                # Get partial results for intermediate feedback
-                partial = json.loads(recognizer.PartialResult())
-                partial_text = partial.get('partial', '').strip()
-                if partial_text and len(partial_text) > 3:  # Only show meaningful partials
-                    current_time = time.time()
-                    time_since_last = current_time - self.user_last_activity.get(user_id + '_last_utterance', 0)
-                    is_new_utterance = time_since_last > self.silence_timeout
-                    
-                    # For partials, show just the current text (not accumulated)
-                    display_text = partial_text
-                    
-                    if user_id in self.user_messages:
-                        # Edit existing message
-                        coro = self.user_messages[user_id].edit(content=f"🎤 **{self.user_names[user_id]}*: {display_text}")
-                        asyncio.run_coroutine_threadsafe(coro, self.loop)
+        user_id = str(user.id)
+        with self.users_lock:
+            user_queue = self.user_queues.get(user_id)
+            if user_queue is None:
+                self.user_names[user_id] = user.display_name
+                self.dropped_packets[user_id] = 0
+                self.user_markers[user_id] = deque()
+                self.user_seq[user_id] = 0
+                user_queue = self.user_queues[user_id] = deque(maxlen=self.max_queue_packets)
+
+            # Under the speaker cap, people mid-utterance keep their slot and newcomers wait
+            speaker_cap = self.speaker_cap
+            if speaker_cap is not None and user_id not in self.user_unfinished and len(self.user_unfinished) >= speaker_cap:
+                metrics.PACKETS_SHED.inc()
+                self.dropped_packets[user_id] += 1
+                self.total_dropped_packets += 1
+                if self.dropped_packets[user_id] % self.max_queue_packets == 1:
+                    logger.warning(
+                        f"Speaker cap of {speaker_cap} reached, shedding {self.user_names[user_id]}: "
+                        f"{self.dropped_packets[user_id]} packets dropped"
+                    )
+                return
+
+            now = time.monotonic()
+            seq = self.user_seq[user_id]
+            last_packet = self.user_last_packet.get(user_id)
+            if last_packet is None or now - last_packet > self.anchor_gap:
+                # Record the arrival time so the decoder can put word times on the wall clock
+                self.user_markers[user_id].append((seq, time.time()))
+
+            # A full deque discards its oldest packet on append
+            metrics.PACKETS.inc()
+            if len(user_queue) == self.max_queue_packets:
+                self.dropped_packets[user_id] += 1
+                self.total_dropped_packets += 1
+                metrics.PACKETS_DROPPED.inc()
+                if self.dropped_packets[user_id] % self.max_queue_packets == 1:
+                    logger.warning(
+                        f"Decoder falling behind for {self.user_names[user_id]}: "
+                        f"{self.dropped_packets[user_id]} packets dropped"
+                    )
+            user_queue.append((seq, pcm_data))
+            self.user_seq[user_id] = seq + 1
+            self.user_last_packet[user_id] = now
+            self.user_unfinished.add(user_id)
+        self._schedule(user_id)
+
+    def _schedule(self, user_id):
+        """Submit a decode job for a user unless one is already pending"""
+        with self.schedule_lock:
+            if user_id in self.scheduled_users:
+                return
+            self.scheduled_users.add(user_id)
+        try:
+            self.decode_pool.submit(self._drain_user, user_id)
+        except RuntimeError:
+            # Pool already shut down by cleanup
+            with self.schedule_lock:
+                self.scheduled_users.discard(user_id)
+
+    def _drain_user(self, user_id):
+        """Decode queued packets for one user (runs on a decode worker)"""
+        user_queue = self.user_queues.get(user_id)
+        markers = self.user_markers.get(user_id)
+        if user_queue is None or markers is None:
+            # drain() finished while this job waited; hand the decoder back as a late job would
+            with self.schedule_lock:
+                self.scheduled_users.discard(user_id)
+            if self._claim(user_id):
+                self._reclaim(user_id, flush=False)
+            return
+        # Packets arrive every 20ms, so the backlog approximates how long the oldest one waited
+        metrics.STAGE_SECONDS.labels("queue").observe(len(user_queue) * PACKET_SECONDS)
+        try:
+            # Take everything queued (up to the batch limit) and resample it in one pass
+            packets = []
+            started_at = None
+            while len(packets) < self.drain_batch:
+                try:
+                    seq, pcm_data = user_queue.popleft()
+                except IndexError:
+                    seq = pcm_data = None
+                # Apply the markers queued ahead of this packet; with the queue empty
+                # only utterance ends are due, an arrival time waits for its packet
+                while markers:
+                    marker_seq, marker = markers[0]
+                    if seq is None and marker is not _END_OF_UTTERANCE:
+                        break
+                    if seq is not None and marker_seq > seq:
+                        break
+                    markers.popleft()
+                    if marker is _END_OF_UTTERANCE:
+                        if packets:
+                            self._decode_packets(user_id, packets, started_at)
+                            packets, started_at = [], None
+                        self._decode_packets(user_id, _END_OF_UTTERANCE)
                     else:
-                        # Create new message for partial
-                        coro = self.text_channel.send(f"🎤 **{self.user_names[user_id]}*: {display_text}")
-                        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
-                        try:
-                            self.user_messages[user_id] = future.result(timeout=2)
-                        except:
-                            pass
-
-            # Use 50% overlap to avoid missing audio between chunks
-            buffer = buffer[self.chunk_size_48k // 2:]
-
-        # Limit buffer size to prevent memory buildup
-        max_buffer_size = self.chunk_size_48k * 4  # Keep max 8 seconds of audio
-        if len(buffer) > max_buffer_size:
-            buffer = buffer[-max_buffer_size:]
-        
-        self.user_buffers[user_id] = buffer
+                        # Arrival time after a gap: it belongs to the first packet of a new batch
+                        if packets:
+                            self._decode_packets(user_id, packets, started_at)
+                            packets = []
+                        # Shifted by any packets dropped on overflow since it was taken
+                        started_at = marker + (seq - marker_seq) * PACKET_SECONDS
+                if seq is None:
+                    break
+                packets.append(pcm_data)
+            if packets and not self.closed:
+                self._decode_packets(user_id, packets, started_at)
+        except Exception as e:
+            logger.error(f"Error decoding audio for {self.user_names.get(user_id, user_id)}: {e}")
+        finally:
+            with self.schedule_lock:
+                self.scheduled_users.discard(user_id)
+        if self.closed:
+            # cleanup skipped this user's decoder while the job was running
+            if self._claim(user_id):
+                self._reclaim(user_id, flush=False)
+            return
+        # Requeue if more audio arrived (or the batch limit was hit)
+        if self._has_work(user_id):
+            self._schedule(user_id)
+
+    def _has_work(self, user_id):
+        """Whether a user has packets or an utterance end waiting to be decoded"""
+        if self.user_queues.get(user_id):
+            return True
+        markers = self.user_markers.get(user_id)
+        return markers is not None and any(marker is _END_OF_UTTERANCE for _, marker in list(markers))
+
+    def _end_utterance(self, user_id):
+        """Queue an utterance end after the user's last packet"""
+        self.user_markers[user_id].append((self.user_seq[user_id], _END_OF_UTTERANCE))
+        self._schedule(user_id)
+
+    def _claim(self, user_id):
+        """Take exclusive use of a user's decoder, as a decode job would"""
+        with self.schedule_lock:
+            if user_id in self.scheduled_users:
+                return False
+            self.scheduled_users.add(user_id)
+            return True
+
+    def _unclaim(self, user_id):
+        with self.schedule_lock:
+            self.scheduled_users.discard(user_id)
+        if self._has_work(user_id) and not self.closed:
+            self._schedule(user_id)
+
+    def _reclaim(self, user_id, flush=True):
+        """Return a claimed user's decoder to the pool, publishing its last words first"""
+        if self.process_backend is not None:
+            if user_id in self.remote_speakers:
+                self.remote_speakers.discard(user_id)
+                self.process_backend.release(self.session_key, user_id)
+            return
+        decoder = self.user_decoders.pop(user_id, None)
+        if decoder is None:
+            return
+        if flush:
+            self._handle_events(user_id, decoder.finish())
+        decoder.close()
+
+    def _evict_lru(self, user_id):
+        """Free a recognizer by evicting the least recently heard speaker"""
+        speakers = self.remote_speakers if self.process_backend is not None else self.user_decoders
+        candidates = sorted(
+            (uid for uid in list(speakers) if uid != user_id),
+            key=lambda uid: self.user_last_packet.get(uid, 0.0),
+        )
+        for candidate in candidates:
+            if self._claim(candidate):
+                name = self.user_names.get(candidate, candidate)
+                try:
+                    self._reclaim(candidate)
+                    self._forget(candidate)
+                finally:
+                    self._unclaim(candidate)
+                metrics.EVICTIONS.labels("lru").inc()
+                logger.info(f"Recognizer pool full, evicted {name}")
+                return True
+        return False
+
+    def _forget(self, user_id):
+        """Drop a claimed, evicted speaker's per-user state unless they are still talking.
+
+        Their dropped packets are already in ``total_dropped_packets`` and
+        their VAD counters go into ``evicted_vad_stats``; if they speak again
+        write() starts them afresh.
+        """
+        with self.users_lock:
+            if user_id in self.user_unfinished or self._has_work(user_id):
+                return
+            self.user_queues.pop(user_id, None)
+            self.user_markers.pop(user_id, None)
+            self.user_seq.pop(user_id, None)
+            self.user_names.pop(user_id, None)
+            self.user_last_packet.pop(user_id, None)
+            self.user_sentence_open.pop(user_id, None)
+            self.dropped_packets.pop(user_id, None)
+            stats = self.user_vad_stats.pop(user_id, None)
+            if stats is not None:
+                self.evicted_vad_stats[0] += stats[0]
+                self.evicted_vad_stats[1] += stats[1]
+
+    def _decode_packets(self, user_id, packets, started_at=None):
+        """Run a batch of PCM packets through the user's decoder"""
+        if user_id not in self.user_sentence_open:
+            self.user_sentence_open[user_id] = False
+
+        if self.process_backend is not None:
+            # Results come back through _handle_events on the backend's reader thread
+            if packets is _END_OF_UTTERANCE:
+                if user_id not in self.remote_speakers:
+                    return  # Already evicted and flushed
+                with self.schedule_lock:
+                    self.finishes_in_flight += 1
+            elif user_id not in self.remote_speakers:
+                if self.process_backend.at_capacity:
+                    self._evict_lru(user_id)
+                self.remote_speakers.add(user_id)
+            self.process_backend.submit(self.session_key, user_id, packets, started_at)
+            return
+
+        decoder = self.user_decoders.get(user_id)
+        if decoder is None:
+            if packets is _END_OF_UTTERANCE:
+                return  # Already evicted and flushed
+            if self.recognizer_pool.at_capacity:
+                self._evict_lru(user_id)
+            decoder = self.user_decoders[user_id] = SpeakerDecoder(
+                self.model, pool=self.recognizer_pool, **self.decoder_options()
+            )
+
+        if packets is _END_OF_UTTERANCE:
+            # Packets stopped arriving mid-utterance; close it out
+            events = decoder.finish()
+        else:
+            events = decoder.feed(packets, started_at)
+        self._handle_events(user_id, events)
+
+    def decoder_options(self):
+        """Keyword arguments for every SpeakerDecoder this sink creates"""
+        return {
+            "sample_rate": self.sample_rate,
+            "feed_duration": self.feed_duration,
+            "vad_threshold_db": self.vad_threshold_db,
+            "vad_hangover_ms": self.vad_hangover_ms,
+            "silence_timeout": self.silence_timeout,
+            "spool_dir": self.spool_dir,
+            "partials": self.partials,
+        }
+
+    def set_file_creation(self, enabled):
+        """Turn the transcript file on or off for this session, including its crash recovery"""
+        self.enable_file_creation = enabled
+        try:
+            self.transcript.update_meta(enable_file_creation=enabled)
+        except OSError as e:
+            logger.error(f"Error saving transcript setting: {e}")
+
+    def set_load_level(self, partials=True, feed_duration=None, speaker_cap=None):
+        """Apply the LoadController's settings to new and running decoders"""
+        self.partials = partials
+        self.feed_duration = feed_duration or self.base_feed_duration
+        self.speaker_cap = speaker_cap
+        if self.process_backend is not None:
+            self.process_backend.tune(self.session_key, feed_duration=self.feed_duration, partials=partials)
+        for decoder in list(self.user_decoders.values()):
+            decoder.tune(feed_duration=self.feed_duration, partials=partials)
+
+    def _handle_events(self, user_id, events):
+        """Publish decoder events for one user"""
+        for kind, payload in events:
+            if kind == "final":
+                self._emit_final(user_id, payload)
+            elif kind == "partial":
+                self._emit_partial(user_id, payload)
+            elif kind == "utterance":
+                self._submit_utterance(user_id, payload)
+            elif kind == "end":
+                # The next final starts a new sentence
+                self.user_sentence_open[user_id] = False
+                self.user_vad_stats[user_id] = payload
+            elif kind == "finished":
+                # Process mode: a worker has handled one of our end-of-utterance markers
+                with self.schedule_lock:
+                    self.finishes_in_flight -= 1
+
+    def _emit_final(self, user_id, result):
+        text = result.get('text', '').strip()
+        if not text:
+            return
+
+        # Late results can outlive an evicted speaker's state
+        name = self.user_names.get(user_id, user_id)
+        # Always append to the session's transcript log; a pause starts a new sentence
+        new_sentence = not self.user_sentence_open.get(user_id, False)
+        self.user_sentence_open[user_id] = True
+        try:
+            self.transcript.append(
+                user_id, name, text, new_sentence,
+                start=result.get("start"), end=result.get("end"),
+            )
+        except OSError as e:
+            logger.error(f"Error writing transcript segment: {e}")
+        if self.archive is not None:
+            now = time.time()
+            self.archive.add(
+                self.transcript.meta.get("guild_id"), self.transcript.meta.get("channel_id"),
+                user_id, name,
+                result.get("start", now), result.get("end", now), text,
+            )
+
+        metrics.RESULTS.labels("final").inc()
+        self.updates.submit_final(user_id, name, text)
+        logger.info(f"Transcribed {name}: {text}")
+
+    def _submit_utterance(self, user_id, utterance):
+        """Queue a finished utterance's spooled audio for the second pass"""
+        if self.closed:
+            # The session's revision set is already settled; drop late arrivals
+            try:
+                os.remove(utterance["path"])
+            except OSError:
+                pass
+            return
+        self.second_pass.submit(Utterance(
+            self.transcript, user_id, utterance["path"], utterance["start"], utterance["end"],
+            functools.partial(self._revise, self.user_names.get(user_id, user_id)),
+        ))
+
+    def _revise(self, name, utterance, text):
+        """Patch the transcript log and archive with second-pass text (second-pass thread)"""
+        try:
+            self.transcript.revise(utterance.user_id, name, utterance.start, utterance.end, text)
+        except OSError as e:
+            logger.error(f"Error writing transcript revision: {e}")
+        if self.archive is not None:
+            self.archive.revise(
+                self.transcript.meta.get("guild_id"), self.transcript.meta.get("channel_id"),
+                utterance.user_id, name, utterance.start, utterance.end, text,
+            )
+
+    def _emit_partial(self, user_id, partial_text):
+        # Get partial results for intermediate feedback
+        partial_text = partial_text.strip()
+        if not self.partials:
+            return  # Already computed before the load controller turned them off
+        if not partial_text or len(partial_text) <= 3:  # Only show meaningful partials
+            return
+
+        # For partials, show just the current text (not accumulated)
+        metrics.RESULTS.labels("partial").inc()
+        self.updates.submit_partial(user_id, self.user_names.get(user_id, user_id), partial_text)
+
+    def _housekeeping(self):
+        """Finalize utterances of users whose packets stopped arriving"""
+        next_sync = time.monotonic() + self.transcript_sync_interval
+        while not self.stop_event.wait(self.housekeeping_interval):
+            now = time.monotonic()
+            if now >= next_sync:
+                next_sync = now + self.transcript_sync_interval
+                try:
+                    self.transcript.sync()
+                except OSError as e:
+                    logger.error(f"Error syncing transcript log: {e}")
+            for user_id, last_packet in list(self.user_last_packet.items()):
+                if user_id not in self.user_unfinished:
+                    continue
+                if now - last_packet >= self.silence_timeout:
+                    self.user_unfinished.discard(user_id)  # Don't queue the marker twice
+                    self._end_utterance(user_id)
+            self._evict_idle(now)
+
+    def _evict_idle(self, now):
+        """Give back the decoders of speakers whose last utterance ended long ago"""
+        speakers = self.remote_speakers if self.process_backend is not None else self.user_decoders
+        for user_id in list(speakers):
+            if user_id in self.user_unfinished:
+                continue
+            if now - self.user_last_packet.get(user_id, now) < self.recognizer_idle_timeout:
+                continue
+            if self._has_work(user_id) or not self._claim(user_id):
+                continue
+            try:
+                self._reclaim(user_id)
+                self._forget(user_id)
+            finally:
+                self._unclaim(user_id)
+            metrics.EVICTIONS.labels("idle").inc()
+
+    @property
+    def active_speakers(self):
+        """Users who sent audio within the last few seconds"""
+        cutoff = time.monotonic() - 5.0
+        return sum(1 for last_packet in list(self.user_last_packet.values()) if last_packet >= cutoff)
+
+    def queue_depths(self):
+        """Packets waiting to be decoded, per user"""
+        return {user_id: len(user_queue) for user_id, user_queue in list(self.user_queues.items())}
+
+    @property
+    def skipped_audio_fraction(self):
+        """Fraction of received audio the VAD kept away from the recognizer"""
+        stats = dict(self.user_vad_stats)
+        # In-process decoders have live counters; worker processes report at utterance end
+        for user_id, decoder in list(self.user_decoders.items()):
+            stats[user_id] = (decoder.vad.frames_total, decoder.vad.frames_skipped)
+        stats = list(stats.values()) + [self.evicted_vad_stats]
+        total = sum(frames_total for frames_total, _ in stats)
+        skipped = sum(frames_skipped for _, frames_skipped in stats)
+        return skipped / total if total else 0.0
 
     def cleanup(self):
+        # reader.stop() and AudioSink.__del__ both call this; only the first starts the drain
+        self.stop()
+
+    def stop(self):
+        """Stop intake and start drain(); returns a concurrent Future of its result.
+
+        Safe to call from any thread, more than once. Never blocks, since the
+        voice client calls it (through cleanup) on the event loop.
+        """
         with self.cleanup_lock:
-            logger.info("Cleaning up TranscriptionSink")
-            
-            # Create transcript file if enabled and there's any accumulated text
-            logger.info(f"Transcripts available: {list(self.user_transcripts.items())}")
-            if self.enable_file_creation and any(self.user_transcripts.values()):
-                import datetime
-                logger.info("Creating transcript file...")
-                
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"transcript_{timestamp}.txt"
-                
-                # Create transcript content
-                transcript_content = "DISCORD VOICE TRANSCRIPT\n"
-                transcript_content += f"Generated: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                transcript_content += "=" * 50 + "\n\n"
-                
-                for user_id, transcript in self.user_transcripts.items():
-                    if transcript.strip():
-                        transcript_content += f"{self.user_names[user_id]}:\n"
-                        transcript_content += transcript.strip() + "\n\n"
-                
-                # Write to file
+            if self._stopping is None:
+                self.stopping = True
+                coro = self.drain()
                 try:
-                    with open(filename, 'w', encoding='utf-8') as f:
-                        f.write(transcript_content)
-                    
-                    # Send file to channel
-                    coro = self.text_channel.send(
-                        content="📝 **Complete Voice Transcript:**",
-                        file=discord.File(filename, filename="transcript.txt")
-                    )
-                    future = asyncio.run_coroutine_threadsafe(coro, self.loop)
-                    future.result(timeout=5)  # Wait for send to complete
-                    
-                    logger.info(f"Sent transcript file successfully")
-                    
-                    # Clean up local file
-                    try:
-                        os.remove(filename)
-                    except:
-                        pass
-                        
-                except Exception as e:
-                    logger.error(f"Error creating/sending transcript file: {e}")
-                    # Fallback: send as plain message
-                    fallback_text = "📝 **TRANSCRIPT:**\n" + "\n\n".join([
-                        f"**{self.user_names[user_id]}**: {transcript.strip()}" 
-                        for user_id, transcript in self.user_transcripts.items() 
-                        if transcript.strip()
-                    ])
-                    coro = self.text_channel.send(fallback_text)
-                    asyncio.run_coroutine_threadsafe(coro, self.loop)
-            
-            self.user_buffers.clear()
-            self.user_recognizers.clear()
-            self.user_names.clear()
-            self.user_messages.clear()
-            self.user_transcripts.clear()
-            self.user_last_activity.clear()
+                    self._stopping = asyncio.run_coroutine_threadsafe(coro, self.loop)
+                except RuntimeError:
+                    # The event loop is gone; the unclosed log is recovered at the next start
+                    coro.close()
+                    self.stop_event.set()
+                    self._stopping = Future()
+                    self._stopping.set_result(0.0)
+            return self._stopping
+
+    async def drain(self):
+        """Finish the session without blocking the event loop; returns the seconds it took.
+
+        1. Every speaker's queued audio and final result are decoded, in
+           parallel on the decode pool, so trailing speech makes it in.
+        2. Pending captions are sent.
+        3. The transcript is exported off the loop and uploaded.
+
+        The first two share the ``stop_timeout`` deadline (captions always get
+        at least a second) and the upload has ``upload_timeout``. Past them
+        the rest is dropped and the timeout counted; finals are in the
+        transcript either way.
+        """
+        logger.info("Stopping TranscriptionSink")
+        started = phase = time.perf_counter()
+        deadline = self.loop.time() + self.stop_timeout
+
+        # End every open utterance now instead of after the silence timeout
+        self.stop_event.set()
+        for user_id in list(self.user_unfinished):
+            self.user_unfinished.discard(user_id)
+            self._end_utterance(user_id)
+        for user_id in list(self.user_queues):
+            if self._has_work(user_id):
+                self._schedule(user_id)
+        if not await self._wait_until(self._flushed, deadline):
+            metrics.STOP_TIMEOUTS.labels("flush").inc()
+            logger.warning(f"Stop deadline reached with {sum(self.queue_depths().values())} packets undecoded")
+        metrics.STOP_SECONDS.labels("flush").observe(time.perf_counter() - phase)
+
+        # Decode jobs still running past the deadline return their recognizers when they finish
+        self.closed = True
+        if self.owns_decode_pool:
+            self.decode_pool.shutdown(wait=False, cancel_futures=True)
+        if self.process_backend is not None:
+            self.process_backend.unregister(self.session_key)
+            self.remote_speakers.clear()
+        for user_id in list(self.user_decoders):
+            if self._claim(user_id):
+                self._reclaim(user_id, flush=False)  # Finished above, or out of time
+        if self.recognizer_pool is not None:
+            logger.info(
+                f"Recognizer pool: {self.recognizer_pool.hits} hits, {self.recognizer_pool.misses} misses, "
+                f"{self.recognizer_pool.resident} resident"
+            )
+
+        phase = time.perf_counter()
+        if not await self.updates.drain(max(1.0, deadline - self.loop.time())):
+            metrics.STOP_TIMEOUTS.labels("captions").inc()
+        metrics.STOP_SECONDS.labels("captions").observe(time.perf_counter() - phase)
+        logger.info(f"Message updates: {self.updates.stats}")
+        if self.total_dropped_packets:
+            logger.warning(
+                f"Dropped {self.total_dropped_packets} packets on queue overflow or under the speaker cap: "
+                f"{self.dropped_packets}"
+            )
+        if self.user_vad_stats or self.evicted_vad_stats[0]:
+            logger.info(f"VAD skipped {self.skipped_audio_fraction:.0%} of received audio as silence")
+
+        # Stream the transcript file from the on-disk segment log
+        phase = time.perf_counter()
+        self.transcript.close()
+        sent = await self._send_transcript("📝 **Complete Voice Transcript:**")
+        if self.second_pass is not None and self.second_pass.defer(
+            self.transcript, lambda: asyncio.run_coroutine_threadsafe(self._send_revised_transcript(), self.loop)
+        ):
+            # Utterances are still being re-decoded; the log stays until they are in
+            logger.info("Second pass still running, revised transcript will follow")
+        elif sent:
+            await self.loop.run_in_executor(None, self.transcript.remove)
+        metrics.STOP_SECONDS.labels("transcript").observe(time.perf_counter() - phase)
+
+        self.user_queues.clear()
+        self.user_markers.clear()
+        self.user_seq.clear()
+        self.user_names.clear()
+        self.user_sentence_open.clear()
+        self.user_last_packet.clear()
+        self.user_unfinished.clear()
+        self.user_vad_stats.clear()
+
+        seconds = time.perf_counter() - started
+        metrics.STOP_SECONDS.labels("total").observe(seconds)
+        return seconds
+
+    def _flushed(self):
+        """Whether every queued packet and utterance end has been decoded"""
+        with self.schedule_lock:
+            if self.scheduled_users or self.finishes_in_flight > 0:
+                return False
+        return not any(self._has_work(user_id) for user_id in list(self.user_queues))
+
+    async def _wait_until(self, condition, deadline, interval=0.02):
+        while not condition():
+            if self.loop.time() >= deadline:
+                return False
+            await asyncio.sleep(interval)
+        return True
+
+    async def _send_transcript(self, title):
+        """Export the log and post it; returns False if it could not be sent and was kept"""
+        files = []
+        if self.enable_file_creation:
+            try:
+                files = await self.loop.run_in_executor(None, self.transcript.export, self.subtitle_format)
+            except OSError as e:
+                logger.error(f"Error creating transcript file: {e}")
+        if not files:
+            return True
+        logger.info("Sending transcript file...")
+        try:
+            # Send file to channel
+            await asyncio.wait_for(
+                self.text_channel.send(
+                    content=title,
+                    files=[discord.File(path, filename=name) for path, name in files],
+                ),
+                self.upload_timeout,
+            )
+
+            logger.info(f"Sent transcript file successfully")
+            return True
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.STOP_TIMEOUTS.labels("transcript").inc()
+            logger.error(f"Error sending transcript file: {e!r}")
+            # Fallback: send the start of it as a plain message, keep the log on disk
+            with open(files[0][0], encoding="utf-8") as f:
+                fallback_text = "📝 **TRANSCRIPT:**\n" + f.read(1900)
+            try:
+                await asyncio.wait_for(self.text_channel.send(fallback_text), self.upload_timeout)
+            except (discord.HTTPException, asyncio.TimeoutError) as e:
+                logger.error(f"Error sending transcript excerpt: {e!r}")
+            await self.loop.run_in_executor(None, self.transcript.mark_closed)
+            logger.info(f"Transcript kept in {self.transcript.directory}")
+            return False
+
+    async def _send_revised_transcript(self):
+        """Post the transcript again once the second pass has revised all of it"""
+        self.transcript.close()
+        if await self._send_transcript("📝 **Revised Voice Transcript** (high-accuracy second pass):"):
+            await self.loop.run_in_executor(None, self.transcript.remove)
 
     def idle(self):
         pass
 
 
-def download_vosk_model():
-    """Helper function to download a Vosk model"""
-    import urllib.request
-    import zipfile
-    
-    model_url = "https://alphacephei.com/vosk/models/vosk-model-small-en-us-0.15.zip"
-    model_path = "models"
-    model_zip = "vosk-model-small-en-us-0.15.zip"
-    
-    if not os.path.exists(model_path):
-        os.makedirs(model_path)
-    
-    if not os.path.exists(os.path.join(model_path, "vosk-model-small-en-us-0.15")):
-        logger.info("Downloading Vosk model... This may take a while.")
-        urllib.request.urlretrieve(model_url, model_zip)
-        
-        with zipfile.ZipFile(model_zip, 'r') as zip_ref:
-            zip_ref.extractall(model_path)
-        
-        os.remove(model_zip)
-        logger.info("Vosk model downloaded and extracted successfully")
\ No newline at end of file
+def download_vosk_model(name="en"):
+    """Helper function to download a Vosk model; see model_registry.MODELS for the names"""
+    return download_model(name)
@@ -0,0 +1,110 @@
+"""
+Benchmark: speakers decoded in real time per core, in-process threads vs. worker processes.
+
+Feeds the same 48kHz stereo audio for N speakers through SpeakerDecoder on
+a thread pool, and through ProcessDecodeBackend, as fast as possible. The
+model load is excluded; the score is audio-seconds decoded per wall-second
+divided by the number of workers.
+
+    python benchmarks/bench_backends.py --speakers 8 --seconds 20 [--wav speech.wav]
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import DEFAULT_MODEL, load_audio, packets
+
+import vosk
+from process_backend import ProcessDecodeBackend
+from speaker_decoder import SpeakerDecoder
+
+BATCH = 25  # Packets per submit, like a decode job draining a queue
+
+
+def batches(pcm):
+    queued = packets(pcm)
+    return [queued[i:i + BATCH] for i in range(0, len(queued), BATCH)]
+
+
+def bench_threads(model_path, pcm, speakers, workers):
+    vosk.SetLogLevel(-1)
+    model = vosk.Model(model_path)
+    jobs = batches(pcm)
+
+    def run_speaker(_):
+        decoder = SpeakerDecoder(model)
+        for batch in jobs:
+            decoder.feed(batch)
+        decoder.finish()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run_speaker, range(speakers)))
+    return time.perf_counter() - start
+
+
+class _CountingSink:
+    """Stands in for TranscriptionSink: counts finished speakers"""
+
+    def __init__(self, speakers):
+        self.remaining = speakers
+        self.done = threading.Event()
+
+    def decoder_options(self):
+        return {}
+
+    def _handle_events(self, user_id, events):
+        # VAD utterance ends also report "end"; only "finished" answers the explicit finish
+        if any(kind == "finished" for kind, _ in events):
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.done.set()
+
+
+def bench_processes(model_path, pcm, speakers, workers):
+    per_worker = -(-speakers // workers)
+    backend = ProcessDecodeBackend(model_path, workers=workers, ring_bytes=len(pcm) * per_worker + 4096)
+    try:
+        while not backend.ready:
+            time.sleep(0.05)
+        sink = _CountingSink(speakers)
+        session_key = backend.register(sink)
+        jobs = batches(pcm)
+
+        start = time.perf_counter()
+        for batch in jobs:
+            for speaker in range(speakers):
+                backend.submit(session_key, speaker, batch)
+        for speaker in range(speakers):
+            backend.submit(session_key, speaker, None)
+        sink.done.wait()
+        elapsed = time.perf_counter() - start
+        if backend.dropped_batches:
+            print(f"warning: {backend.dropped_batches} batches dropped")
+        return elapsed
+    finally:
+        backend.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--speakers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=20.0, help="audio per speaker")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--wav", help="speech WAV to use instead of synthetic noise bursts")
+    args = parser.parse_args()
+
+    pcm = load_audio(args.seconds, wav=args.wav)
+    audio_seconds = args.speakers * args.seconds
+    for name, bench in (("thread", bench_threads), ("process", bench_processes)):
+        elapsed = bench(args.model, pcm, args.speakers, args.workers)
+        speakers_per_core = audio_seconds / elapsed / args.workers
+        print(f"{name:<8} {elapsed:7.2f}s for {audio_seconds:.0f}s of audio "
+              f"-> {speakers_per_core:5.2f} real-time speakers per core ({args.workers} workers)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Micro-benchmark: 48kHz stereo -> 16kHz mono conversion, in samples/sec.
+
+Compares the original per-packet path (float mean downmix + naive [::3]
+decimation, no anti-aliasing) with the stateful FIR Resampler, called per
+packet and per batch of queued packets.
+
+    python benchmarks/bench_resampler.py [--seconds 2]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from common import PACKET_BYTES
+
+from resampler import Resampler
+
+PACKET_FRAMES = PACKET_BYTES // 4
+
+
+def make_packets(count, seed=0):
+    rng = np.random.default_rng(seed)
+    audio = (rng.standard_normal((count * PACKET_FRAMES, 2)) * 3000).astype(np.int16)
+    return [audio[i * PACKET_FRAMES:(i + 1) * PACKET_FRAMES].tobytes() for i in range(count)]
+
+
+def naive(packets):
+    for pcm_data in packets:
+        pcm = np.frombuffer(pcm_data, dtype=np.int16)
+        mono = pcm.reshape(-1, 2).mean(axis=1).astype(np.int16)
+        mono[::3].tobytes()
+
+
+def fir_per_packet(packets):
+    resampler = Resampler()
+    for pcm_data in packets:
+        resampler.process(pcm_data)
+
+
+def fir_queued(packets, batch=10):
+    resampler = Resampler()
+    for i in range(0, len(packets), batch):
+        resampler.process(packets[i:i + batch])
+
+
+def run(name, func, input_samples, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<34} {input_samples / best / 1e6:8.2f} M input samples/sec "
+          f"({input_samples / best / 48000:8.0f}x real time)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=2.0, help="audio per speaker")
+    args = parser.parse_args()
+
+    packets = make_packets(int(args.seconds * 50))
+    samples = len(packets) * PACKET_FRAMES
+    run("naive mean + [::3] (per packet)", lambda: naive(packets), samples)
+    run("Resampler (per packet)", lambda: fir_per_packet(packets), samples)
+    run("Resampler (10 queued packets)", lambda: fir_queued(packets), samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Shared helpers for the offline benchmarks."""
+import os
+import sys
+import wave
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+DEFAULT_MODEL = os.path.join(REPO_ROOT, "models", "vosk-model-small-en-us-0.15")
+PACKET_BYTES = 3840  # 20 ms of 48kHz stereo int16, what Discord delivers
+PACKET_SECONDS = 0.02
+
+
+def load_audio(seconds, wav=None, source="noise", seed=0):
+    """48kHz stereo int16 PCM bytes.
+
+    Either a WAV file (any rate or channel count, looped to length) or a
+    synthetic signal: ``noise`` or ``tone`` bursts of 1.5 s separated by
+    0.5 s of silence, so VAD gating behaves like it does on real speech.
+    """
+    samples = int(seconds * 48000)
+    if wav:
+        with wave.open(wav, "rb") as f:
+            audio = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+            audio = audio.reshape(-1, f.getnchannels()).mean(axis=1)
+            rate = f.getframerate()
+        if rate != 48000:
+            positions = np.arange(int(len(audio) * 48000 / rate)) * rate / 48000
+            audio = np.interp(positions, np.arange(len(audio)), audio)
+        audio = np.resize(audio, samples)
+    else:
+        t = np.arange(samples) / 48000
+        if source == "tone":
+            # Voiced-speech-like harmonic stack with a slow pitch wobble
+            pitch = 140 + 20 * np.sin(2 * np.pi * 0.5 * t)
+            phase = 2 * np.pi * np.cumsum(pitch) / 48000
+            audio = sum(np.sin(k * phase) / k for k in range(1, 8)) * 4000
+        else:
+            audio = np.random.default_rng(seed).standard_normal(samples) * 3000
+        audio[(np.arange(samples) // 24000) % 4 == 3] = 0
+    mono = audio.astype(np.int16)
+    return np.repeat(mono, 2).tobytes()
+
+
+def packets(pcm):
+    return [pcm[i:i + PACKET_BYTES] for i in range(0, len(pcm), PACKET_BYTES)]
@@ -0,0 +1,234 @@
+"""
+Offline replay benchmark for TranscriptionSink.
+
+Drives TranscriptionSink.write with VoiceData-like packets for N simulated
+speakers, the way the voice_recv router thread would, with a stub text
+channel that records sends and edits instead of talking to Discord. Runs at
+real-time pace (--realtime) or as fast as the sink keeps up, and reports:
+
+- real-time factor (wall time to decode everything / audio duration)
+- CPU seconds per second of audio
+- write() latency on the intake thread and enqueue-to-decoded latency
+  per packet (p50 / p95 / p99 / max)
+- peak RSS, dropped packets, and Discord sends/edits
+- per-stage p50 / p95 from the bot's own metrics histograms
+
+    python benchmarks/replay.py --speakers 10 --seconds 30 [--realtime]
+    python benchmarks/replay.py --wav alice.wav --wav bob.wav --json
+"""
+import argparse
+import asyncio
+import json
+import resource
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from common import DEFAULT_MODEL, PACKET_SECONDS, load_audio, packets
+
+import vosk
+import metrics
+from audio_processor import TranscriptionSink
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.display_name = f"speaker{user_id}"
+
+
+class FakeVoiceData:
+    __slots__ = ("pcm",)
+
+    def __init__(self, pcm):
+        self.pcm = pcm
+
+
+class StubMessage:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content=None, **kwargs):
+        self.channel.edits += 1
+        self.content = content
+        return self
+
+    async def delete(self):
+        self.channel.deletes += 1
+
+
+class StubChannel:
+    """Records what the sink would have posted"""
+
+    def __init__(self):
+        self.sends = 0
+        self.edits = 0
+        self.deletes = 0
+        self.messages = []
+
+    async def send(self, content=None, file=None, **kwargs):
+        self.sends += 1
+        message = StubMessage(self, content)
+        self.messages.append(message)
+        return message
+
+
+class ReplaySink(TranscriptionSink):
+    """TranscriptionSink that timestamps packets from write() until decoded"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.enqueued_at = {}  # user_id -> deque of perf_counter stamps, mirrors user_queues
+        self.decode_latencies = []
+
+    def write(self, user, data):
+        stamps = self.enqueued_at.get(str(user.id))
+        if stamps is None:
+            stamps = self.enqueued_at[str(user.id)] = deque(maxlen=self.max_queue_packets)
+        stamps.append(time.perf_counter())
+        super().write(user, data)
+
+    def _decode_packets(self, user_id, packets, started_at=None):
+        super()._decode_packets(user_id, packets, started_at)
+        if isinstance(packets, list):
+            now = time.perf_counter()
+            stamps = self.enqueued_at[user_id]
+            for _ in range(min(len(packets), len(stamps))):
+                self.decode_latencies.append(now - stamps.popleft())
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ms = np.asarray(values) * 1000
+    return {
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def run(args):
+    vosk.SetLogLevel(-1)
+    model = vosk.Model(args.model)
+
+    sources = args.wav or [None]
+    streams = [
+        packets(load_audio(args.seconds, wav=sources[i % len(sources)], source=args.source, seed=i))
+        for i in range(args.speakers)
+    ]
+    users = [FakeUser(i) for i in range(args.speakers)]
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    channel = StubChannel()
+    sink = ReplaySink(
+        model, channel, loop, 16000,
+        enable_file_creation=False,
+        decode_workers=args.workers,
+        max_updates_per_second=args.update_rate,
+    )
+
+    write_latencies = []
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+
+    # Stagger speakers so their packets don't line up exactly
+    ticks = len(streams[0])
+    for tick in range(ticks):
+        if args.realtime:
+            delay = start + tick * PACKET_SECONDS - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        for user, stream in zip(users, streams):
+            if not args.realtime:
+                # Max speed means as fast as decoding keeps up, not overrunning the queues
+                user_queue = sink.user_queues.get(str(user.id))
+                while user_queue is not None and len(user_queue) >= sink.max_queue_packets - 1:
+                    time.sleep(0.001)
+            data = FakeVoiceData(stream[(tick + user.id * 7) % len(stream)])
+            t0 = time.perf_counter()
+            sink.write(user, data)
+            write_latencies.append(time.perf_counter() - t0)
+    fed = time.perf_counter()
+
+    # Wait for the decode workers to drain every queue
+    while any(sink.user_queues.values()) or sink.scheduled_users:
+        time.sleep(0.005)
+    done = time.perf_counter()
+    cpu = time.process_time() - cpu_start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    audio_seconds = ticks * PACKET_SECONDS
+    report = {
+        "speakers": args.speakers,
+        "audio_seconds_per_speaker": audio_seconds,
+        "mode": "realtime" if args.realtime else "max-speed",
+        "real_time_factor": (done - start) / audio_seconds,
+        "drain_lag_seconds": done - fed,
+        "cpu_seconds_per_audio_second": cpu / (audio_seconds * args.speakers),
+        "write_latency": percentiles(write_latencies),
+        "decode_latency": percentiles(sink.decode_latencies),
+        "peak_rss_mb": rss_after / 1024,
+        "rss_growth_mb": (rss_after - rss_before) / 1024,
+        "dropped_packets": sink.total_dropped_packets,
+        "skipped_audio_fraction": sink.skipped_audio_fraction,
+    }
+
+    # Stop drains the decoders and publishes pending captions; wait for it before stopping the loop
+    report["stop_seconds"] = sink.stop().result(timeout=60)
+    report["discord"] = dict(sink.updates.stats)
+    report["stages"] = {
+        f"{metric.name.replace('subby_', '').replace('_seconds', '')}:{values[0]}": {
+            "p50_ms": child.quantile(0.5) * 1000,
+            "p95_ms": child.quantile(0.95) * 1000,
+        }
+        for metric in (metrics.STAGE_SECONDS, metrics.PUBLISH_DELAY, metrics.DISCORD_SECONDS)
+        for values, child in metric.children()
+    }
+    loop.call_soon_threadsafe(loop.stop)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--speakers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=30.0, help="audio per speaker")
+    parser.add_argument("--wav", action="append", help="speech WAV (repeat for several speakers)")
+    parser.add_argument("--source", choices=("noise", "tone"), default="noise",
+                        help="synthetic signal when no WAV is given")
+    parser.add_argument("--realtime", action="store_true", help="pace packets at 20 ms like a live call")
+    parser.add_argument("--workers", type=int, default=None, help="decode threads (default: CPU count)")
+    parser.add_argument("--update-rate", type=float, default=1.0, help="Discord updates per second")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{report['speakers']} speakers x {report['audio_seconds_per_speaker']:.1f}s ({report['mode']})")
+    print(f"  real-time factor     {report['real_time_factor']:.3f}  (drain lag {report['drain_lag_seconds']:.2f}s)")
+    print(f"  CPU per audio second {report['cpu_seconds_per_audio_second']:.3f}s")
+    for name in ("write_latency", "decode_latency"):
+        stats = report[name]
+        if stats:
+            print(f"  {name:<20} p50 {stats['p50_ms']:.3f}ms  p95 {stats['p95_ms']:.3f}ms  "
+                  f"p99 {stats['p99_ms']:.3f}ms  max {stats['max_ms']:.3f}ms")
+    print(f"  peak RSS             {report['peak_rss_mb']:.1f} MB (+{report['rss_growth_mb']:.1f} MB)")
+    print(f"  dropped packets      {report['dropped_packets']}")
+    print(f"  silence skipped      {report['skipped_audio_fraction']:.0%}")
+    print(f"  discord              {report['discord']}")
+    for name, stats in report["stages"].items():
+        print(f"  {name:<20} p50 {stats['p50_ms']:.3f}ms  p95 {stats['p95_ms']:.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
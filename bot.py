@@ -1,11 +1,17 @@
+import time
+LAUNCHED = time.perf_counter()  # Startup phases are timed from here
+
 import discord
 import asyncio
 import logging
 from discord.ext import commands
-from discord.ext import voice_recv
 import os
+import tempfile
 from dotenv import load_dotenv
-from audio_processor import AudioProcessor, download_vosk_model
+import metrics
+from model_registry import MODELS, download_model
+# Only the light modules here: vosk, numpy and voice_recv load in the background, see setup_hook
+from session_manager import SessionManager
 
 
 # Load environment variables
@@ -26,14 +32,51 @@ intents.voice_states = True
 # Note: message_content is a privileged intent - enable it in your Discord Developer Portal for this bot application
 bot = commands.Bot(command_prefix=BOT_PREFIX, intents=intents, case_insensitive=True)
 
-# Global audio processor
-audio_processor = AudioProcessor()
+# Per-guild transcription sessions sharing one loaded model.
+# SUBBY_BACKEND=process decodes in worker processes to use every core.
+# SUBBY_SECOND_PASS_MODEL re-transcribes every utterance with a larger model in the background.
+sessions = SessionManager(
+    backend=os.getenv('SUBBY_BACKEND', 'thread'),
+    second_pass_model=os.getenv('SUBBY_SECOND_PASS_MODEL'),
+    model_budget_mb=int(os.getenv('SUBBY_MODEL_BUDGET_MB', '2048')),
+    caption_updates_per_second=float(os.getenv('SUBBY_CAPTION_RATE', '1.0')),
+    batch_captions=os.getenv('SUBBY_BATCH_CAPTIONS', '0') == '1',
+)
+sessions.startup_timings["bot_imports"] = time.perf_counter() - LAUNCHED
+# SUBBY_PRELOAD=0 defers loading the model until the first ?subbystart
+PRELOAD = os.getenv('SUBBY_PRELOAD', '1') != '0'
+
+# Optional Prometheus export: an HTTP /metrics endpoint and/or a textfile dump
+METRICS_PORT = os.getenv('SUBBY_METRICS_PORT')
+METRICS_FILE = os.getenv('SUBBY_METRICS_FILE')
+metrics_exporters = []
+transcripts_recovered = False
+
+@bot.event
+async def setup_hook():
+    """Runs after login, before the gateway connects: load the model alongside the connect"""
+    if PRELOAD:
+        sessions.start_preload()
 
 @bot.event
 async def on_ready():
     """Event triggered when the bot is ready"""
     logger.info(f'{bot.user.name} has connected to Discord!')
     logger.info(f'Bot is in {len(bot.guilds)} servers')
+    # on_ready fires again after reconnects; only the first time is startup
+    global transcripts_recovered
+    if not transcripts_recovered:
+        transcripts_recovered = True
+        sessions.startup_timings["gateway"] = time.perf_counter() - LAUNCHED
+        metrics.STARTUP_SECONDS.labels("gateway").set(sessions.startup_timings["gateway"])
+        logger.info(f"Connected {sessions.startup_timings['gateway']:.2f}s after launch "
+                    f"(decoder {'ready' if sessions.is_ready else 'still loading'})")
+        await sessions.recover_transcripts(bot)
+    if not metrics_exporters:
+        if METRICS_PORT:
+            metrics_exporters.append(await metrics.serve(int(METRICS_PORT)))
+        if METRICS_FILE:
+            metrics_exporters.append(asyncio.create_task(metrics.dump_periodically(METRICS_FILE)))
 
 @bot.command(name='subby', help='Check if the bot is responsive')
 async def subby(ctx):
@@ -43,41 +86,87 @@ async def subby(ctx):
     await ctx.send("* ?subbystart starts transcription ")
     await ctx.send("* ?subbystop stops transcription ")
     await ctx.send("* ?subbyleave leaves the voice channel")
-    await ctx.send("* ?subbynotranscript disables transcript file creation for this run")
-    await ctx.send("* ?subbytranscript re-enables transcript file creation for this run")
+    await ctx.send("* ?subbynotranscript disables transcript file creation in this server")
+    await ctx.send("* ?subbytranscript re-enables transcript file creation in this server")
+    await ctx.send("* ?subbysubtitles srt|vtt|off adds a subtitle file to the transcript in this server")
+    await ctx.send("* ?subbycaptions separate|combined picks one caption message per speaker or one shared message")
+    await ctx.send("* ?subbysearch <words> searches past transcripts in this server")
+    await ctx.send("* ?subbyhistory [@user] shows recent transcript lines in this server")
+    await ctx.send("* ?subbyfile transcribes an attached (or replied-to) audio or video file")
+    await ctx.send("* ?subbymodel [name] shows or picks the speech model (language) for this server")
+    await ctx.send("* ?subbystats shows pipeline latency and load")
 
 @bot.command(name='subbynotranscript', help='Turn off transcription file creation after stopping')
+@commands.guild_only()
 async def subbynotranscript(ctx):
-    """Disable transcription file creation after stopping (for this bot run)"""
-    # Disable globally for any new sinks
+    """Disable transcription file creation after stopping (for this server)"""
+    audio_processor = sessions.get(ctx.guild.id)
+    # Disable for any new sinks in this server
     audio_processor.enable_file_creation = False
     # Also disable on the current sink, if one is active
     if audio_processor.sink is not None:
-        try:
-            audio_processor.sink.enable_file_creation = False
-        except AttributeError:
-            pass
-    await ctx.send("Transcription file creation has been disabled for this run. No transcript files will be created after stopping transcription.")
-    logger.info("Transcription file creation disabled by user.")
+        audio_processor.sink.set_file_creation(False)
+    await ctx.send("Transcription file creation has been disabled for this server. No transcript files will be created after stopping transcription.")
+    logger.info(f"Transcription file creation disabled by user in {ctx.guild}.")
 
 @bot.command(name='subbytranscript', help='Re-enable transcription file creation after stopping')
+@commands.guild_only()
 async def subbytranscript(ctx):
-    """Enable transcription file creation after stopping (for this bot run)"""
-    # Enable globally for any new sinks
+    """Enable transcription file creation after stopping (for this server)"""
+    audio_processor = sessions.get(ctx.guild.id)
+    # Enable for any new sinks in this server
     audio_processor.enable_file_creation = True
     # Also enable on the current sink, if one is active
     if audio_processor.sink is not None:
-        try:
-            audio_processor.sink.enable_file_creation = True
-        except AttributeError:
-            pass
-    await ctx.send("Transcription file creation has been enabled for this run. Transcript files will be created after stopping transcription.")
-    logger.info("Transcription file creation enabled by user.")
+        audio_processor.sink.set_file_creation(True)
+    await ctx.send("Transcription file creation has been enabled for this server. Transcript files will be created after stopping transcription.")
+    logger.info(f"Transcription file creation enabled by user in {ctx.guild}.")
+
+@bot.command(name='subbysubtitles', help='Send SRT or WebVTT subtitles with the transcript (srt, vtt or off)')
+@commands.guild_only()
+async def subbysubtitles(ctx, fmt: str = "srt"):
+    """Choose the subtitle format sent with the transcript file (for this server)"""
+    fmt = fmt.lower()
+    if fmt not in ("srt", "vtt", "off"):
+        await ctx.send("Usage: ?subbysubtitles srt|vtt|off")
+        return
+    audio_processor = sessions.get(ctx.guild.id)
+    audio_processor.subtitle_format = None if fmt == "off" else fmt
+    # Also apply to the current sink, if one is active
+    if audio_processor.sink is not None:
+        audio_processor.sink.subtitle_format = audio_processor.subtitle_format
+    if fmt == "off":
+        await ctx.send("Subtitle files have been disabled for this server.")
+    else:
+        await ctx.send(f"A .{fmt} subtitle file will be sent with the transcript after stopping transcription.")
+    logger.info(f"Subtitle format set to {fmt} in {ctx.guild}.")
+
+@bot.command(name='subbycaptions', help='One caption message per speaker, or one shared message (separate or combined)')
+@commands.guild_only()
+async def subbycaptions(ctx, mode: str = None):
+    """Choose how live captions are laid out (for this server), or show the current layout"""
+    audio_processor = sessions.get(ctx.guild.id)
+    if mode is None:
+        current = "combined" if audio_processor.batch_partials else "separate"
+        await ctx.send(f"Live captions here: **{current}**\nUsage: ?subbycaptions separate|combined")
+        return
+    mode = mode.lower()
+    if mode not in ("separate", "combined"):
+        await ctx.send("Usage: ?subbycaptions separate|combined")
+        return
+    # The publisher is set up per session, so this takes effect from the next ?subbystart
+    audio_processor.batch_partials = mode == "combined"
+    if mode == "combined":
+        await ctx.send("Live captions will share one message per channel, starting with the next ?subbystart.")
+    else:
+        await ctx.send("Live captions will get one message per speaker, starting with the next ?subbystart.")
+    logger.info(f"Caption mode set to {mode} in {ctx.guild}.")
 
 @bot.command(name='subbyjoin', help='Join the voice channel you are in')
 async def join_voice(ctx):
     """Join the voice channel of the user who called the command"""
     if ctx.author.voice:
+        from discord.ext import voice_recv
         channel = ctx.author.voice.channel
         try:
             await channel.connect(cls=voice_recv.VoiceRecvClient)
@@ -92,6 +181,8 @@ async def join_voice(ctx):
 async def leave_voice(ctx):
     """Leave the current voice channel"""
     if ctx.voice_client:
+        # Finish any running transcription before the voice connection goes away
+        await sessions.stop(ctx.guild.id, ctx.voice_client)
         await ctx.voice_client.disconnect()
         await ctx.send("Left the voice channel")
         logger.info("Left voice channel")
@@ -103,7 +194,9 @@ async def start_transcription(ctx):
     """Start transcribing audio from the voice channel"""
     if ctx.voice_client:
         try:
-            await audio_processor.start_transcription(ctx.voice_client, ctx.channel)
+            if not sessions.is_ready:
+                await ctx.send("⏳ Loading the speech model, transcription starts as soon as it's ready...")
+            await sessions.start(ctx.guild.id, ctx.voice_client, ctx.channel)
             await ctx.send("🎙️ Started transcription! I'll now transcribe speech in this voice channel.")
         except Exception as e:
             await ctx.send(f"❌ Error starting transcription: {str(e)}")
@@ -116,7 +209,7 @@ async def stop_transcription(ctx):
     """Stop transcribing audio"""
     if ctx.voice_client:
         try:
-            await audio_processor.stop_transcription(ctx.voice_client)
+            await sessions.stop(ctx.guild.id, ctx.voice_client)
             await ctx.send("🛑 Stopped transcription.")
         except Exception as e:
             await ctx.send(f"❌ Error stopping transcription: {str(e)}")
@@ -124,14 +217,228 @@ async def stop_transcription(ctx):
     else:
         await ctx.send("I'm not transcribing in any voice channel!")
 
-@bot.command(name='setup', help='Download Vosk model for speech recognition')
-async def setup_model(ctx):
-    """Download the Vosk model for speech recognition"""
-    await ctx.send("📥 Downloading Vosk model... This may take a few minutes.")
+ARCHIVE_PAGE_SIZE = 5
+
+class ArchivePages(discord.ui.View):
+    """Previous/Next buttons that page through an archive query by editing one message"""
+
+    def __init__(self, author_id, title, fetch):
+        super().__init__(timeout=300)
+        self.author_id = author_id
+        self.title = title
+        self.fetch = fetch  # (limit, offset) -> rows, run off the event loop
+        self.page = 0
+
+    async def render(self):
+        loop = asyncio.get_running_loop()
+        # One extra row tells us whether there is a next page
+        rows = await loop.run_in_executor(
+            None, self.fetch, ARCHIVE_PAGE_SIZE + 1, self.page * ARCHIVE_PAGE_SIZE
+        )
+        self.previous.disabled = self.page == 0
+        self.next.disabled = len(rows) <= ARCHIVE_PAGE_SIZE
+        lines = [
+            f"<t:{int(row['start'])}:f> **{row['speaker_name']}**: {row['text'][:300]}"
+            for row in rows[:ARCHIVE_PAGE_SIZE]
+        ]
+        return f"{self.title} (page {self.page + 1})\n" + ("\n".join(lines) or "Nothing found.")
+
+    async def interaction_check(self, interaction):
+        return interaction.user.id == self.author_id
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous(self, interaction, button):
+        self.page -= 1
+        await interaction.response.edit_message(content=await self.render(), view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next(self, interaction, button):
+        self.page += 1
+        await interaction.response.edit_message(content=await self.render(), view=self)
+
+@bot.command(name='subbysearch', help='Search past transcripts in this server')
+@commands.guild_only()
+async def subbysearch(ctx, *, terms: str):
+    """Full-text search over every archived transcript line in this server"""
+    if sessions.archive is None:
+        await ctx.send("The transcript archive is disabled.")
+        return
+    guild_id = ctx.guild.id
+    view = ArchivePages(
+        ctx.author.id, f"🔎 Transcript lines matching *{terms}*",
+        lambda limit, offset: sessions.archive.search(guild_id, terms, limit, offset),
+    )
+    await ctx.send(await view.render(), view=view)
+
+@bot.command(name='subbyhistory', help='Show recent transcript lines in this server, optionally for one user')
+@commands.guild_only()
+async def subbyhistory(ctx, member: discord.Member = None):
+    """Browse archived transcript lines, newest first"""
+    if sessions.archive is None:
+        await ctx.send("The transcript archive is disabled.")
+        return
+    guild_id = ctx.guild.id
+    speaker_id = str(member.id) if member is not None else None
+    title = f"📜 Recent lines from {member.display_name}" if member is not None else "📜 Recent transcript lines"
+    view = ArchivePages(
+        ctx.author.id, title,
+        lambda limit, offset: sessions.archive.history(guild_id, speaker_id, limit, offset),
+    )
+    await ctx.send(await view.render(), view=view)
+
+def _clock(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes // 60}:{minutes % 60:02d}:{seconds:02d}"
+
+@bot.command(name='subbyfile', help='Transcribe an attached or replied-to audio/video file')
+async def subbyfile(ctx):
+    """Transcribe an uploaded recording, editing one message with progress"""
+    attachments = ctx.message.attachments
+    if not attachments and ctx.message.reference is not None:
+        try:
+            referenced = await ctx.channel.fetch_message(ctx.message.reference.message_id)
+            attachments = referenced.attachments
+        except discord.HTTPException:
+            attachments = []
+    if not attachments:
+        await ctx.send("Attach an audio or video file to ?subbyfile, or reply to a message that has one.")
+        return
+    attachment = attachments[0]
+    status = await ctx.send(f"🎧 Transcribing **{attachment.filename}**...")
+
+    async def progress(decoded, total):
+        if total:
+            done = f"{min(decoded / total, 1.0):.0%} ({_clock(decoded)} of {_clock(total)})"
+        else:
+            done = f"{_clock(decoded)} decoded"
+        await status.edit(content=f"🎧 Transcribing **{attachment.filename}**: {done}")
+
+    model_name = sessions.get(ctx.guild.id).model_name if ctx.guild is not None else None
+    try:
+        # ffmpeg streams the attachment straight from Discord's CDN
+        async with sessions.models.using(model_name or sessions.model_path) as entry:
+            with tempfile.TemporaryDirectory(prefix="subby-file-") as directory:
+                path = await sessions.files.transcribe(entry.model, attachment.url, directory, progress)
+                if path is None:
+                    await status.edit(content=f"🎧 No speech found in **{attachment.filename}**.")
+                    return
+                name = os.path.splitext(attachment.filename)[0] + ".txt"
+                await ctx.send(f"📝 **Transcript of {attachment.filename}:**", file=discord.File(path, filename=name))
+        await status.edit(content=f"✅ Transcribed **{attachment.filename}**.")
+    except Exception as e:
+        await status.edit(content=f"❌ Error transcribing {attachment.filename}: {str(e)}")
+        logger.error(f"Error transcribing {attachment.filename}: {e}")
+
+def _latency_line(label, histogram):
+    if not histogram.count:
+        return f"{label:<16} -"
+    return (f"{label:<16} p50 {histogram.quantile(0.5) * 1000:8.1f}ms  "
+            f"p95 {histogram.quantile(0.95) * 1000:8.1f}ms  n={histogram.count}")
+
+@bot.command(name='subbystats', help='Show where time goes between audio and captions')
+async def subbystats(ctx):
+    """Report per-stage latency, real-time factor, queue depth and drops"""
+    audio = metrics.AUDIO_DECODED.value
+    lines = [
+        f"Sessions {len(sessions.active_sessions)}/{sessions.max_sessions}, "
+        f"active speakers {sessions.active_speakers}/{sessions.max_speakers}",
+        f"Real-time factor {metrics.REAL_TIME_FACTOR.value:.3f} recent, "
+        f"{metrics.DECODE_TIME.value / audio if audio else 0.0:.3f} overall",
+        f"Packets {metrics.PACKETS.value:.0f}, dropped {metrics.PACKETS_DROPPED.value:.0f}, "
+        f"silence skipped {metrics.AUDIO_SKIPPED.value:.0f}s",
+        f"Recognizers {metrics.POOL_RECOGNIZERS.total():.0f} resident, "
+        f"pool hits {metrics.POOL_REQUESTS.labels('hit').value:.0f}, "
+        f"misses {metrics.POOL_REQUESTS.labels('miss').value:.0f}, "
+        f"evictions {metrics.EVICTIONS.total():.0f}",
+        f"Load level {sessions.load_controller.level} ({sessions.load_controller.level_name}), "
+        f"transitions {metrics.LOAD_TRANSITIONS.total():.0f}, "
+        f"packets shed {metrics.PACKETS_SHED.value:.0f}",
+        f"Models {len(sessions.models.loaded())} loaded, {metrics.MODEL_BYTES.get() / 1024 ** 2:.0f} MB, "
+        f"evictions {metrics.MODEL_EVENTS.labels('evict').value:.0f}",
+        "Startup " + (", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in sessions.startup_timings.items())
+                      or "-"),
+        "",
+    ]
+    for stage in ("queue", "resample", "vad", "decode"):
+        lines.append(_latency_line(stage, metrics.STAGE_SECONDS.labels(stage)))
+    for kind in ("partial", "final"):
+        lines.append(_latency_line(f"publish {kind}", metrics.PUBLISH_DELAY.labels(kind)))
+    for op in ("send", "edit"):
+        lines.append(_latency_line(f"discord {op}", metrics.DISCORD_SECONDS.labels(op)))
+    for phase in ("flush", "captions", "total"):
+        lines.append(_latency_line(f"stop {phase}", metrics.STOP_SECONDS.labels(phase)))
+    updates = {outcome: metrics.DISCORD_UPDATES.labels(outcome).value
+               for outcome in ("send", "edit", "coalesced", "error")}
+    lines.append("Updates " + ", ".join(f"{outcome} {count:.0f}" for outcome, count in updates.items()))
+
+    if ctx.guild is not None:
+        processor = sessions.sessions.get(ctx.guild.id)
+        if processor is not None and processor.sink is not None:
+            sink = processor.sink
+            depths = ", ".join(
+                f"{sink.user_names.get(user_id, user_id)} {depth}"
+                for user_id, depth in sink.queue_depths().items()
+            )
+            lines.append(f"Queued packets here: {depths or 'none'}")
+            # Queue overflow and speaker-cap sheds, so it shows who is losing audio
+            dropped = ", ".join(
+                f"{sink.user_names.get(user_id, user_id)} {count}"
+                for user_id, count in list(sink.dropped_packets.items()) if count
+            )
+            lines.append(f"Dropped packets here: {dropped or 'none'}")
+    await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
+@bot.command(name='subbymodel', help='Show or choose the speech model (language) for this server')
+@commands.guild_only()
+async def subbymodel(ctx, name: str = None):
+    """Pick a registry model for this server's next transcription, or list them"""
+    audio_processor = sessions.get(ctx.guild.id)
+    if name is None:
+        loaded = ", ".join(
+            f"{os.path.basename(path)} ({users} in use)" for path, users in sessions.models.loaded()
+        )
+        await ctx.send(
+            f"Model for this server: **{audio_processor.model_name or 'default'}**\n"
+            f"Downloaded: {', '.join(sessions.models.available()) or 'none'} "
+            f"(others: {', '.join(n for n in MODELS if n not in sessions.models.available())})\n"
+            f"Loaded: {loaded or 'none'} "
+            f"({sessions.models.resident_bytes / 1024 ** 2:.0f} of {sessions.models.budget_bytes / 1024 ** 2:.0f} MB)"
+        )
+        return
+    name = name.lower()
+    if name == "default":
+        audio_processor.model_name = None
+        await ctx.send("This server will use the default model.")
+        return
+    if name not in MODELS:
+        await ctx.send(f"Unknown model. Choose one of: default, {', '.join(MODELS)}")
+        return
+    if sessions.backend == "process":
+        await ctx.send("Per-server models need the thread backend; the decoder processes only load the default model.")
+        return
+    if name not in sessions.models.available():
+        await ctx.send(f"Model {name} is not downloaded yet, use ?setup {name} first.")
+        return
+    audio_processor.model_name = name
+    sessions.preload_model(name)  # Loads in the background, ready by the next ?subbystart
+    when = "once transcription is restarted" if audio_processor.is_transcribing else "from the next ?subbystart"
+    await ctx.send(f"This server will use the **{name}** model {when}.")
+    logger.info(f"Model set to {name} in {ctx.guild}.")
+
+@bot.command(name='setup', help='Download a Vosk model for speech recognition (default: en)')
+async def setup_model(ctx, name: str = "en"):
+    """Download a Vosk model for speech recognition"""
+    name = name.lower()
+    if name not in MODELS:
+        await ctx.send(f"Unknown model. Choose one of: {', '.join(MODELS)}")
+        return
+    await ctx.send(f"📥 Downloading Vosk model {MODELS[name]}... This may take a few minutes.")
     try:
         # Run in thread to avoid blocking
         loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, download_vosk_model)
+        await loop.run_in_executor(None, download_model, name)
+        if PRELOAD:
+            sessions.start_preload()
         await ctx.send("✅ Vosk model downloaded successfully! You can now use !start to begin transcription.")
     except Exception as e:
         await ctx.send(f"❌ Error downloading model: {str(e)}")
@@ -142,4 +449,7 @@ if __name__ == "__main__":
         logger.error("DISCORD_TOKEN not found in environment variables!")
         exit(1)
     
-    bot.run(BOT_TOKEN)
\ No newline at end of file
+    try:
+        bot.run(BOT_TOKEN)
+    finally:
+        sessions.shutdown()
\ No newline at end of file
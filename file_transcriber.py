@@ -0,0 +1,158 @@
+import asyncio
+import datetime
+import json
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpeg
+import vosk
+
+from second_pass import lower_thread_priority
+from speaker_decoder import as_waveform
+
+
+logger = logging.getLogger(__name__)
+
+
+class FileTranscriber:
+    """Offline transcription of audio/video files with an already loaded model.
+
+    ffmpeg decodes the source (a local path or an attachment URL) to 16kHz
+    mono PCM on a pipe, and the recognizer reads it in fixed blocks into one
+    reusable buffer, so memory stays flat however long the recording is.
+    Files longer than ``part_seconds`` are cut into parts that decode in
+    parallel, each with its own ffmpeg seek and recognizer, writing its
+    lines to a part file; the parts are stitched in order at the end. Parts
+    run on a dedicated, low-priority pool so live sessions keep the decode
+    pool to themselves.
+    """
+
+    def __init__(self, workers=None, part_seconds=600.0, block_seconds=0.5, niceness=10):
+        self.workers = workers or max(1, (os.cpu_count() or 1) // 2)
+        self.part_seconds = part_seconds
+        self.block_seconds = block_seconds
+        self.niceness = niceness
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="subby-file",
+                                       initializer=lower_thread_priority, initargs=(niceness,))
+
+    async def transcribe(self, model, source, directory, on_progress=None, progress_interval=2.0):
+        """Transcribe ``source`` into ``directory``; returns the transcript path, or None if nothing was said.
+
+        ``on_progress(decoded_seconds, total_seconds)`` is awaited every
+        ``progress_interval`` seconds; ``total_seconds`` is None when ffprobe
+        can't tell the duration, in which case the file is decoded as one part.
+        """
+        loop = asyncio.get_running_loop()
+        duration = await loop.run_in_executor(None, _duration, source)
+        if duration is None:
+            parts = [(0.0, None)]
+        else:
+            count = max(1, math.ceil(duration / self.part_seconds))
+            length = duration / count
+            parts = [(index * length, length) for index in range(count)]
+
+        decoded = [0.0] * len(parts)  # Seconds done per part, written by the part threads
+        stop = threading.Event()
+        futures = [
+            loop.run_in_executor(
+                self.pool, self._decode_part, model, source, offset, length,
+                os.path.join(directory, f"part{index:04d}.txt"), decoded, index, stop,
+            )
+            for index, (offset, length) in enumerate(parts)
+        ]
+        started = time.perf_counter()
+        try:
+            pending = set(futures)
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=progress_interval)
+                for future in done:
+                    future.result()  # Raise the first failure
+                if on_progress is not None:
+                    await on_progress(sum(decoded), duration)
+        except BaseException:
+            stop.set()  # Running parts notice between blocks
+            raise
+        logger.info(f"Transcribed {sum(decoded):.0f}s of {source} in {time.perf_counter() - started:.1f}s "
+                    f"using {len(parts)} parts")
+
+        path = os.path.join(directory, "transcript.txt")
+        wrote = await loop.run_in_executor(None, self._stitch, path, [
+            os.path.join(directory, f"part{index:04d}.txt") for index in range(len(parts))
+        ])
+        return path if wrote else None
+
+    def _decode_part(self, model, source, offset, length, path, decoded, index, stop):
+        """Stream one part through ffmpeg into a fresh recognizer, writing timestamped lines"""
+        recognizer = vosk.KaldiRecognizer(model, 16000)
+        recognizer.SetWords(True)
+        options = {"ss": offset} if offset else {}
+        if length is not None:
+            options["t"] = length
+        process = (
+            ffmpeg.input(source, **options)
+            .output("pipe:", format="s16le", acodec="pcm_s16le", ac=1, ar=16000)
+            .global_args("-nostdin", "-loglevel", "error")
+            .run_async(pipe_stdout=True, pipe_stderr=True)
+        )
+        block = bytearray(int(16000 * self.block_seconds) * 2)
+        view = memoryview(block)
+        try:
+            with open(path, "w", encoding="utf-8") as out:
+                while not stop.is_set():
+                    size = process.stdout.readinto(block)
+                    if not size:
+                        break
+                    size -= size % 2  # Only an odd tail at EOF can be short
+                    if recognizer.AcceptWaveform(as_waveform(view[:size])):
+                        _write_result(out, json.loads(recognizer.Result()), offset)
+                    decoded[index] += size / 32000
+                _write_result(out, json.loads(recognizer.FinalResult()), offset)
+        finally:
+            if stop.is_set():
+                process.kill()
+            process.stdout.close()
+            stderr = process.stderr.read().decode(errors="replace").strip()
+            process.stderr.close()
+            returncode = process.wait()
+        if returncode and not stop.is_set():
+            raise RuntimeError(f"ffmpeg failed: {stderr or returncode}")
+
+    @staticmethod
+    def _stitch(path, part_paths):
+        """Concatenate part files in order under the transcript header"""
+        wrote = False
+        with open(path, "w", encoding="utf-8") as out:
+            out.write("FILE TRANSCRIPT\n")
+            out.write(f"Generated: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            out.write("=" * 50 + "\n\n")
+            for part_path in part_paths:
+                with open(part_path, encoding="utf-8") as part:
+                    for line in part:
+                        out.write(line)
+                        wrote = True
+        return wrote
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _duration(source):
+    """Duration in seconds according to ffprobe, or None"""
+    try:
+        return float(ffmpeg.probe(source)["format"]["duration"])
+    except (ffmpeg.Error, OSError, KeyError, ValueError) as e:
+        logger.info(f"Could not probe duration of {source}: {e}")
+        return None
+
+
+def _write_result(out, result, offset):
+    text = result.get("text", "").strip()
+    if not text:
+        return
+    words = result.get("result")
+    start = offset + (words[0]["start"] if words else 0.0)
+    out.write(f"[{time.strftime('%H:%M:%S', time.gmtime(start))}] {text}\n")
@@ -0,0 +1,111 @@
+import logging
+import threading
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# Degradation steps, cumulative: each level keeps the ones before it
+LEVELS = ("normal", "no_partials", "coarse_feed", "speaker_cap")
+
+
+class LoadController:
+    """Trade caption quality for throughput when decoding falls behind.
+
+    Every ``interval`` seconds it looks at the deepest per-speaker queue and
+    the recognizers' real-time factor. ``degrade_after`` overloaded checks
+    in a row step one level down ``LEVELS``:
+
+    1. ``no_partials`` - recognizers stop computing partial hypotheses
+    2. ``coarse_feed`` - audio goes to the recognizer in ``coarse_feed_duration`` blocks
+    3. ``speaker_cap`` - each session decodes at most its share of the decode
+       workers' speakers; people already talking keep their slot and new
+       talkers' packets are shed until one of them goes quiet
+
+    Quality comes back one level at a time, only after ``restore_after``
+    calm checks in a row; the gap between the high and low thresholds keeps
+    it from flapping. Every transition is logged and counted.
+    """
+
+    def __init__(self, sessions, interval=1.0, high_queue_packets=50, low_queue_packets=10,
+                 high_rtf=0.9, low_rtf=0.5, degrade_after=2, restore_after=10, coarse_feed_duration=1.0):
+        self.sessions = sessions
+        self.interval = interval
+        self.high_queue_packets = high_queue_packets  # 50 packets = 1s of audio waiting
+        self.low_queue_packets = low_queue_packets
+        self.high_rtf = high_rtf
+        self.low_rtf = low_rtf
+        self.degrade_after = degrade_after
+        self.restore_after = restore_after
+        self.coarse_feed_duration = coarse_feed_duration
+        self.level = 0
+        self._overloaded = 0  # Consecutive checks above the high thresholds
+        self._calm = 0  # Consecutive checks below the low thresholds
+        self._stop = threading.Event()
+        self._thread = None
+        metrics.LOAD_LEVEL.set(0)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="subby-load", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def level_name(self):
+        return LEVELS[self.level]
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Error in load controller: {e}")
+
+    def check(self):
+        """Sample the load once and move at most one level"""
+        depth = max(self.sessions.queue_depths().values(), default=0)
+        # The RTF average goes stale once nobody talks, so only trust it under load
+        rtf = metrics.REAL_TIME_FACTOR.value if self.sessions.active_speakers else 0.0
+        if depth >= self.high_queue_packets or rtf >= self.high_rtf:
+            self._overloaded += 1
+            self._calm = 0
+        elif depth <= self.low_queue_packets and rtf <= self.low_rtf:
+            self._calm += 1
+            self._overloaded = 0
+        else:
+            self._overloaded = self._calm = 0
+
+        if self._overloaded >= self.degrade_after and self.level < len(LEVELS) - 1:
+            self._transition(self.level + 1, depth, rtf)
+        elif self._calm >= self.restore_after and self.level > 0:
+            self._transition(self.level - 1, depth, rtf)
+
+    def _transition(self, level, depth, rtf):
+        direction = "degrade" if level > self.level else "restore"
+        logger.warning(
+            f"Load {direction}: {LEVELS[self.level]} -> {LEVELS[level]} "
+            f"(max queue {depth} packets, RTF {rtf:.2f})"
+        )
+        self.level = level
+        self._overloaded = self._calm = 0
+        metrics.LOAD_LEVEL.set(level)
+        metrics.LOAD_TRANSITIONS.labels(direction, LEVELS[level]).inc()
+        for processor in self.sessions.active_sessions:
+            if processor.sink is not None:
+                self.apply(processor.sink)
+
+    def apply(self, sink):
+        """Configure a sink for the current level; also called for every new session"""
+        speaker_cap = None
+        if self.level >= 3:
+            sessions = max(1, len(self.sessions.active_sessions))
+            speaker_cap = max(1, self.sessions.decode_workers // sessions)
+        sink.set_load_level(
+            partials=self.level < 1,
+            feed_duration=self.coarse_feed_duration if self.level >= 2 else None,
+            speaker_cap=speaker_cap,
+        )
@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import discord
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 2000  # Discord's per-message character limit
+
+
+def _clip(content):
+    if len(content) <= MAX_MESSAGE_LENGTH:
+        return content
+    return content[:MAX_MESSAGE_LENGTH - 1] + "…"
+
+
+class MessageUpdateScheduler:
+    """Rate-limited, coalescing publisher of live captions to one text channel.
+
+    Decode threads call ``submit_partial`` / ``submit_final`` without ever
+    blocking; all Discord calls happen in a single task on the event loop.
+    Only the latest pending partial per user is kept, finals always go out
+    before partials, and at most ``max_updates_per_second`` sends/edits are
+    issued to the channel. A lone final turns its speaker's partial message
+    into the final; when several are queued they are combined into one send,
+    so a busy channel never builds a backlog, and the superseded partial
+    messages are deleted in spare slots. With ``batch_partials`` every
+    speaker's partial shares one live message as well.
+    """
+
+    def __init__(self, text_channel, loop, max_updates_per_second=1.0, batch_partials=False):
+        self.text_channel = text_channel
+        self.loop = loop
+        self.min_interval = 1.0 / max_updates_per_second
+        self.batch_partials = batch_partials
+        self.pending_partials = {}  # user_id -> (name, text, submitted), latest only
+        self.pending_finals = deque()  # (user_id, name, text, submitted) in arrival order
+        self.user_messages = {}  # user_id -> partial message to turn into the final
+        self.live_lines = {}  # batch mode: user_id -> partial line shown in live_message
+        self.live_message = None
+        self.stale_messages = deque()  # Partial messages superseded by a combined send, to delete
+        self._live_dirty = False  # batch mode: live message must drop a finalized line
+        self.stats = {
+            "sends": 0,  # New messages posted
+            "edits": 0,  # Existing messages edited
+            "coalesced": 0,  # Updates superseded before they were sent
+            "errors": 0,
+        }
+        self._next_slot = 0.0
+        self._wakeup = None
+        self._closing = False
+        self._task = None
+
+    def start(self):
+        """Start the publishing task; safe to call from any thread"""
+        self._task = asyncio.run_coroutine_threadsafe(self._run(), self.loop)
+
+    def submit_partial(self, user_id, name, text):
+        self.loop.call_soon_threadsafe(self._add_partial, user_id, name, text, time.perf_counter())
+
+    def submit_final(self, user_id, name, text):
+        self.loop.call_soon_threadsafe(self._add_final, user_id, name, text, time.perf_counter())
+
+    def close(self):
+        """Send what is still pending, then stop; safe to call from any thread"""
+        self.loop.call_soon_threadsafe(self._close)
+
+    async def drain(self, timeout=None):
+        """Send what is still pending and wait for it, for at most ``timeout`` seconds.
+
+        Returns False if the deadline cut it short; whatever was still queued
+        is dropped. Call on the event loop.
+        """
+        self._close()
+        if self._task is None:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(self._task), timeout)
+            return True
+        except asyncio.TimeoutError:
+            dropped = len(self.pending_finals) + len(self.pending_partials)
+            self._coalesce(dropped)
+            logger.warning(f"Stop deadline reached, dropped {dropped} pending caption updates")
+            return False
+
+    @property
+    def idle(self):
+        return not (self.pending_finals or self.pending_partials or self._live_dirty or self.stale_messages)
+
+    def _add_partial(self, user_id, name, text, submitted):
+        if user_id in self.pending_partials:
+            self._coalesce()
+        self.pending_partials[user_id] = (name, text, submitted)
+        self._wake()
+
+    def _add_final(self, user_id, name, text, submitted):
+        # A final supersedes whatever partial was waiting for this user
+        if self.pending_partials.pop(user_id, None) is not None:
+            self._coalesce()
+        self.pending_finals.append((user_id, name, text, submitted))
+        self._wake()
+
+    def _coalesce(self, count=1):
+        self.stats["coalesced"] += count
+        metrics.DISCORD_UPDATES.labels("coalesced").inc(count)
+
+    def _close(self):
+        self._closing = True
+        self._wake()
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            if self.idle:
+                if self._closing:
+                    return
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            # Wait for the next rate-limit slot; updates arriving meanwhile coalesce
+            delay = self._next_slot - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_slot = self.loop.time() + self.min_interval
+
+            try:
+                if self.pending_finals:
+                    await self._publish_finals()
+                elif self.batch_partials:
+                    await self._publish_live_message()
+                elif self.pending_partials:
+                    await self._publish_partial()
+                else:
+                    await self._delete_stale_message()
+            except discord.HTTPException as e:
+                self.stats["errors"] += 1
+                metrics.DISCORD_UPDATES.labels("error").inc()
+                logger.error(f"Error updating transcript message: {e}")
+            except Exception as e:
+                self.stats["errors"] += 1
+                metrics.DISCORD_UPDATES.labels("error").inc()
+                logger.error(f"Unexpected error updating transcript message: {e}")
+
+    async def _publish_finals(self):
+        if not self.batch_partials and len(self.pending_finals) == 1:
+            user_id, name, text, submitted = self.pending_finals.popleft()
+            content = f"🎤 **{name}**: {text}"
+            message = self.user_messages.pop(user_id, None)
+            if message is not None:
+                # Edit the partial message to become final (just remove asterisk)
+                await self._edit(message, content)
+            else:
+                await self._send(content)
+            self._published("final", submitted)
+            return
+
+        # Every final queued so far goes out in one message
+        lines = []
+        stamps = []
+        length = 0
+        while self.pending_finals:
+            user_id, name, text, submitted = self.pending_finals[0]
+            line = f"🎤 **{name}**: {text}"
+            if lines and length + len(line) + 1 > MAX_MESSAGE_LENGTH:
+                break
+            self.pending_finals.popleft()
+            lines.append(line)
+            stamps.append(submitted)
+            length += len(line) + 1
+            if self.live_lines.pop(user_id, None) is not None:
+                self._live_dirty = True
+            message = self.user_messages.pop(user_id, None)
+            if message is not None:
+                self.stale_messages.append(message)
+        await self._send("\n".join(lines))
+        self._coalesce(len(lines) - 1)
+        for submitted in stamps:
+            self._published("final", submitted)
+
+    async def _publish_partial(self):
+        user_id = next(iter(self.pending_partials))
+        name, text, submitted = self.pending_partials.pop(user_id)
+        content = f"🎤 **{name}*: {text}"
+        message = self.user_messages.get(user_id)
+        if message is not None:
+            await self._edit(message, content)
+        else:
+            self.user_messages[user_id] = await self._send(content)
+        self._published("partial", submitted)
+
+    async def _publish_live_message(self):
+        # Fold every pending partial into the one shared live message
+        stamps = []
+        for user_id, (name, text, submitted) in self.pending_partials.items():
+            self.live_lines[user_id] = f"🎤 **{name}*: {text}"
+            stamps.append(submitted)
+        self._coalesce(max(0, len(self.pending_partials) - 1))
+        self.pending_partials.clear()
+        self._live_dirty = False
+
+        content = "\n".join(self.live_lines.values())
+        if not content:
+            if self.live_message is not None:
+                message, self.live_message = self.live_message, None
+                self.stats["edits"] += 1
+                await message.delete()
+            return
+        if self.live_message is not None:
+            await self._edit(self.live_message, content)
+        else:
+            self.live_message = await self._send(content)
+        for submitted in stamps:
+            self._published("partial", submitted)
+
+    async def _delete_stale_message(self):
+        message = self.stale_messages.popleft()
+        self.stats["edits"] += 1
+        await message.delete()
+
+    def _published(self, kind, submitted):
+        metrics.PUBLISH_DELAY.labels(kind).observe(time.perf_counter() - submitted)
+
+    async def _send(self, content):
+        self.stats["sends"] += 1
+        metrics.DISCORD_UPDATES.labels("send").inc()
+        started = time.perf_counter()
+        try:
+            return await self.text_channel.send(_clip(content))
+        finally:
+            metrics.DISCORD_SECONDS.labels("send").observe(time.perf_counter() - started)
+
+    async def _edit(self, message, content):
+        self.stats["edits"] += 1
+        metrics.DISCORD_UPDATES.labels("edit").inc()
+        started = time.perf_counter()
+        try:
+            return await message.edit(content=_clip(content))
+        finally:
+            metrics.DISCORD_SECONDS.labels("edit").observe(time.perf_counter() - started)
@@ -0,0 +1,315 @@
+import asyncio
+import bisect
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans sub-millisecond NumPy stages up to slow Discord round-trips
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class _CounterValue:
+    __slots__ = ("value", "lock")
+
+    def __init__(self, lock):
+        self.value = 0.0
+        self.lock = lock  # The owning metric's; += is not atomic across decode threads
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def drain(self):
+        with self.lock:
+            value, self.value = self.value, 0.0
+        return value if value else None
+
+    def merge(self, value):
+        self.inc(value)
+
+
+class _GaugeValue:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Compute the value at collection time instead of storing it"""
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception:
+                return float("nan")
+        return self.value
+
+    def drain(self):
+        return None if self.function is not None else self.value
+
+    def merge(self, value):
+        self.value = value
+
+
+class _HistogramValue:
+    """Fixed-bucket histogram; observe() is a bisect and two additions"""
+
+    __slots__ = ("bounds", "counts", "sum", "count", "lock")
+
+    def __init__(self, bounds, lock):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = lock  # The owning metric's, so drain() never splits an observe()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """Consistent (counts, sum, count)"""
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket"""
+        counts, _, count = self.snapshot()
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, bucket in enumerate(counts):
+            if bucket and seen + bucket >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.bounds[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket
+            seen += bucket
+        return self.bounds[-1]
+
+    def drain(self):
+        with self.lock:
+            if not self.count:
+                return None
+            delta = (self.counts, self.sum, self.count)
+            self.counts = [0] * (len(self.bounds) + 1)
+            self.sum = 0.0
+            self.count = 0
+        return delta
+
+    def merge(self, delta):
+        counts, total, count = delta
+        with self.lock:
+            for i, value in enumerate(counts):
+                self.counts[i] += value
+            self.sum += total
+            self.count += count
+
+
+class _Metric:
+    def __init__(self, kind, name, documentation, labelnames=(), factory=None):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._factory(self._lock)
+        return child
+
+    def children(self):
+        """(label values, child) pairs, sorted by label values"""
+        return sorted(list(self._children.items()))
+
+    def total(self):
+        """Sum over every label combination of a counter or gauge"""
+        children = [child for _, child in self.children()]
+        if self.kind == "gauge":
+            return sum(child.get() for child in children)
+        return sum(child.value for child in children)
+
+    # Unlabelled metrics act as their only child
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return getattr(self.labels(), attr)
+
+    def _label_text(self, values, extra=None):
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self.children():
+            if self.kind == "histogram":
+                counts, total, count = child.snapshot()
+                cumulative = 0
+                for bound, bucket in zip(child.bounds + ("+Inf",), counts):
+                    cumulative += bucket
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{self._label_text(values, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{self._label_text(values)} {total}")
+                lines.append(f"{self.name}_count{self._label_text(values)} {count}")
+            elif self.kind == "gauge":
+                lines.append(f"{self.name}{self._label_text(values)} {child.get()}")
+            else:
+                lines.append(f"{self.name}{self._label_text(values)} {child.value}")
+        return lines
+
+
+def Counter(name, documentation, labelnames=()):
+    return _Metric("counter", name, documentation, labelnames, _CounterValue)
+
+
+def Gauge(name, documentation, labelnames=()):
+    # set() is a single assignment, so gauges need no lock
+    return _Metric("gauge", name, documentation, labelnames, lambda lock: _GaugeValue())
+
+
+def Histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return _Metric("histogram", name, documentation, labelnames, lambda lock: _HistogramValue(buckets, lock))
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def drain(self):
+        """Take and reset everything recorded since the last drain (for worker processes)"""
+        deltas = []
+        for metric in self.metrics.values():
+            for values, child in metric.children():
+                delta = child.drain()
+                if delta is not None:
+                    deltas.append((metric.name, values, delta))
+        return deltas
+
+    def merge(self, deltas):
+        """Fold deltas drained in another process into this registry"""
+        for name, values, delta in deltas:
+            metric = self.metrics.get(name)
+            if metric is not None:
+                metric.labels(*values).merge(delta)
+
+
+REGISTRY = MetricsRegistry()
+
+# Pipeline stages: queue (estimated wait before decode), resample, vad, decode, archive (commit),
+# second_pass (re-decoding one utterance with the large model)
+STAGE_SECONDS = Histogram("subby_stage_seconds", "Time per batch spent in each pipeline stage", ["stage"])
+DISCORD_SECONDS = Histogram("subby_discord_request_seconds", "Discord send/edit round-trip time", ["op"])
+PUBLISH_DELAY = Histogram(
+    "subby_publish_delay_seconds",
+    "Time from recognizer result to the Discord update completing", ["kind"],
+)
+PACKETS = Counter("subby_packets_total", "Voice packets received")
+PACKETS_DROPPED = Counter("subby_packets_dropped_total", "Packets dropped because decoding fell behind")
+AUDIO_DECODED = Counter("subby_decoded_audio_seconds_total", "Seconds of audio fed to recognizers")
+AUDIO_SKIPPED = Counter("subby_skipped_audio_seconds_total", "Seconds of audio gated out as silence")
+DECODE_TIME = Counter("subby_decode_seconds_total", "Seconds spent inside recognizers")
+RESULTS = Counter("subby_results_total", "Recognizer results published", ["kind"])
+DISCORD_UPDATES = Counter("subby_discord_updates_total", "Caption updates by outcome", ["outcome"])
+REAL_TIME_FACTOR = Gauge("subby_real_time_factor", "Recent recognizer time per second of audio (EWMA)")
+QUEUE_DEPTH = Gauge("subby_queue_depth_packets", "Queued packets awaiting decode", ["aggregate"])
+ACTIVE_SESSIONS = Gauge("subby_active_sessions", "Voice channels being transcribed")
+ACTIVE_SPEAKERS = Gauge("subby_active_speakers", "Users who spoke in the last few seconds")
+POOL_REQUESTS = Counter("subby_recognizer_pool_requests_total", "Recognizer requests by outcome", ["result"])
+POOL_RECOGNIZERS = Gauge("subby_recognizers", "Recognizers held by each pool", ["pool", "state"])
+ARCHIVED_SEGMENTS = Counter("subby_archived_segments_total", "Final segments written to the search archive")
+EVICTIONS = Counter("subby_recognizer_evictions_total", "Speakers whose recognizer was reclaimed", ["reason"])
+SECOND_PASS_QUEUE = Gauge("subby_second_pass_queue", "Utterances waiting for the second pass")
+SECOND_PASS_YIELDS = Counter("subby_second_pass_yields_total", "Times the second pass paused for the live path")
+REVISED_SEGMENTS = Counter("subby_revised_segments_total", "Utterances re-transcribed by the second pass")
+LOAD_LEVEL = Gauge("subby_load_level", "Degradation level set by the load controller (0 = full quality)")
+LOAD_TRANSITIONS = Counter(
+    "subby_load_transitions_total", "Load controller level changes", ["direction", "level"],
+)
+MODEL_BYTES = Gauge("subby_model_resident_bytes", "Estimated memory held by loaded models")
+MODEL_EVENTS = Counter("subby_model_events_total", "Model loads and budget evictions", ["event"])
+STARTUP_SECONDS = Gauge("subby_startup_seconds", "Time spent in each startup phase", ["phase"])
+PACKETS_SHED = Counter("subby_packets_shed_total", "Packets not decoded because of the speaker cap")
+STOP_SECONDS = Histogram("subby_stop_seconds", "Time to stop a session, per phase", ["phase"])
+STOP_TIMEOUTS = Counter("subby_stop_timeouts_total", "Stop phases cut short by the deadline", ["phase"])
+
+_rtf_lock = threading.Lock()
+
+
+def observe_decode(decode_seconds, audio_seconds, smoothing=0.05):
+    """Record recognizer time for a block of audio and update the RTF average"""
+    DECODE_TIME.inc(decode_seconds)
+    AUDIO_DECODED.inc(audio_seconds)
+    if audio_seconds:
+        with _rtf_lock:
+            rtf = REAL_TIME_FACTOR.labels()
+            sample = decode_seconds / audio_seconds
+            rtf.value = sample if not rtf.value else rtf.value + smoothing * (sample - rtf.value)
+
+
+def write_textfile(path):
+    """Atomically write the current metrics for a textfile collector"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp, path)
+
+
+async def serve(port, host="0.0.0.0"):
+    """Serve /metrics over HTTP (aiohttp ships with discord.py)"""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
+
+
+async def dump_periodically(path, interval=15.0):
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, write_textfile, path)
+        except OSError as e:
+            logger.error(f"Error writing metrics to {path}: {e}")
+        await asyncio.sleep(interval)
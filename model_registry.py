@@ -0,0 +1,184 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+MODEL_URL = "https://alphacephei.com/vosk/models/{}.zip"
+
+# Short names accepted by ?subbymodel and ?setup -> model directory under the models root
+MODELS = {
+    "en": "vosk-model-small-en-us-0.15",
+    "en-large": "vosk-model-en-us-0.22",
+    "de": "vosk-model-small-de-0.15",
+    "fr": "vosk-model-small-fr-0.22",
+    "es": "vosk-model-small-es-0.42",
+    "it": "vosk-model-small-it-0.22",
+    "pt": "vosk-model-small-pt-0.3",
+    "ru": "vosk-model-small-ru-0.22",
+    "cn": "vosk-model-small-cn-0.22",
+    "ja": "vosk-model-small-ja-0.22",
+}
+
+
+def model_size(path):
+    """Bytes on disk; Vosk keeps roughly that much in memory once loaded"""
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return total
+
+
+def download_model(name="en", root="models"):
+    """Download and unpack a catalog model unless it is already there; returns its path (blocking)"""
+    import shutil
+    import urllib.request
+    import zipfile
+
+    directory = MODELS[name]
+    path = os.path.join(root, directory)
+    if os.path.exists(path):
+        return path
+    os.makedirs(root, exist_ok=True)
+    archive = os.path.join(root, f"{directory}.zip.part")
+    logger.info(f"Downloading Vosk model {directory}... This may take a while.")
+    # Streamed to disk in chunks; the large models are over a gigabyte
+    with urllib.request.urlopen(MODEL_URL.format(directory)) as response, open(archive, "wb") as out:
+        shutil.copyfileobj(response, out, 1024 * 1024)
+    with zipfile.ZipFile(archive) as zip_ref:
+        zip_ref.extractall(root)
+    os.remove(archive)
+    logger.info(f"Vosk model {directory} downloaded and extracted successfully")
+    return path
+
+
+class _Entry:
+    __slots__ = ("path", "size", "model", "pool", "refs", "last_used", "loading")
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.model = None
+        self.pool = None  # RecognizerPool for this model
+        self.refs = 0  # Sessions (and file jobs) currently using the model
+        self.last_used = time.monotonic()
+        self.loading = None  # Task loading the model, shared by everyone waiting on it
+
+
+class ModelRegistry:
+    """Loaded Vosk models, shared by every session that uses them.
+
+    Models are named by catalog key (``"de"``) or directory path and are
+    loaded on first request in a background thread; concurrent requests
+    for the same model wait on the same load. ``acquire`` and ``release``
+    count the sessions using a model. Before a load would push the
+    estimated resident size (each model's size on disk) past
+    ``budget_bytes``, unused models are evicted least recently used first;
+    a model is only unused when no session holds it and its recognizer
+    pool has nothing handed out. If nothing can be evicted the load goes
+    ahead over budget, with a warning. Call from the event loop.
+    """
+
+    def __init__(self, root="models", budget_bytes=2 * 1024 ** 3, max_resident=64):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.max_resident = max_resident  # Recognizer cap of each model's pool
+        self.entries = {}  # path -> _Entry
+        metrics.MODEL_BYTES.set_function(lambda: self.resident_bytes)
+
+    def resolve(self, name):
+        """Directory of a catalog name, or ``name`` itself taken as a path"""
+        return os.path.join(self.root, MODELS[name]) if name in MODELS else name
+
+    def available(self):
+        """Catalog names whose model directory exists"""
+        return [name for name in MODELS if os.path.isdir(self.resolve(name))]
+
+    @property
+    def resident_bytes(self):
+        return sum(entry.size for entry in self.entries.values() if entry.model is not None)
+
+    def loaded(self):
+        """(path, sessions using it) for every loaded model"""
+        return [(path, entry.refs) for path, entry in self.entries.items() if entry.model is not None]
+
+    async def acquire(self, name):
+        """Load (or reuse) a model and count one more user; returns the entry with ``model`` and ``pool``"""
+        entry = await self.load(name)
+        entry.refs += 1
+        entry.last_used = time.monotonic()
+        return entry
+
+    def release(self, entry):
+        entry.refs -= 1
+        entry.last_used = time.monotonic()
+
+    @contextlib.asynccontextmanager
+    async def using(self, name):
+        entry = await self.acquire(name)
+        try:
+            yield entry
+        finally:
+            self.release(entry)
+
+    async def load(self, name):
+        """Make sure a model is loaded without taking a reference (``?subbymodel`` preloads this way)"""
+        path = self.resolve(name)
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"Model {name} is not downloaded (try ?setup {name})")
+        entry = self.entries.get(path)
+        if entry is None:
+            entry = self.entries[path] = _Entry(path, model_size(path))
+        if entry.model is None:
+            task = entry.loading
+            if task is None:
+                task = entry.loading = asyncio.get_running_loop().create_task(self._load(entry))
+            try:
+                await asyncio.shield(task)
+            finally:
+                if task.done() and entry.loading is task:
+                    entry.loading = None  # A failed load is retried by the next request
+        entry.last_used = time.monotonic()
+        return entry
+
+    async def _load(self, entry):
+        import vosk
+        from recognizer_pool import RecognizerPool
+
+        self._make_room(entry)
+        logger.info(f"Loading Vosk model from: {entry.path}")
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        model = await loop.run_in_executor(None, vosk.Model, entry.path)
+        entry.pool = RecognizerPool(model, max_resident=self.max_resident, name=os.path.basename(entry.path))
+        entry.model = model
+        metrics.MODEL_EVENTS.labels("load").inc()
+        logger.info(f"Vosk model loaded successfully in {time.perf_counter() - started:.1f}s "
+                    f"({self.resident_bytes / 1024 ** 2:.0f} MB of {self.budget_bytes / 1024 ** 2:.0f} MB in use)")
+
+    def _make_room(self, incoming):
+        """Evict unused models, least recently used first, until ``incoming`` fits the budget"""
+        while self.resident_bytes + incoming.size > self.budget_bytes:
+            idle = [
+                entry for entry in self.entries.values()
+                if entry is not incoming and entry.model is not None
+                and entry.refs == 0 and entry.pool.in_use == 0
+            ]
+            if not idle:
+                logger.warning(f"Model budget exceeded loading {incoming.path}: every loaded model is in use")
+                return
+            victim = min(idle, key=lambda entry: entry.last_used)
+            logger.info(f"Evicting model {victim.path} to stay within the memory budget")
+            victim.pool.clear()
+            victim.model = None  # Freed by Vosk once no recognizer refers to it
+            victim.pool = None
+            metrics.MODEL_EVENTS.labels("evict").inc()
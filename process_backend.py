@@ -0,0 +1,323 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_HEADER_BYTES = 64  # write position, read position (int64 each), padded
+_METRICS_INTERVAL = 2.0  # Seconds between workers shipping their stage timings
+
+
+class SharedPcmRing:
+    """Single-consumer byte ring in shared memory carrying 48kHz stereo PCM.
+
+    The producer side (the bot process) copies packets in and posts the
+    ``(start, length)`` of each batch on the worker's command queue; the
+    worker reads the batch in place and advances the read position once it
+    has consumed it. Positions grow monotonically and are taken modulo the
+    capacity, which is kept a multiple of one stereo frame (4 bytes) so a
+    wrapped batch never splits a frame.
+    """
+
+    def __init__(self, shm, capacity):
+        self.shm = shm
+        self.capacity = capacity
+        self._positions = np.ndarray((2,), dtype=np.int64, buffer=shm.buf)
+        self._data = np.ndarray((capacity,), dtype=np.uint8, buffer=shm.buf, offset=_HEADER_BYTES)
+
+    @classmethod
+    def create(cls, capacity):
+        capacity -= capacity % 4
+        shm = shared_memory.SharedMemory(create=True, size=_HEADER_BYTES + capacity)
+        ring = cls(shm, capacity)
+        ring._positions[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name, capacity):
+        return cls(shared_memory.SharedMemory(name=name), capacity)
+
+    def write(self, packets):
+        """Append packets back to back; returns (start, length) or None when full"""
+        length = sum(len(pcm) - len(pcm) % 4 for pcm in packets)
+        write_pos, read_pos = int(self._positions[0]), int(self._positions[1])
+        if length > self.capacity - (write_pos - read_pos):
+            return None
+        start = pos = write_pos
+        for pcm in packets:
+            data = np.frombuffer(pcm, dtype=np.uint8)
+            data = data[:len(data) - len(data) % 4]
+            offset = pos % self.capacity
+            first = min(len(data), self.capacity - offset)
+            self._data[offset:offset + first] = data[:first]
+            self._data[:len(data) - first] = data[first:]
+            pos += len(data)
+        # Publish only after the bytes are in place
+        self._positions[0] = pos
+        return start, length
+
+    def read(self, start, length):
+        """Zero-copy int16 views of a batch (two parts if it wraps)"""
+        offset = start % self.capacity
+        first = min(length, self.capacity - offset)
+        parts = [self._data[offset:offset + first].view(np.int16)]
+        if length > first:
+            parts.append(self._data[:length - first].view(np.int16))
+        return parts
+
+    def release(self, end):
+        self._positions[1] = end
+
+    def close(self, unlink=False):
+        # Drop our views before closing, or the buffer stays exported
+        del self._positions, self._data
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _worker_main(index, model_path, shm_name, capacity, commands, results, max_resident=64):
+    """Worker process: load the model once, then decode the speakers assigned to it"""
+    import vosk
+    from recognizer_pool import RecognizerPool
+    from speaker_decoder import SpeakerDecoder
+
+    vosk.SetLogLevel(-1)
+    ring = SharedPcmRing.attach(shm_name, capacity)
+    try:
+        model = vosk.Model(model_path)
+    except Exception as e:
+        results.put(("error", index, f"Failed to load Vosk model: {e}"))
+        return
+    results.put(("ready", index, None))
+
+    pools = {}  # sample_rate -> RecognizerPool, reused as speakers come and go
+    decoders = {}
+    metrics_due = time.monotonic() + _METRICS_INTERVAL
+    while True:
+        command = commands.get()
+        kind = command[0]
+        if kind == "stop":
+            break
+        key = command[1]
+        try:
+            if kind == "open":
+                options = command[2]
+                rate = options.get("sample_rate", 16000)
+                pool = pools.get(rate)
+                if pool is None:
+                    pool = pools[rate] = RecognizerPool(model, rate, max_resident=max_resident, name=f"worker-{index}")
+                decoders[key] = SpeakerDecoder(model, pool=pool, **options)
+                events = []
+            elif kind == "audio":
+                _, _, start, length, started_at = command
+                decoder = decoders[key]
+                # The resampler copies out of shared memory, so release right after
+                events = decoder.feed(ring.read(start, length), started_at)
+                ring.release(start + length)
+            elif kind == "finish":
+                decoder = decoders.get(key)
+                events = decoder.finish() if decoder is not None else []
+                # Answers this command in particular; VAD-detected ends also send "end"
+                events.append(("finished", None))
+            elif kind == "tune":
+                # Broadcast to every worker; key is the session here
+                for (session_key, _), decoder in decoders.items():
+                    if session_key == key:
+                        decoder.tune(**command[2])
+                events = []
+            elif kind == "drop":
+                decoder = decoders.pop(key, None)
+                if decoder is not None:
+                    decoder.close()
+                events = []
+            else:
+                events = []
+            if events:
+                results.put(("events", key, events))
+        except Exception as e:
+            results.put(("error", index, f"Error decoding audio for {key}: {e}"))
+        # Decode timings are recorded in this process; ship them to the bot's registry
+        if time.monotonic() >= metrics_due:
+            metrics_due = time.monotonic() + _METRICS_INTERVAL
+            results.put(("metrics", index, metrics.REGISTRY.drain()))
+    results.put(("metrics", index, metrics.REGISTRY.drain()))
+    ring.close()
+
+
+class _Worker:
+    def __init__(self, index, process, commands, ring):
+        self.index = index
+        self.process = process
+        self.commands = commands
+        self.ring = ring
+        self.write_lock = threading.Lock()  # Several decode threads may feed one worker
+        self.speakers = 0
+        self.ready = False
+
+
+class ProcessDecodeBackend:
+    """Decode speakers in worker processes instead of the bot's interpreter.
+
+    Each worker loads the Vosk model once at startup and hosts the
+    SpeakerDecoders for the speakers sharded onto it. A speaker sticks to
+    the worker it was first assigned to (the least loaded one at the time)
+    so its recognizer state stays in one place. Audio travels through a
+    per-worker shared-memory ring; only small ``(start, length)`` tuples
+    are pickled. Results stream back on one queue and a reader thread hands
+    them to the owning sink.
+
+    With ``max_speakers`` each worker's recognizer pool holds its share of
+    that budget, and ``at_capacity`` tells sinks to evict their least
+    recently heard speaker before adding one. A sink can only evict its
+    own speakers, so when other sessions hold every slot the new speaker
+    goes over the cap, as with the in-process RecognizerPool.
+    """
+
+    def __init__(self, model_path, workers=None, ring_bytes=8 * 1024 * 1024, max_speakers=None):
+        self.model_path = model_path
+        context = multiprocessing.get_context("spawn")
+        self.results = context.Queue()
+        self.workers = []
+        count = workers or os.cpu_count() or 1
+        # Speakers are assigned to the least loaded worker, so each gets an even share
+        self.speakers_per_worker = -(-max_speakers // count) if max_speakers else None
+        for index in range(count):
+            ring = SharedPcmRing.create(ring_bytes)
+            commands = context.Queue()
+            process = context.Process(
+                target=_worker_main,
+                args=(index, model_path, ring.shm.name, ring.capacity, commands, self.results,
+                      self.speakers_per_worker or 64),
+                name=f"subby-decoder-{index}",
+                daemon=True,
+            )
+            process.start()
+            self.workers.append(_Worker(index, process, commands, ring))
+
+        self.assignments = {}  # (session_key, user_id) -> _Worker
+        self.sinks = {}  # session_key -> sink receiving results
+        self.assign_lock = threading.Lock()
+        self.dropped_batches = 0  # Batches dropped because a worker's ring was full
+        self._session_keys = itertools.count()
+        self._reader = threading.Thread(target=self._read_results, name="subby-results", daemon=True)
+        self._reader.start()
+        logger.info(f"Started {len(self.workers)} decoder processes")
+
+    def register(self, sink):
+        """Attach a sink; returns the session key to pass to submit"""
+        session_key = next(self._session_keys)
+        self.sinks[session_key] = sink
+        return session_key
+
+    def unregister(self, session_key):
+        """Detach a sink and free its speakers' decoders in the workers"""
+        self.sinks.pop(session_key, None)
+        with self.assign_lock:
+            keys = [key for key in self.assignments if key[0] == session_key]
+            for key in keys:
+                worker = self.assignments.pop(key)
+                worker.speakers -= 1
+                worker.commands.put(("drop", key))
+
+    def release(self, session_key, user_id):
+        """Free one idle speaker's decoder; their next audio is assigned afresh"""
+        with self.assign_lock:
+            worker = self.assignments.pop((session_key, user_id), None)
+            if worker is not None:
+                worker.speakers -= 1
+                worker.commands.put(("drop", (session_key, user_id)))
+
+    def tune(self, session_key, **options):
+        """Retune a session's existing decoders; new ones take the sink's decoder_options()"""
+        for worker in self.workers:
+            worker.commands.put(("tune", session_key, options))
+
+    def _worker_for(self, key):
+        with self.assign_lock:
+            worker = self.assignments.get(key)
+            if worker is None:
+                worker = min(self.workers, key=lambda w: w.speakers)
+                worker.speakers += 1
+                self.assignments[key] = worker
+                # Commands on one queue are handled in order, so the decoder
+                # exists before the speaker's first audio arrives
+                worker.commands.put(("open", key, self.sinks[key[0]].decoder_options()))
+            return worker
+
+    def submit(self, session_key, user_id, packets, started_at=None):
+        """Queue a batch of PCM packets (or the end-of-utterance marker) for a speaker"""
+        if session_key not in self.sinks:
+            return
+        key = (session_key, user_id)
+        worker = self._worker_for(key)
+        if not isinstance(packets, list):
+            worker.commands.put(("finish", key))
+            return
+        with worker.write_lock:
+            span = worker.ring.write(packets)
+            if span is not None:
+                worker.commands.put(("audio", key, span[0], span[1], started_at))
+        if span is None:
+            self.dropped_batches += 1
+            metrics.PACKETS_DROPPED.inc(len(packets))
+            if self.dropped_batches % 100 == 1:
+                logger.warning(
+                    f"Decoder process {worker.index} is falling behind: "
+                    f"{self.dropped_batches} audio batches dropped"
+                )
+
+    def _read_results(self):
+        while True:
+            try:
+                message = self.results.get()
+            except (EOFError, OSError):
+                return
+            if message is None:
+                return
+            kind, key, payload = message
+            if kind == "events":
+                sink = self.sinks.get(key[0])
+                if sink is not None:
+                    try:
+                        sink._handle_events(key[1], payload)
+                    except Exception as e:
+                        logger.error(f"Error publishing results for {key[1]}: {e}")
+            elif kind == "metrics":
+                metrics.REGISTRY.merge(payload)
+            elif kind == "ready":
+                self.workers[key].ready = True
+                logger.info(f"Decoder process {key} loaded the model")
+            elif kind == "error":
+                logger.error(f"Decoder process {key}: {payload}")
+
+    @property
+    def at_capacity(self):
+        """Whether every worker already hosts its share of ``max_speakers``"""
+        if self.speakers_per_worker is None:
+            return False
+        with self.assign_lock:
+            return all(worker.speakers >= self.speakers_per_worker for worker in self.workers)
+
+    @property
+    def ready(self):
+        return all(worker.ready for worker in self.workers)
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.commands.put(("stop",))
+        for worker in self.workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.ring.close(unlink=True)
+        self.results.put(None)
+        self._reader.join(timeout=5)
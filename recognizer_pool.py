@@ -0,0 +1,102 @@
+import logging
+import threading
+
+import vosk
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class RecognizerPool:
+    """Reusable KaldiRecognizers for one model and sample rate.
+
+    Building a recognizer allocates the decoder graph state, which costs
+    tens of milliseconds on the first packet of every new speaker. The pool
+    hands out pre-built recognizers instead and takes them back once a
+    speaker goes idle, calling ``Reset()`` so no hypothesis leaks into the
+    next speaker. ``Reset()`` does not rewind Vosk's clock, so word times
+    keep counting from the audio a recognizer consumed before; ``acquire``
+    returns that elapsed time alongside the recognizer and ``release``
+    takes the updated figure back. At most ``max_resident`` recognizers
+    (in use plus idle) are meant to exist; ``at_capacity`` tells callers
+    when to reclaim one from their least recently active speaker before
+    asking for another.
+    """
+
+    def __init__(self, model, sample_rate=16000, max_resident=64, name="main"):
+        self.model = model
+        self.sample_rate = sample_rate
+        self.max_resident = max_resident
+        self.name = name
+        self.idle = []  # (recognizer, elapsed seconds) ready to hand out
+        self.in_use = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _new(self):
+        recognizer = vosk.KaldiRecognizer(self.model, self.sample_rate)
+        recognizer.SetWords(True)  # Word start/end times place segments on the session clock
+        return recognizer
+
+    def prewarm(self, count):
+        """Build recognizers ahead of the first speakers (blocking; run off the event loop)"""
+        built = []
+        for _ in range(max(0, min(count, self.max_resident - self.resident))):
+            built.append((self._new(), 0.0))
+        with self._lock:
+            self.idle.extend(built)
+            self._update_gauges()
+        if built:
+            logger.info(f"Pre-built {len(built)} recognizers for pool {self.name}")
+
+    def acquire(self):
+        """Returns ``(recognizer, elapsed)``, elapsed being the audio seconds it already consumed"""
+        with self._lock:
+            self.in_use += 1
+            if self.idle:
+                self.hits += 1
+                metrics.POOL_REQUESTS.labels("hit").inc()
+                entry = self.idle.pop()
+                self._update_gauges()
+                return entry
+            self.misses += 1
+            metrics.POOL_REQUESTS.labels("miss").inc()
+        try:
+            recognizer = self._new()
+        except Exception:
+            with self._lock:
+                self.in_use -= 1
+            raise
+        with self._lock:
+            self._update_gauges()
+        return recognizer, 0.0
+
+    def release(self, recognizer, elapsed=0.0):
+        """Take a recognizer back; its pending audio and hypothesis are discarded"""
+        recognizer.Reset()
+        with self._lock:
+            self.in_use -= 1
+            if self.in_use + len(self.idle) < self.max_resident:
+                self.idle.append((recognizer, elapsed))
+            self._update_gauges()
+
+    def clear(self):
+        """Drop the idle recognizers, e.g. before the model is unloaded"""
+        with self._lock:
+            self.idle.clear()
+            self._update_gauges()
+
+    @property
+    def resident(self):
+        return self.in_use + len(self.idle)
+
+    @property
+    def at_capacity(self):
+        return not self.idle and self.in_use >= self.max_resident
+
+    def _update_gauges(self):
+        metrics.POOL_RECOGNIZERS.labels(self.name, "in_use").set(self.in_use)
+        metrics.POOL_RECOGNIZERS.labels(self.name, "idle").set(len(self.idle))
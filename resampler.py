@@ -0,0 +1,114 @@
+import functools
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+def design_lowpass(num_taps, cutoff, sample_rate, beta=7.0):
+    """Kaiser-windowed sinc low-pass filter with unity DC gain"""
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = np.sinc(2 * cutoff / sample_rate * n) * np.kaiser(num_taps, beta)
+    return taps / taps.sum()
+
+
+@functools.lru_cache(maxsize=None)
+def _decimation_taps(num_taps, cutoff, sample_rate):
+    # Halve the taps so filtering L + R directly yields the channel mean;
+    # reversed so a dot product with an input window is a convolution
+    taps = (0.5 * design_lowpass(num_taps, cutoff, sample_rate))[::-1].astype(np.float32)
+    taps.flags.writeable = False
+    return taps
+
+
+class Resampler:
+    """Stateful 48kHz stereo -> 16kHz mono anti-aliased resampler.
+
+    A low-pass FIR runs in front of the 3:1 decimation, but only the output
+    phase that is kept is ever computed (polyphase decimation): each output
+    sample is one dot product over a strided window of the input. Filter
+    history carries across calls, so packet boundaries are seamless. The
+    stereo downmix is folded into the taps, and all work buffers are
+    preallocated, so steady-state calls do not allocate.
+    """
+
+    factor = 3
+    input_rate = 48000
+
+    def __init__(self, num_taps=96, cutoff=7000.0, max_frames=4800):
+        self.taps = _decimation_taps(num_taps, float(cutoff), self.input_rate)
+        self.num_taps = num_taps
+        self.history = num_taps - 1
+        self._skip = 0  # New input samples to skip before the next output sample
+        self._alloc(max_frames)
+
+    def _alloc(self, max_frames):
+        history = None if not hasattr(self, "_work") else self._work[:self.history].copy()
+        max_out = max_frames // self.factor + 1
+        self._work = np.zeros(self.history + max_frames, dtype=np.float32)
+        self._acc = np.empty(max_out, dtype=np.float32)
+        self._out = np.empty(max_out, dtype=np.int16)
+        if history is not None:
+            self._work[:self.history] = history
+        self.max_frames = max_frames
+
+    @staticmethod
+    def _stereo(pcm):
+        if not isinstance(pcm, np.ndarray):
+            pcm = np.frombuffer(pcm, dtype=np.int16)
+        if len(pcm) % 2 != 0:
+            pcm = pcm[:-1]
+        return pcm.reshape(-1, 2)
+
+    def reset(self):
+        """Forget filter history, e.g. before reusing for another stream"""
+        self._work[:self.history] = 0
+        self._skip = 0
+
+    def process(self, packets):
+        """Resample one PCM packet (or a list of packets) to 16kHz mono int16.
+
+        Returns a view into an internal buffer that stays valid until the
+        next call.
+        """
+        if isinstance(packets, (bytes, bytearray, memoryview, np.ndarray)):
+            packets = (packets,)
+        stereo = [self._stereo(pcm) for pcm in packets]
+        frames = sum(len(s) for s in stereo)
+        if frames > self.max_frames:
+            self._alloc(frames)
+
+        # Append L + R of every packet after the carried filter history
+        work = self._work
+        pos = self.history
+        for s in stereo:
+            np.add(s[:, 0], s[:, 1], out=work[pos:pos + len(s)], dtype=np.float32)
+            pos += len(s)
+
+        n_out = self._filter(work, frames, self._acc, self._out)
+
+        # Carry the last num_taps - 1 inputs into the next call
+        work[:self.history] = work[frames:frames + self.history]
+        return self._out[:n_out]
+
+    def _filter(self, work, frames, acc, out):
+        skip = self._skip
+        n_out = max(0, -(-(frames - skip) // self.factor))
+        self._skip = skip + n_out * self.factor - frames
+        if n_out:
+            step = work.strides[-1]
+            windows = as_strided(
+                work[skip:],
+                shape=(n_out, self.num_taps),
+                strides=(self.factor * step, step),
+                writeable=False,
+            )
+            np.dot(windows, self.taps, out=acc[:n_out])
+            _to_int16(acc[:n_out], out[:n_out])
+        return n_out
+
+
+def _to_int16(samples, out):
+    np.rint(samples, out=samples)
+    np.clip(samples, -32768, 32767, out=samples)
+    out[:] = samples
+
@@ -0,0 +1,63 @@
+import numpy as np
+
+
+class PcmRingBuffer:
+    """Fixed-capacity int16 ring buffer for per-user PCM audio.
+
+    Every sample is stored twice, ``capacity`` apart, so any window of up to
+    ``capacity`` samples is contiguous in memory and ``peek`` can hand out a
+    view instead of a copy. Writing never allocates; when the buffer is full
+    the oldest samples are overwritten and counted in ``overwritten``.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self._data = np.zeros(self.capacity * 2, dtype=np.int16)
+        self._start = 0  # Read position, always in [0, capacity)
+        self._size = 0
+        self.overwritten = 0  # Samples lost because the buffer was full
+
+    def __len__(self):
+        return self._size
+
+    def write(self, samples):
+        """Append samples, dropping the oldest ones if capacity is exceeded"""
+        n = len(samples)
+        if n == 0:
+            return
+        if n > self.capacity:
+            self.overwritten += n - self.capacity
+            samples = samples[-self.capacity:]
+            n = self.capacity
+
+        overflow = self._size + n - self.capacity
+        if overflow > 0:
+            self.consume(overflow)
+            self.overwritten += overflow
+
+        cap = self.capacity
+        end = (self._start + self._size) % cap
+        first = min(n, cap - end)
+        self._data[end:end + first] = samples[:first]
+        self._data[end + cap:end + cap + first] = samples[:first]
+        rest = n - first
+        if rest:
+            self._data[:rest] = samples[first:]
+            self._data[cap:cap + rest] = samples[first:]
+        self._size += n
+
+    def peek(self, n=None):
+        """Return a zero-copy view of up to n of the oldest samples"""
+        if n is None or n > self._size:
+            n = self._size
+        return self._data[self._start:self._start + n]
+
+    def consume(self, n):
+        """Discard up to n of the oldest samples"""
+        n = min(n, self._size)
+        self._start = (self._start + n) % self.capacity
+        self._size -= n
+
+    def clear(self):
+        self._start = 0
+        self._size = 0
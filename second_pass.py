@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import vosk
+
+import metrics
+from speaker_decoder import as_waveform
+
+
+logger = logging.getLogger(__name__)
+
+_FEED_SAMPLES = 8000  # 0.5s per AcceptWaveform, the same block size as the live path
+
+
+def lower_thread_priority(niceness):
+    """Renice the calling thread; Linux schedules threads individually, elsewhere this may do nothing"""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+    except (AttributeError, OSError) as e:
+        logger.info(f"Background thread runs at normal priority: {e}")
+
+
+class Utterance:
+    """A spooled utterance waiting for the second pass"""
+
+    __slots__ = ("session", "user_id", "path", "start", "end", "on_result")
+
+    def __init__(self, session, user_id, path, start, end, on_result):
+        self.session = session  # Owning TranscriptLog, used to know when a session is fully revised
+        self.user_id = user_id
+        self.path = path  # Raw 16kHz mono int16 audio
+        self.start = start
+        self.end = end
+        self.on_result = on_result  # Called with (utterance, text) on the worker thread
+
+
+class SecondPass:
+    """Background re-transcription of finished utterances with a larger model.
+
+    Live captions keep coming from the small model; every utterance the
+    live decoder finishes is spooled to disk as raw 16kHz PCM and queued
+    here. One worker thread loads the large model on first use and
+    re-decodes utterances in arrival order, reading each file through a
+    memory map, then hands the text back so the session can patch its
+    transcript and archive. The worker runs at the lowest CPU priority
+    and, between blocks, sleeps while ``pressure()`` reports the live path
+    is behind, so it only uses spare cycles. ``load_model`` is called
+    with ``model_path`` on the worker thread to get the model;
+    SessionManager passes one that goes through its ModelRegistry so the
+    large model counts against the memory budget.
+    """
+
+    def __init__(self, model_path, pressure=None, niceness=19, backoff=0.2, load_model=None):
+        self.model_path = model_path
+        self.load_model = load_model or vosk.Model
+        self.pressure = pressure or (lambda: False)
+        self.niceness = niceness
+        self.backoff = backoff  # Seconds to sleep while the live path is under pressure
+        self.jobs = queue.Queue()
+        self.pending = {}  # TranscriptLog -> utterances queued or running
+        self.idle_callbacks = {}  # TranscriptLog -> callbacks to run once it has none pending
+        self.lock = threading.Lock()
+        self.model = None
+        metrics.SECOND_PASS_QUEUE.set_function(self.jobs.qsize)
+        self._thread = threading.Thread(target=self._run, name="subby-second-pass", daemon=True)
+        self._thread.start()
+
+    def submit(self, utterance):
+        with self.lock:
+            self.pending[utterance.session] = self.pending.get(utterance.session, 0) + 1
+        self.jobs.put(utterance)
+
+    def defer(self, session, callback):
+        """Run ``callback`` once the utterances of ``session`` still queued are re-decoded.
+
+        Returns False, without calling it, if there are none.
+        """
+        with self.lock:
+            if not self.pending.get(session):
+                return False
+            self.idle_callbacks.setdefault(session, []).append(callback)
+            return True
+
+    def shutdown(self):
+        self.jobs.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        lower_thread_priority(self.niceness)
+        recognizer = None
+        while True:
+            utterance = self.jobs.get()
+            if utterance is None:
+                return
+            try:
+                if recognizer is None:
+                    logger.info(f"Loading second-pass model from: {self.model_path}")
+                    self.model = self.load_model(self.model_path)
+                    recognizer = vosk.KaldiRecognizer(self.model, 16000)
+                text = self._decode(recognizer, utterance.path)
+                if text:
+                    utterance.on_result(utterance, text)
+                    metrics.REVISED_SEGMENTS.inc()
+            except Exception as e:
+                logger.error(f"Error in second pass for {utterance.path}: {e}")
+                if recognizer is not None:
+                    recognizer.Reset()
+            finally:
+                try:
+                    os.remove(utterance.path)
+                except OSError:
+                    pass
+                self._finished(utterance.session)
+
+    def _decode(self, recognizer, path):
+        if os.path.getsize(path) == 0:
+            return ""
+        started = time.perf_counter()
+        samples = np.memmap(path, dtype=np.int16, mode="r")
+        texts = []
+        for offset in range(0, len(samples), _FEED_SAMPLES):
+            # Give the CPU back to live decoding whenever it falls behind
+            while self.pressure():
+                metrics.SECOND_PASS_YIELDS.inc()
+                time.sleep(self.backoff)
+            chunk = np.ascontiguousarray(samples[offset:offset + _FEED_SAMPLES])
+            if recognizer.AcceptWaveform(as_waveform(chunk)):
+                texts.append(json.loads(recognizer.Result()).get("text", ""))
+        texts.append(json.loads(recognizer.FinalResult()).get("text", ""))
+        recognizer.Reset()
+        del samples
+        metrics.STAGE_SECONDS.labels("second_pass").observe(time.perf_counter() - started)
+        return " ".join(text for text in texts if text).strip()
+
+    def _finished(self, session):
+        with self.lock:
+            remaining = self.pending[session] - 1
+            if remaining:
+                self.pending[session] = remaining
+                return
+            del self.pending[session]
+            callbacks = self.idle_callbacks.pop(session, [])
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error finishing second pass for a session: {e}")
@@ -0,0 +1,323 @@
+import asyncio
+import importlib
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import discord
+
+import metrics
+from load_controller import LoadController
+from model_registry import ModelRegistry
+from transcript_archive import TranscriptArchive
+from transcript_log import TranscriptLog
+
+# vosk, numpy and voice_recv are imported on first use (normally by preload)
+# so the bot can start connecting to Discord without waiting for them
+_DECODE_MODULES = ("vosk", "numpy", "audio_processor", "recognizer_pool", "process_backend")
+
+
+logger = logging.getLogger(__name__)
+
+
+class SessionLimitError(Exception):
+    """Raised when starting a session would exceed the global budget"""
+
+
+class SessionManager:
+    """Registry of per-guild transcription sessions.
+
+    Every guild gets its own AudioProcessor (sink, text channel and settings
+    such as ``enable_file_creation``), while the loaded ``vosk.Model`` and the
+    decode thread pool are shared by all of them. New sessions are only
+    admitted while the number of transcribing sessions and recently active
+    speakers stays within the configured budget.
+
+    ``backend`` selects where recognizers run: ``"thread"`` decodes in this
+    process on the shared pool, ``"process"`` shards speakers across
+    ProcessDecodeBackend worker processes that each load the model.
+
+    A LoadController watches queue depth and real-time factor across all
+    sessions and degrades caption quality in steps when decoding falls
+    behind, restoring it once the load drops.
+
+    Models live in a ModelRegistry under a memory budget: the default one
+    (``model_path``) stays loaded, while models picked per guild with
+    ``AudioProcessor.model_name`` load on demand and can be evicted once no
+    session uses them. Per-guild models need the thread backend, since
+    worker processes only load the default.
+
+    ``preload`` imports the decode stack, loads the model and runs a
+    warm-up decode; the bot starts it in the background at launch, and
+    ``start`` waits for it rather than loading on the first request.
+
+    With ``second_pass_model`` set, every session's utterances are also
+    re-transcribed in the background with that (larger) model, using only
+    CPU the live path leaves idle.
+    """
+
+    def __init__(self, model_path="models/vosk-model-small-en-us-0.15", max_sessions=32,
+                 speakers_per_core=6, decode_workers=None, backend="thread", prewarm_recognizers=4,
+                 transcript_dir="transcripts", archive_path="transcripts/archive.db",
+                 second_pass_model=None, pressure_queue_packets=25, models_root="models",
+                 model_budget_mb=2048, caption_updates_per_second=1.0, batch_captions=False):
+        if backend not in ("thread", "process"):
+            raise ValueError(f"Unknown decode backend: {backend}")
+        self.model_path = model_path
+        self.model = None
+        self._model_lock = asyncio.Lock()
+        self.sessions = {}  # guild_id -> AudioProcessor
+        workers = decode_workers or os.cpu_count() or 1
+        # One pool for every session, so total decode concurrency is bounded by cores.
+        # In process mode it only forwards audio to the decoder processes.
+        self.decode_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="subby-decode")
+        self.backend = backend
+        self.decode_workers = workers
+        self.process_backend = None
+        self.recognizer_pool = None
+        self.prewarm_recognizers = prewarm_recognizers
+        self.transcript_dir = transcript_dir  # Per-session segment logs, see TranscriptLog
+        # Every final from every session, full-text searchable; None disables it
+        self.archive = TranscriptArchive(archive_path) if archive_path else None
+        self.max_sessions = max_sessions
+        # Caption defaults for new guild sessions; ?subbycaptions changes batching per guild
+        self.caption_updates_per_second = caption_updates_per_second
+        self.batch_captions = batch_captions
+        self.max_speakers = speakers_per_core * workers
+        self.models = ModelRegistry(models_root, model_budget_mb * 1024 ** 2, max_resident=self.max_speakers)
+        # The second pass backs off once any speaker has this much audio queued (25 = 0.5s)
+        self.pressure_queue_packets = pressure_queue_packets
+        self.second_pass = None
+        self._second_pass_entry = None  # Registry reference held by the second pass
+        if second_pass_model:
+            from second_pass import SecondPass
+            self.second_pass = SecondPass(
+                second_pass_model, pressure=self.under_pressure, load_model=self._load_second_pass_model
+            )
+        self.loop = None  # The bot's event loop, known once start_preload has run
+        self.load_controller = LoadController(self)
+        self._files = None  # FileTranscriber for ?subbyfile, created on first use
+        self._preload = None  # Task running preload()
+        self.startup_timings = {}  # Phase -> seconds, filled in by preload
+
+        metrics.ACTIVE_SESSIONS.set_function(lambda: len(self.active_sessions))
+        metrics.ACTIVE_SPEAKERS.set_function(lambda: self.active_speakers)
+        metrics.QUEUE_DEPTH.labels("total").set_function(lambda: sum(self.queue_depths().values()))
+        metrics.QUEUE_DEPTH.labels("max").set_function(lambda: max(self.queue_depths().values(), default=0))
+
+    async def load_model(self):
+        """Load the shared Vosk model once, however many sessions ask for it.
+
+        In process mode the workers load their own copy and no model is
+        needed here, so this starts the worker processes and returns None.
+        """
+        async with self._model_lock:
+            if self.backend == "process":
+                if self.process_backend is None:
+                    from process_backend import ProcessDecodeBackend
+                    self.process_backend = ProcessDecodeBackend(
+                        self.model_path, workers=self.decode_workers, max_speakers=self.max_speakers
+                    )
+            elif self.model is None:
+                # Never released, so the default model is never evicted
+                entry = await self.models.acquire(self.model_path)
+                self.model, self.recognizer_pool = entry.model, entry.pool
+                # Sized to the speaker budget; the first speakers get pre-built recognizers
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self.recognizer_pool.prewarm, self.prewarm_recognizers)
+        return self.model
+
+    def preload_model(self, name):
+        """Start loading a registry model in the background, e.g. right after ?subbymodel"""
+        task = asyncio.get_running_loop().create_task(self.models.load(name))
+        task.add_done_callback(_log_preload_failure)
+        return task
+
+    @property
+    def files(self):
+        if self._files is None:
+            from file_transcriber import FileTranscriber
+            # Uploaded recordings decode on their own low-priority pool
+            self._files = FileTranscriber()
+        return self._files
+
+    async def preload(self):
+        """Import the decode stack, load the model and warm it up, timing each phase"""
+        loop = asyncio.get_running_loop()
+        timings = self.startup_timings
+        started = phase = time.perf_counter()
+        await loop.run_in_executor(None, lambda: [importlib.import_module(name) for name in _DECODE_MODULES])
+        timings["import"] = time.perf_counter() - phase
+        phase = time.perf_counter()
+        await self.load_model()
+        timings["model"] = time.perf_counter() - phase
+        phase = time.perf_counter()
+        if self.process_backend is not None:
+            # Each worker loads its own copy; wait until every one can decode
+            while not self.process_backend.ready:
+                if any(not w.ready and not w.process.is_alive() for w in self.process_backend.workers):
+                    raise RuntimeError("A decoder process failed to load the model")
+                await asyncio.sleep(0.05)
+        else:
+            await loop.run_in_executor(None, self._warm_up)
+        timings["warmup"] = time.perf_counter() - phase
+        timings["preload"] = time.perf_counter() - started
+        for name, seconds in timings.items():
+            metrics.STARTUP_SECONDS.labels(name).set(seconds)
+        logger.info("Decoder ready: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()))
+
+    def _warm_up(self):
+        """Decode a second of faint noise so the first speaker finds the model paged in and caches warm"""
+        import numpy as np
+        recognizer, elapsed = self.recognizer_pool.acquire()
+        try:
+            noise = (np.random.default_rng(0).standard_normal(16000) * 100).astype(np.int16)
+            recognizer.AcceptWaveform(noise.tobytes())
+            recognizer.FinalResult()
+        finally:
+            self.recognizer_pool.release(recognizer, elapsed + 1.0)
+
+    def _load_second_pass_model(self, path):
+        """Load the second-pass model through the registry (second-pass thread); kept until shutdown"""
+        if self.loop is None:
+            raise RuntimeError("No event loop yet to load the second-pass model on")
+        entry = asyncio.run_coroutine_threadsafe(self.models.acquire(path), self.loop).result()
+        if self._second_pass_entry is not None:
+            self.models.release(self._second_pass_entry)  # Reloaded after an error
+        self._second_pass_entry = entry
+        return entry.model
+
+    def start_preload(self):
+        """Start preload() in the background, or again if the last attempt failed"""
+        self.loop = asyncio.get_running_loop()
+        task = self._preload
+        if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+            task = self._preload = asyncio.get_running_loop().create_task(self.preload())
+            task.add_done_callback(_log_preload_failure)
+        return task
+
+    @property
+    def is_ready(self):
+        task = self._preload
+        return task is not None and task.done() and not task.cancelled() and task.exception() is None
+
+    async def wait_ready(self):
+        """Wait for the preload (starting it if needed); raises if loading failed"""
+        await asyncio.shield(self.start_preload())
+
+    def get(self, guild_id):
+        """Return the guild's session, creating it with default settings"""
+        processor = self.sessions.get(guild_id)
+        if processor is None:
+            from audio_processor import AudioProcessor
+            processor = self.sessions[guild_id] = AudioProcessor(self.model_path, sessions=self)
+            processor.max_updates_per_second = self.caption_updates_per_second
+            processor.batch_partials = self.batch_captions
+        return processor
+
+    @property
+    def active_sessions(self):
+        return [p for p in self.sessions.values() if p.is_transcribing]
+
+    @property
+    def active_speakers(self):
+        return sum(p.sink.active_speakers for p in self.active_sessions if p.sink is not None)
+
+    def queue_depths(self):
+        """Queued packets per (guild_id, user_id) across every active session"""
+        depths = {}
+        for guild_id, processor in list(self.sessions.items()):
+            if processor.is_transcribing and processor.sink is not None:
+                for user_id, depth in processor.sink.queue_depths().items():
+                    depths[guild_id, user_id] = depth
+        return depths
+
+    def under_pressure(self):
+        """Whether live decoding is falling behind or the CPUs are saturated"""
+        if max(self.queue_depths().values(), default=0) >= self.pressure_queue_packets:
+            return True
+        if hasattr(os, "getloadavg"):
+            return os.getloadavg()[0] >= (os.cpu_count() or 1)
+        return False
+
+    async def start(self, guild_id, voice_client, text_channel):
+        """Start transcribing a guild's voice channel, subject to admission control"""
+        processor = self.get(guild_id)
+        if processor.is_transcribing:
+            return processor
+
+        active = len(self.active_sessions)
+        if active >= self.max_sessions:
+            raise SessionLimitError(f"Transcription is running in {active} channels already, try again later")
+        speakers = self.active_speakers
+        if speakers >= self.max_speakers:
+            raise SessionLimitError(f"The bot is busy decoding {speakers} speakers, try again later")
+
+        await self.wait_ready()
+        await processor.start_transcription(voice_client, text_channel)
+        # New sessions start at the current degradation level
+        self.load_controller.apply(processor.sink)
+        self.load_controller.start()
+        logger.info(f"Sessions active: {len(self.active_sessions)}/{self.max_sessions}")
+        return processor
+
+    async def stop(self, guild_id, voice_client):
+        processor = self.sessions.get(guild_id)
+        if processor is not None:
+            await processor.stop_transcription(voice_client)
+
+    async def recover_transcripts(self, bot):
+        """Post the transcripts of sessions cut short by a crash or restart.
+
+        Call once at startup, before any session starts, since every log
+        without a closed marker is taken to be orphaned.
+        """
+        loop = asyncio.get_running_loop()
+        for log in await loop.run_in_executor(None, TranscriptLog.orphans, self.transcript_dir):
+            if not log.meta.get("enable_file_creation", True):
+                # The server turned transcript files off (?subbynotranscript)
+                await loop.run_in_executor(None, log.remove)
+                logger.info(f"Discarded transcript from {log.directory}, transcript files were off")
+                continue
+            channel = bot.get_channel(log.meta.get("channel_id") or 0)
+            try:
+                files = await loop.run_in_executor(None, log.export)
+                if files and channel is not None:
+                    await channel.send(
+                        content=f"📝 **Transcript recovered after a restart** (started {log.meta.get('started')}):",
+                        files=[discord.File(path, filename=name) for path, name in files],
+                    )
+                    log.remove()
+                elif files:
+                    log.mark_closed()
+                    logger.warning(f"Channel for recovered transcript is gone, kept in {log.directory}")
+                else:
+                    log.remove()
+            except (OSError, discord.HTTPException) as e:
+                logger.error(f"Error recovering transcript from {log.directory}: {e}")
+                continue
+            logger.info(f"Recovered transcript from {log.directory}")
+
+    def shutdown(self):
+        """Stop the decoder processes and second pass, if any, and flush the archive"""
+        self.load_controller.stop()
+        if self._files is not None:
+            self._files.shutdown()
+        if self.second_pass is not None:
+            self.second_pass.shutdown()
+            self.second_pass = None
+        if self._second_pass_entry is not None:
+            self.models.release(self._second_pass_entry)
+            self._second_pass_entry = None
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+        if self.process_backend is not None:
+            self.process_backend.shutdown()
+            self.process_backend = None
+
+
+def _log_preload_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Failed to load the speech model: {task.exception()}")
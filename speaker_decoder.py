@@ -0,0 +1,249 @@
+import bisect
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+import vosk
+
+import metrics
+from ring_buffer import PcmRingBuffer
+from resampler import Resampler
+from vad import EnergyVAD
+
+
+try:
+    _from_buffer = vosk._ffi.from_buffer
+except AttributeError:  # Builds without the cffi handle; it is not public API
+    _from_buffer = None
+
+
+def as_waveform(samples):
+    """Expose contiguous int16 audio to AcceptWaveform, without copying it to bytes where vosk allows"""
+    if _from_buffer is None:
+        return bytes(samples)
+    return _from_buffer(samples)
+
+
+class SpeakerDecoder:
+    """Per-speaker decode chain: resample, VAD-gate, buffer and recognize.
+
+    Self-contained so it can run on a decode thread or inside a worker
+    process. ``feed`` and ``finish`` return a list of ``(kind, payload)``
+    events for the caller to publish:
+
+    - ``("partial", text)`` - current partial hypothesis
+    - ``("final", result)`` - parsed Vosk result dict; when ``feed`` has
+      been given arrival times, ``start`` and ``end`` hold the wall-clock
+      time of its first and last word
+    - ``("utterance", {"path", "start", "end"})`` - with a ``spool_dir``,
+      the kept 16kHz audio of the utterance that just ended, as a raw int16
+      file, and its wall-clock span; it precedes the ``"end"`` event
+    - ``("end", (frames_total, frames_skipped))`` - the utterance ended; the
+      payload carries the VAD's running counters
+    """
+
+    def __init__(self, model, sample_rate=16000, feed_duration=0.5, max_buffer_duration=6.0,
+                 vad_threshold_db=-50.0, vad_hangover_ms=300, silence_timeout=2.0, pool=None,
+                 spool_dir=None, partials=True):
+        self.sample_rate = sample_rate
+        self.feed_size = int(sample_rate * feed_duration)
+        self.partials = partials  # Whether to compute a partial hypothesis after every block
+        self.buffer = PcmRingBuffer(int(sample_rate * max_buffer_duration))
+        self.resampler = Resampler()
+        self.vad = EnergyVAD(
+            sample_rate,
+            threshold_db=vad_threshold_db,
+            hangover_ms=vad_hangover_ms,
+            end_silence=silence_timeout,
+        )
+        # Recognizers come from the shared RecognizerPool when there is one
+        self.pool = pool
+        if pool is not None:
+            self.recognizer, self.elapsed = pool.acquire()
+        else:
+            self.recognizer, self.elapsed = vosk.KaldiRecognizer(model, sample_rate), 0.0
+            self.recognizer.SetWords(True)
+        self.frame_seconds = self.vad.frame_size / sample_rate
+
+        # Word times count samples fed to the recognizer. To put them on the
+        # wall clock, remember where each run of kept (non-silent) audio came
+        # from in the input stream, and when input batches arrived.
+        self.fed = 0  # Samples passed to AcceptWaveform
+        self.written = 0  # Samples written to the buffer
+        self.received = 0  # 16kHz samples seen by the VAD
+        self._run_written = []  # Buffer position where a run of kept audio starts...
+        self._run_received = []  # ...and its position in the input
+        self._anchor_received = []  # Input position of a batch given an arrival time...
+        self._anchor_wall = []  # ...and that time
+
+        # Two-pass mode: each utterance's kept audio is also written to disk
+        self.spool_dir = spool_dir
+        self._spool = None  # Open file of the current utterance
+        self._spool_start = None  # Its wall-clock start
+
+    def feed(self, packets, started_at=None):
+        """Decode a batch of 48kHz stereo PCM packets.
+
+        ``started_at`` is the wall-clock arrival time of the first packet;
+        callers pass it after a gap in the stream so finals can be timed.
+        """
+        events = []
+        buffer = self.buffer
+        if started_at is not None:
+            self._anchor_received.append(self.received)
+            self._anchor_wall.append(started_at)
+
+        # Anti-aliased 48kHz stereo -> 16kHz mono, then drop silent frames
+        started = time.perf_counter()
+        samples = self.resampler.process(packets)
+        resampled = time.perf_counter()
+        first_frame = self.vad.frames_total
+        self.received += len(samples)
+        frames, keep, ended = self.vad.process(samples)
+        kept = int(keep.sum())
+        if kept:
+            audio = frames.reshape(-1) if kept == len(keep) else frames[keep].reshape(-1)
+            written = self.written
+            buffer.write(audio)  # Oldest audio is overwritten past capacity
+            self._track_runs(first_frame, keep, kept)
+            if self.spool_dir is not None:
+                self._spool_audio(audio, written)
+        gated = time.perf_counter()
+        metrics.STAGE_SECONDS.labels("resample").observe(resampled - started)
+        metrics.STAGE_SECONDS.labels("vad").observe(gated - resampled)
+        if kept < len(keep):
+            metrics.AUDIO_SKIPPED.inc((len(keep) - kept) * self.frame_seconds)
+
+        # Feed each complete block once; the remainder waits for the next packet
+        recognizer = self.recognizer
+        blocks = 0
+        while len(buffer) >= self.feed_size:
+            # Zero-copy view of the oldest audio, handed straight to Vosk
+            chunk = buffer.peek(self.feed_size)
+            if recognizer.AcceptWaveform(as_waveform(chunk)):
+                events.append(("final", self._stamp(json.loads(recognizer.Result()))))
+            elif self.partials:
+                partial = json.loads(recognizer.PartialResult())
+                events.append(("partial", partial.get("partial", "")))
+            buffer.consume(self.feed_size)
+            self.fed += self.feed_size
+            blocks += 1
+        if blocks:
+            decoded = time.perf_counter() - gated
+            metrics.STAGE_SECONDS.labels("decode").observe(decoded)
+            metrics.observe_decode(decoded, blocks * self.feed_size / self.sample_rate)
+
+        if ended:
+            events.extend(self.finish())
+        return events
+
+    def finish(self):
+        """Flush buffered speech and finalize the current utterance"""
+        self.vad.end_utterance()
+        buffer = self.buffer
+        started = time.perf_counter()
+        remaining = len(buffer)
+        if remaining:
+            self.recognizer.AcceptWaveform(as_waveform(buffer.peek()))
+            buffer.consume(remaining)
+            self.fed += remaining
+        final = self._stamp(json.loads(self.recognizer.FinalResult()))
+        metrics.observe_decode(time.perf_counter() - started, remaining / self.sample_rate)
+        events = [("final", final)]
+        utterance = self._close_spool()
+        if utterance is not None:
+            events.append(("utterance", utterance))
+        events.append(("end", (self.vad.frames_total, self.vad.frames_skipped)))
+        return events
+
+    def tune(self, feed_duration=None, partials=None):
+        """Change block size or partial results mid-stream (the load controller's knobs)"""
+        if feed_duration is not None:
+            self.feed_size = int(self.sample_rate * feed_duration)
+        if partials is not None:
+            self.partials = partials
+
+    def close(self):
+        """Hand the recognizer back to the pool; call finish() first to keep the last words"""
+        if self._spool is not None:
+            self._spool.close()
+            os.remove(self._spool.name)  # An unfinished utterance is not worth re-decoding
+            self._spool = None
+        if self.pool is not None and self.recognizer is not None:
+            self.pool.release(self.recognizer, self.elapsed + self.fed / self.sample_rate)
+        self.recognizer = None
+
+    def _track_runs(self, first_frame, keep, kept):
+        """Record where each new run of kept frames sits in the input"""
+        frame_size = self.vad.frame_size
+        if kept == len(keep):
+            starts = ((0, 0),)
+        else:
+            index = np.flatnonzero(keep)
+            breaks = np.flatnonzero(np.diff(index) != 1) + 1
+            starts = [(0, int(index[0]))] + [(int(b), int(index[b])) for b in breaks]
+        for position, frame in starts:
+            written = self.written + position * frame_size
+            received = (first_frame + frame) * frame_size
+            # A run that simply continues the previous one needs no entry
+            if self._run_written and received - self._run_received[-1] == written - self._run_written[-1]:
+                continue
+            self._run_written.append(written)
+            self._run_received.append(received)
+        self.written += kept * frame_size
+
+    def _spool_audio(self, audio, written):
+        if self._spool is None:
+            path = os.path.join(self.spool_dir, f"{uuid.uuid4().hex}.pcm")
+            self._spool = open(path, "wb")
+            self._spool_start = self._wall_at(written)
+        self._spool.write(audio)  # Raw int16 through the buffer protocol, no bytes copy
+
+    def _close_spool(self):
+        """Close the current utterance's spool file and describe it, if it can be placed in time"""
+        spool, self._spool = self._spool, None
+        if spool is None:
+            return None
+        spool.close()
+        end = self._wall_at(self.written)
+        if self._spool_start is None or end is None:
+            os.remove(spool.name)
+            return None
+        return {"path": spool.name, "start": self._spool_start, "end": end}
+
+    def wall_time(self, seconds):
+        """Wall-clock time of a recognizer timestamp, or None without arrival times"""
+        # Audio overwritten in a full buffer was written but never fed
+        return self._wall_at((seconds - self.elapsed) * self.sample_rate + self.buffer.overwritten)
+
+    def _wall_at(self, written):
+        """Wall-clock time of a position in the buffer's write stream"""
+        if not self._anchor_wall or not self._run_written:
+            return None
+        run = max(0, bisect.bisect_right(self._run_written, written) - 1)
+        received = self._run_received[run] + written - self._run_written[run]
+        anchor = max(0, bisect.bisect_right(self._anchor_received, received) - 1)
+        return self._anchor_wall[anchor] + (received - self._anchor_received[anchor]) / self.sample_rate
+
+    def _stamp(self, result):
+        words = result.get("result")
+        if words:
+            start = self.wall_time(words[0]["start"])
+            if start is not None:
+                result["start"] = start
+                result["end"] = self.wall_time(words[-1]["end"])
+                self._forget_before(words[-1]["end"])
+        return result
+
+    def _forget_before(self, seconds):
+        """Drop runs and anchors that only map audio already finalized"""
+        written = (seconds - self.elapsed) * self.sample_rate + self.buffer.overwritten
+        run = bisect.bisect_right(self._run_written, written) - 1
+        if run > 0:
+            received = self._run_received[run]
+            del self._run_written[:run], self._run_received[:run]
+            anchor = bisect.bisect_right(self._anchor_received, received) - 1
+            if anchor > 0:
+                del self._anchor_received[:anchor], self._anchor_wall[:anchor]
@@ -0,0 +1,127 @@
+import os
+import sys
+
+# The bot's modules live at the repository root, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import json
+import threading
+from collections import deque
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+RATE = 16000
+PACKET_FRAMES = 960  # 20ms of 48kHz stereo
+
+
+def stereo_packets(seconds, amplitude, seed=0):
+    """48kHz stereo int16 packets of noise (or silence with amplitude 0)"""
+    frames = int(seconds * 48000)
+    audio = (np.random.default_rng(seed).standard_normal((frames, 2)) * amplitude).astype(np.int16)
+    return [audio[i:i + PACKET_FRAMES].tobytes() for i in range(0, frames, PACKET_FRAMES)]
+
+
+class FakeRecognizer:
+    """Emits one word spanning everything fed since the last result, on Vosk's running clock"""
+
+    def __init__(self, clock=0.0):
+        self.clock = clock  # Reset() does not rewind it, like Vosk
+        self.word_start = clock
+
+    def AcceptWaveform(self, data):
+        self.clock += len(data) / 2 / RATE
+        return False
+
+    def PartialResult(self):
+        return json.dumps({"partial": ""})
+
+    def FinalResult(self):
+        result = {"text": "word", "result": [{"word": "word", "start": self.word_start, "end": self.clock}]}
+        self.word_start = self.clock
+        return json.dumps(result)
+
+    def SetWords(self, enabled):
+        pass
+
+    def Reset(self):
+        pass
+
+
+class ManualPool:
+    """Executor stand-in that runs submitted jobs only when the test says so"""
+
+    def __init__(self):
+        self.jobs = deque()
+
+    def submit(self, fn, *args):
+        self.jobs.append((fn, args))
+
+    def run(self):
+        while self.jobs:
+            fn, args = self.jobs.popleft()
+            fn(*args)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.jobs.clear()
+
+
+class FakeUser:
+    def __init__(self, user_id, display_name=None):
+        self.id = user_id
+        self.display_name = display_name or f"user{user_id}"
+
+
+def voice_data(pcm):
+    return SimpleNamespace(pcm=pcm)
+
+
+@pytest.fixture
+def event_loop_thread():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+@pytest.fixture
+def make_sink(tmp_path, event_loop_thread):
+    """Build TranscriptionSinks on a running loop whose decode jobs run on demand"""
+    from audio_processor import TranscriptionSink
+
+    sinks = []
+
+    def make(**kwargs):
+        pool = kwargs.pop("decode_pool", None) or ManualPool()
+        kwargs.setdefault("enable_file_creation", False)
+        kwargs.setdefault("transcript_dir", str(tmp_path / "transcripts"))
+        channel = kwargs.pop("text_channel", None) or SimpleNamespace(id=1, guild=None)
+        sink = TranscriptionSink(None, channel, event_loop_thread, 16000, decode_pool=pool, **kwargs)
+        sinks.append(sink)
+        return sink, pool
+
+    yield make
+    for sink in sinks:
+        sink.stop_timeout = 0.1
+        sink.stop().result(timeout=10)
+
+
+@pytest.fixture
+def fake_models(tmp_path, monkeypatch):
+    """Make model directories of a given size on disk that load without Vosk"""
+    import vosk
+
+    monkeypatch.setattr(vosk, "Model", lambda path: SimpleNamespace(path=path))
+    monkeypatch.setattr(vosk, "KaldiRecognizer", lambda model, rate: FakeRecognizer())
+
+    def make(name, size):
+        directory = tmp_path / "models" / name
+        directory.mkdir(parents=True)
+        (directory / "final.mdl").write_bytes(b"\0" * size)
+        return str(directory)
+    return make
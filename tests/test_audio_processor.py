@@ -0,0 +1,37 @@
+"""AudioProcessor's session start and its cleanup when setup fails"""
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from session_manager import SessionManager
+
+
+class BrokenVoiceClient:
+    channel = "voice"
+
+    def listen(self, sink):
+        raise RuntimeError("not connected")
+
+
+def test_failed_start_releases_the_model_and_resets_the_session(tmp_path, fake_models):
+    default, german = fake_models("default", 100), fake_models("de", 100)
+    transcripts = tmp_path / "transcripts"
+    sessions = SessionManager(model_path=default, transcript_dir=str(transcripts), archive_path=None)
+    processor = sessions.get(1)
+    processor.model_name = german
+    channel = SimpleNamespace(id=10, guild=None)
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await processor.start_transcription(BrokenVoiceClient(), channel)
+    try:
+        asyncio.run(main())
+    finally:
+        sessions.shutdown()
+
+    assert not processor.is_transcribing
+    assert processor.sink is None and processor.model_entry is None
+    assert sessions.models.entries[german].refs == 0
+    assert os.listdir(transcripts) == []  # The empty session log is gone, not left for recovery
@@ -0,0 +1,61 @@
+"""LoadController's level steps and hysteresis, against stand-in sessions"""
+from types import SimpleNamespace
+
+from load_controller import LoadController
+
+
+class RecordingSink:
+    def __init__(self):
+        self.settings = None
+
+    def set_load_level(self, **settings):
+        self.settings = settings
+
+
+class FakeSessions:
+    def __init__(self, sessions=1, decode_workers=8):
+        self.depth = 0
+        self.decode_workers = decode_workers
+        self.active_speakers = 0  # Keeps the shared RTF gauge out of these checks
+        self.active_sessions = [SimpleNamespace(sink=RecordingSink()) for _ in range(sessions)]
+
+    def queue_depths(self):
+        return {"speaker": self.depth}
+
+
+def checks(controller, depth, count):
+    controller.sessions.depth = depth
+    for _ in range(count):
+        controller.check()
+    return controller.level
+
+
+def test_sustained_overload_steps_down_one_level_at_a_time():
+    sessions = FakeSessions(sessions=2)
+    controller = LoadController(sessions, degrade_after=2, restore_after=3)
+    assert checks(controller, 60, 1) == 0  # A single spike is not enough
+    assert checks(controller, 60, 1) == 1
+    sink = sessions.active_sessions[0].sink
+    assert sink.settings == {"partials": False, "feed_duration": None, "speaker_cap": None}
+    assert checks(controller, 60, 4) == 3
+    assert sink.settings == {"partials": False, "feed_duration": 1.0, "speaker_cap": 4}
+    assert checks(controller, 60, 10) == 3  # Already at the lowest level
+
+
+def test_quality_comes_back_only_after_calm_checks_in_a_row():
+    controller = LoadController(FakeSessions(), degrade_after=1, restore_after=3)
+    assert checks(controller, 60, 3) == 3
+    assert checks(controller, 0, 2) == 3
+    # Between the thresholds breaks the calm streak
+    assert checks(controller, 30, 1) == 3
+    assert checks(controller, 0, 2) == 3
+    assert checks(controller, 0, 1) == 2
+    assert checks(controller, 0, 3) == 1
+    assert checks(controller, 0, 3) == 0
+    assert controller.sessions.active_sessions[0].sink.settings["partials"] is True
+
+
+def test_depth_between_thresholds_holds_the_level():
+    controller = LoadController(FakeSessions(), degrade_after=2, restore_after=2)
+    assert checks(controller, 60, 2) == 1
+    assert checks(controller, 30, 20) == 1
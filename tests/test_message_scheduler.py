@@ -0,0 +1,97 @@
+"""MessageUpdateScheduler's coalescing and ordering, against a fake channel"""
+import asyncio
+
+from message_scheduler import MessageUpdateScheduler
+
+
+class FakeMessage:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content):
+        self.channel.log.append(("edit", self.content, content))
+        self.content = content
+        return self
+
+    async def delete(self):
+        self.channel.log.append(("delete", self.content))
+
+
+class FakeChannel:
+    def __init__(self):
+        self.log = []
+
+    async def send(self, content):
+        self.log.append(("send", content))
+        return FakeMessage(self, content)
+
+
+def run_scheduler(steps, **kwargs):
+    """Run ``steps(scheduler)`` on a fresh loop, then drain; returns the channel log and stats"""
+    async def main():
+        channel = FakeChannel()
+        scheduler = MessageUpdateScheduler(channel, asyncio.get_running_loop(), max_updates_per_second=1000, **kwargs)
+        await steps(scheduler)
+        if scheduler._task is None:
+            scheduler.start()
+        assert await scheduler.drain(5)
+        return channel.log, scheduler.stats
+    return asyncio.run(main())
+
+
+async def published(scheduler):
+    """Let the publishing task send everything pending"""
+    if scheduler._task is None:
+        scheduler.start()
+    while not scheduler.idle:
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(0.01)
+
+
+def test_partials_coalesce_to_the_latest_per_user():
+    async def steps(scheduler):
+        for text in ("he", "hel", "hello"):
+            scheduler._add_partial("1", "a", text, 0.0)
+        scheduler._add_partial("2", "b", "hi", 0.0)
+
+    log, stats = run_scheduler(steps)
+    assert log == [("send", "🎤 **a*: hello"), ("send", "🎤 **b*: hi")]
+    assert stats["coalesced"] == 2
+
+
+def test_finals_go_out_before_partials_and_supersede_their_own():
+    async def steps(scheduler):
+        scheduler._add_partial("2", "b", "still talking", 0.0)
+        scheduler._add_partial("1", "a", "hello wor", 0.0)
+        scheduler._add_final("1", "a", "hello world", 0.0)
+
+    log, stats = run_scheduler(steps)
+    assert log == [("send", "🎤 **a**: hello world"), ("send", "🎤 **b*: still talking")]
+    assert stats["coalesced"] == 1
+
+
+def test_lone_final_edits_the_speakers_partial_message():
+    async def steps(scheduler):
+        scheduler._add_partial("1", "a", "hello wor", 0.0)
+        await published(scheduler)
+        scheduler._add_final("1", "a", "hello world", 0.0)
+
+    log, _ = run_scheduler(steps)
+    assert log == [("send", "🎤 **a*: hello wor"), ("edit", "🎤 **a*: hello wor", "🎤 **a**: hello world")]
+
+
+def test_queued_finals_combine_into_one_send_and_retire_partial_messages():
+    async def steps(scheduler):
+        scheduler._add_partial("1", "a", "hello wor", 0.0)
+        await published(scheduler)
+        for user_id, name in (("1", "a"), ("2", "b"), ("3", "c")):
+            scheduler._add_final(user_id, name, f"text from {name}", 0.0)
+
+    log, stats = run_scheduler(steps)
+    assert log == [
+        ("send", "🎤 **a*: hello wor"),
+        ("send", "🎤 **a**: text from a\n🎤 **b**: text from b\n🎤 **c**: text from c"),
+        ("delete", "🎤 **a*: hello wor"),
+    ]
+    assert stats["coalesced"] == 2
@@ -0,0 +1,48 @@
+"""ModelRegistry's reference counting and memory budget"""
+import asyncio
+
+from model_registry import ModelRegistry
+
+
+def test_acquire_shares_one_load_and_counts_references(fake_models):
+    path = fake_models("small", 100)
+    registry = ModelRegistry(budget_bytes=1000)
+
+    async def main():
+        first, second = await asyncio.gather(registry.acquire(path), registry.acquire(path))
+        assert first is second and first.model is not None
+        assert registry.loaded() == [(path, 2)]
+        registry.release(first)
+        assert registry.loaded() == [(path, 1)]
+    asyncio.run(main())
+
+
+def test_loading_past_the_budget_evicts_the_least_recently_used_idle_model(fake_models):
+    a, b, c = fake_models("a", 400), fake_models("b", 400), fake_models("c", 400)
+    registry = ModelRegistry(budget_bytes=1000)
+
+    async def main():
+        for path in (a, b):
+            registry.release(await registry.acquire(path))
+        await registry.load(a)  # a becomes the most recently used
+        await registry.load(c)
+    asyncio.run(main())
+    assert sorted(path for path, _ in registry.loaded()) == [a, c]
+    assert registry.resident_bytes == 800
+
+
+def test_models_in_use_are_never_evicted(fake_models):
+    a, b, c = fake_models("a", 400), fake_models("b", 400), fake_models("c", 400)
+    registry = ModelRegistry(budget_bytes=1000)
+
+    async def main():
+        held = await registry.acquire(a)  # A session is using it
+        entry = await registry.acquire(b)
+        recognizer, _ = entry.pool.acquire()  # A recognizer still decoding
+        registry.release(entry)
+        await registry.load(c)  # Nothing idle: goes over budget with a warning
+        entry.pool.release(recognizer)
+        registry.release(held)
+    asyncio.run(main())
+    assert sorted(path for path, _ in registry.loaded()) == [a, b, c]
+    assert registry.resident_bytes == 1200
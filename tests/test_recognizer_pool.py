@@ -0,0 +1,35 @@
+"""RecognizerPool reuse and its resident cap"""
+import pytest
+
+import recognizer_pool
+from conftest import FakeRecognizer
+from recognizer_pool import RecognizerPool
+
+
+@pytest.fixture(autouse=True)
+def fake_recognizers(monkeypatch):
+    monkeypatch.setattr(recognizer_pool.vosk, "KaldiRecognizer", lambda model, rate: FakeRecognizer())
+
+
+def test_released_recognizers_are_reused_with_their_clock():
+    pool = RecognizerPool(None, max_resident=4)
+    recognizer, elapsed = pool.acquire()
+    assert (elapsed, pool.hits, pool.misses) == (0.0, 0, 1)
+    pool.release(recognizer, 3.5)
+    again, elapsed = pool.acquire()
+    assert again is recognizer and elapsed == 3.5
+    assert (pool.hits, pool.misses, pool.in_use) == (1, 1, 1)
+
+
+def test_pool_keeps_at_most_max_resident_recognizers():
+    pool = RecognizerPool(None, max_resident=2)
+    pool.prewarm(5)
+    assert pool.resident == 2 and not pool.at_capacity
+    first, _ = pool.acquire()
+    second, _ = pool.acquire()
+    assert pool.at_capacity
+    third, _ = pool.acquire()  # Over the cap: callers evict first, the pool doesn't refuse
+    assert pool.misses == 1
+    for recognizer in (first, second, third):
+        pool.release(recognizer)
+    assert pool.resident == 2 and pool.in_use == 0
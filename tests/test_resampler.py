@@ -0,0 +1,45 @@
+"""Resampler against a direct convolution"""
+import numpy as np
+
+from conftest import stereo_packets
+from resampler import Resampler, design_lowpass
+
+
+def reference_resample(stereo, num_taps=96, cutoff=7000.0):
+    """Full convolution of the channel mean with the low-pass, every third sample"""
+    mono = stereo[:, 0].astype(np.float64) + stereo[:, 1]
+    taps = 0.5 * design_lowpass(num_taps, cutoff, 48000)
+    filtered = np.convolve(mono, taps)[:len(mono)][::3]
+    return np.clip(np.rint(filtered), -32768, 32767)
+
+
+def test_resampler_matches_reference_convolution_across_odd_splits():
+    rng = np.random.default_rng(2)
+    stereo = (rng.standard_normal((48000, 2)) * 8000).astype(np.int16)
+    resampler = Resampler()
+    out = []
+    position = 0
+    while position < len(stereo):
+        # Packet lengths that are not multiples of 3 move the filter phase
+        n = int(rng.integers(1, 2000))
+        out.append(resampler.process(stereo[position:position + n].reshape(-1)).copy())
+        position += n
+    result = np.concatenate(out)
+    expected = reference_resample(stereo)
+    assert len(result) == len(expected)
+    assert np.max(np.abs(result - expected)) <= 1  # float32 accumulation
+
+
+def test_resampler_batch_of_packets_equals_one_at_a_time():
+    packets = stereo_packets(0.5, 5000)
+    single = Resampler()
+    one_at_a_time = np.concatenate([single.process(p).copy() for p in packets])
+    batched = Resampler().process(packets)
+    np.testing.assert_array_equal(batched, one_at_a_time)
+
+
+def test_resampler_attenuates_above_the_new_nyquist():
+    t = np.arange(48000) / 48000
+    tone = (np.sin(2 * np.pi * 10000 * t) * 10000).astype(np.int16)  # Would alias to 6kHz
+    out = Resampler().process(np.repeat(tone, 2)).astype(np.float64)
+    assert np.sqrt(np.mean(out[100:] ** 2)) < 10000 / np.sqrt(2) * 0.01
@@ -0,0 +1,45 @@
+"""PcmRingBuffer against a plain FIFO"""
+import numpy as np
+
+from ring_buffer import PcmRingBuffer
+
+
+def test_ring_buffer_matches_a_plain_fifo():
+    ring = PcmRingBuffer(100)
+    reference = np.zeros(0, dtype=np.int16)
+    rng = np.random.default_rng(1)
+    counter = 0
+    for _ in range(500):
+        if rng.random() < 0.6:
+            n = int(rng.integers(0, 150))
+            samples = np.arange(counter, counter + n, dtype=np.int16)
+            counter += n
+            ring.write(samples)
+            reference = np.concatenate([reference, samples])[-100:]
+        else:
+            n = int(rng.integers(0, 80))
+            ring.consume(n)
+            reference = reference[n:]
+        assert len(ring) == len(reference)
+        np.testing.assert_array_equal(ring.peek(), reference)
+
+
+def test_ring_buffer_peek_is_a_contiguous_view_across_the_wrap():
+    ring = PcmRingBuffer(10)
+    ring.write(np.arange(8, dtype=np.int16))
+    ring.consume(6)
+    ring.write(np.arange(8, 14, dtype=np.int16))  # Wraps around the end
+    window = ring.peek()
+    np.testing.assert_array_equal(window, np.arange(6, 14))
+    assert window.flags.c_contiguous
+    assert np.shares_memory(window, ring._data)
+
+
+def test_ring_buffer_counts_overwritten_samples():
+    ring = PcmRingBuffer(10)
+    ring.write(np.arange(8, dtype=np.int16))
+    ring.write(np.arange(8, 14, dtype=np.int16))
+    assert ring.overwritten == 4
+    ring.write(np.arange(25, dtype=np.int16))
+    assert ring.overwritten == 4 + 15 + 10
+    np.testing.assert_array_equal(ring.peek(), np.arange(15, 25))
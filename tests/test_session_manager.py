@@ -0,0 +1,74 @@
+"""SessionManager pieces that run without a model or a Discord connection"""
+import asyncio
+import os
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import vosk
+
+import second_pass
+from conftest import FakeRecognizer
+from second_pass import Utterance
+from session_manager import SessionManager
+from transcript_log import TranscriptLog
+
+
+class RecordingChannel:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content=None, files=None):
+        self.sent.append((content, [file.filename for file in files or []]))
+
+
+def test_recovery_honours_a_session_that_turned_transcripts_off(tmp_path):
+    root = str(tmp_path / "transcripts")
+    kept = TranscriptLog.create(root, guild_id=1, channel_id=10, enable_file_creation=True)
+    kept.append("1", "a", "posted after the restart", True, start=1.0, end=2.0)
+    opted_out = TranscriptLog.create(root, guild_id=2, channel_id=20, enable_file_creation=True)
+    opted_out.append("2", "b", "never posted", True, start=1.0, end=2.0)
+    opted_out.update_meta(enable_file_creation=False)  # ?subbynotranscript mid-session
+    for log in (kept, opted_out):
+        log.close()  # The bot died without marking either closed
+
+    channels = {10: RecordingChannel(), 20: RecordingChannel()}
+    bot = SimpleNamespace(get_channel=channels.get)
+    sessions = SessionManager(transcript_dir=root, archive_path=None)
+    try:
+        asyncio.run(sessions.recover_transcripts(bot))
+    finally:
+        sessions.shutdown()
+
+    assert [files for _, files in channels[10].sent] == [["transcript.txt"]]
+    assert channels[20].sent == []
+    assert not os.path.exists(kept.directory) and not os.path.exists(opted_out.directory)
+
+
+def test_second_pass_model_is_loaded_through_the_registry(tmp_path, monkeypatch):
+    model_dir = tmp_path / "big-model"
+    model_dir.mkdir()
+    (model_dir / "final.mdl").write_bytes(b"\0" * 4096)
+    monkeypatch.setattr(vosk, "Model", lambda path: SimpleNamespace(path=path))
+    monkeypatch.setattr(second_pass.vosk, "KaldiRecognizer", lambda model, rate: FakeRecognizer())
+    spool = tmp_path / "utterance.pcm"
+    spool.write_bytes(np.zeros(16000, dtype=np.int16).tobytes())
+
+    sessions = SessionManager(archive_path=None, second_pass_model=str(model_dir))
+    sessions.second_pass.pressure = lambda: False
+    revised = threading.Event()
+
+    async def main():
+        sessions.loop = asyncio.get_running_loop()  # As start_preload() records it
+        sessions.second_pass.submit(Utterance(None, "1", str(spool), 0.0, 1.0, lambda u, text: revised.set()))
+        await asyncio.get_running_loop().run_in_executor(None, revised.wait, 10)
+        return sessions.models.loaded(), sessions.models.resident_bytes
+
+    try:
+        loaded, resident = asyncio.run(main())
+    finally:
+        sessions.shutdown()
+    assert revised.is_set()
+    assert loaded == [(str(model_dir), 1)]
+    assert resident == 4096
+    assert sessions.models.entries[str(model_dir)].refs == 0  # Given back at shutdown
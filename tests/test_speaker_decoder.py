@@ -0,0 +1,60 @@
+"""SpeakerDecoder's mapping of word times onto the wall clock"""
+import numpy as np
+import pytest
+
+import speaker_decoder
+from conftest import FakeRecognizer, stereo_packets
+from speaker_decoder import SpeakerDecoder, as_waveform
+
+
+class FakePool:
+    """Hands out a recognizer that already decoded ``elapsed`` seconds for another speaker"""
+
+    def __init__(self, elapsed):
+        self.recognizer = FakeRecognizer(clock=elapsed)
+        self.elapsed = elapsed
+        self.released = None
+
+    def acquire(self):
+        return self.recognizer, self.elapsed
+
+    def release(self, recognizer, elapsed=0.0):
+        self.released = elapsed
+
+
+def finals(events):
+    return [payload for kind, payload in events if kind == "final"]
+
+
+def test_decoder_maps_word_times_past_gated_silence_onto_arrival_time():
+    pool = FakePool(elapsed=5.0)
+    decoder = SpeakerDecoder(None, pool=pool, vad_hangover_ms=300, silence_timeout=10.0)
+    packets = stereo_packets(0.5, 0) + stereo_packets(1.0, 3000) + stereo_packets(0.5, 0)
+    events = decoder.feed(packets, started_at=1000.0)
+    events += decoder.finish()
+    (final,) = finals(events)
+    # The leading silence never reaches the recognizer, the 300ms hangover does
+    assert final["start"] == pytest.approx(1000.5, abs=0.025)
+    assert final["end"] == pytest.approx(1001.8, abs=0.025)
+    decoder.close()
+    assert pool.released == pytest.approx(5.0 + 1.3, abs=0.025)
+
+
+def test_decoder_uses_the_latest_arrival_anchor_after_a_gap():
+    decoder = SpeakerDecoder(None, pool=FakePool(elapsed=2.0), vad_hangover_ms=0, silence_timeout=10.0)
+    events = decoder.feed(stereo_packets(0.5, 3000), started_at=1000.0)
+    events += decoder.finish()
+    events += decoder.feed(stereo_packets(0.5, 3000, seed=1), started_at=2000.0)
+    events += decoder.finish()
+    first, second = finals(events)
+    assert first["start"] == pytest.approx(1000.0, abs=0.025)
+    assert first["end"] == pytest.approx(1000.5, abs=0.025)
+    assert second["start"] == pytest.approx(2000.0, abs=0.025)
+    assert second["end"] == pytest.approx(2000.5, abs=0.025)
+
+
+def test_waveform_falls_back_to_bytes_without_vosk_ffi(monkeypatch):
+    samples = np.arange(-4, 4, dtype=np.int16)
+    monkeypatch.setattr(speaker_decoder, "_from_buffer", None)
+    assert as_waveform(samples) == samples.tobytes()
+    assert as_waveform(memoryview(samples.tobytes())[4:]) == samples.tobytes()[4:]
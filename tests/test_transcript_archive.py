@@ -0,0 +1,43 @@
+"""TranscriptArchive's batched writer and revisions"""
+import time
+
+from transcript_archive import TranscriptArchive
+
+
+def test_archive_revision_replaces_only_that_speakers_window(tmp_path):
+    archive = TranscriptArchive(str(tmp_path / "archive.db"), flush_interval=0.01)
+    for start, text in ((10.0, "helo"), (11.0, "wrld"), (20.0, "later")):
+        archive.add(1, 2, "a", "Ann", start, start + 0.5, text)
+    archive.add(1, 2, "b", "Bob", 10.5, 11.0, "other")
+    archive.revise(1, 2, "a", "Ann", 10.0, 11.5, "hello world")
+    archive.close()
+    archive = TranscriptArchive(str(tmp_path / "archive.db"))
+    try:
+        rows = archive.history(1, limit=10)
+        assert sorted(text for _, _, _, text in rows) == ["hello world", "later", "other"]
+        assert [text for *_, text in archive.search(1, "hello")] == ["**hello** world"]  # Match highlighted
+    finally:
+        archive.close()
+
+
+def test_a_trickle_of_finals_commits_once_per_flush_interval(tmp_path):
+    archive = TranscriptArchive(str(tmp_path / "archive.db"), flush_interval=1.0)
+    for i in range(20):  # 10 finals a second for two seconds
+        archive.add(1, 2, "a", "Ann", float(i), i + 0.5, f"final {i}")
+        time.sleep(0.1)
+    archive.close()
+    assert archive.commits <= 3
+
+
+def test_a_burst_commits_in_batches_of_batch_size(tmp_path):
+    archive = TranscriptArchive(str(tmp_path / "archive.db"), batch_size=4, flush_interval=5.0)
+    for i in range(10):
+        archive.add(1, 2, "a", "Ann", float(i), i + 0.5, f"final {i}")
+    started = time.monotonic()
+    archive.close()
+    # Two full batches, then close() flushes the rest without waiting out the interval
+    assert archive.commits == 3
+    assert time.monotonic() - started < 5.0
+    reopened = TranscriptArchive(str(tmp_path / "archive.db"))
+    assert len(reopened.history(1, limit=20)) == 10
+    reopened.close()
@@ -0,0 +1,31 @@
+"""TranscriptLog's merged export and second-pass revisions"""
+from transcript_log import TranscriptLog
+
+
+def test_transcript_log_merges_speakers_in_start_order(tmp_path):
+    log = TranscriptLog.create(str(tmp_path))
+    log.append("a", "Ann", "one", True, start=10.0, end=11.0)
+    log.append("b", "Bob", "two", True, start=10.5, end=12.0)
+    log.append("a", "Ann", "three", False, start=12.5, end=13.0)
+    log.append("b", "Bob", "four", True, start=14.0, end=15.0)
+    log.close()
+    assert [s["text"] for s in log.merged()] == ["one", "two", "three", "four"]
+
+
+def test_transcript_log_replays_revisions_over_the_segments_they_cover(tmp_path):
+    log = TranscriptLog.create(str(tmp_path))
+    for start, text in ((10.0, "helo"), (11.0, "wrld"), (20.0, "kept"), (30.0, "bye")):
+        log.append("a", "Ann", text, True, start=start, end=start + 0.5)
+    log.append("b", "Bob", "other", True, start=10.5, end=10.8)
+    log.revise("a", "Ann", 10.0, 11.5, "hello world")
+    log.revise("a", "Ann", 29.995, 30.5, "goodbye")  # Within the float slack of the segment
+    log.close()
+    assert [s["text"] for s in log.segments("a")] == ["hello world", "kept", "goodbye"]
+    assert [s["text"] for s in log.merged()] == ["hello world", "other", "kept", "goodbye"]
+    assert log.speakers() == ["a", "b"]
+
+    ((path, _),) = log.export()
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    assert "hello world" in text and "goodbye" in text
+    assert "helo" not in text and "wrld" not in text and ": bye" not in text
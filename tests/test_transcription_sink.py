@@ -0,0 +1,188 @@
+"""TranscriptionSink's packet intake and decode scheduling, without a model"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import audio_processor
+import metrics
+import recognizer_pool
+from conftest import FakeRecognizer, FakeUser, stereo_packets, voice_data
+from recognizer_pool import RecognizerPool
+
+
+def recording_decoder(sink):
+    decoded = []
+    sink._decode_packets = lambda user_id, packets, started_at=None: decoded.append((packets, started_at))
+    return decoded
+
+
+def test_overflow_drops_the_oldest_audio_but_keeps_arrival_times(make_sink):
+    sink, pool = make_sink(max_queue_packets=4)
+    decoded = recording_decoder(sink)
+    user = FakeUser(1)
+
+    for i in range(4):
+        sink.write(user, voice_data(bytes([i]) * 4))
+    # The arrival time is not a packet, so a full queue hasn't dropped anything yet
+    assert sink.dropped_packets["1"] == 0
+    for i in range(4, 6):
+        sink.write(user, voice_data(bytes([i]) * 4))
+    assert sink.dropped_packets["1"] == 2
+    assert sink.total_dropped_packets == 2
+    assert [pcm[0] for _, pcm in sink.user_queues["1"]] == [2, 3, 4, 5]
+
+    (_, arrived), = sink.user_markers["1"]
+    sink._end_utterance("1")
+    pool.run()
+
+    (packets, started_at), (end, _) = decoded
+    assert [pcm[0] for pcm in packets] == [2, 3, 4, 5]
+    # The first kept packet arrived two dropped packets after the anchor
+    assert started_at == pytest.approx(arrived + 2 * audio_processor.PACKET_SECONDS)
+    assert end is audio_processor._END_OF_UTTERANCE
+    assert not sink.user_markers["1"]
+
+
+def test_utterance_end_waits_behind_queued_audio(make_sink):
+    sink, pool = make_sink()
+    decoded = recording_decoder(sink)
+    sink.drain_batch = 2
+    user = FakeUser(1)
+
+    for i in range(3):
+        sink.write(user, voice_data(bytes([i]) * 4))
+    sink._end_utterance("1")
+    sink.write(user, voice_data(b"\x09" * 4))
+    pool.run()
+
+    batches = [packets if packets is audio_processor._END_OF_UTTERANCE else [pcm[0] for pcm in packets]
+               for packets, _ in decoded]
+    assert batches == [[0, 1], [2], audio_processor._END_OF_UTTERANCE, [9]]
+
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    monkeypatch.setattr(recognizer_pool.vosk, "KaldiRecognizer", lambda model, rate: FakeRecognizer())
+    return lambda max_resident: RecognizerPool(None, max_resident=max_resident)
+
+
+def speak(sink, pool, user, seconds=0.2):
+    """Queue and decode an utterance from ``user``, ending it as the silence timeout would"""
+    for packet in stereo_packets(seconds, 3000, seed=user.id):
+        sink.write(user, voice_data(packet))
+    user_id = str(user.id)
+    sink.user_unfinished.discard(user_id)
+    sink._end_utterance(user_id)
+    pool.run()
+
+
+def test_idle_eviction_returns_the_recognizer_and_forgets_the_speaker(make_sink, fake_pool):
+    recognizers = fake_pool(max_resident=4)
+    sink, pool = make_sink(recognizer_pool=recognizers)
+    speak(sink, pool, FakeUser(1))
+    assert recognizers.in_use == 1
+
+    sink._evict_idle(time.monotonic() + sink.recognizer_idle_timeout)
+    assert recognizers.in_use == 0 and len(recognizers.idle) == 1
+    for state in (sink.user_decoders, sink.user_queues, sink.user_markers, sink.user_names,
+                  sink.user_last_packet, sink.user_sentence_open, sink.dropped_packets, sink.user_vad_stats):
+        assert "1" not in state
+    assert sink.evicted_vad_stats[0] > 0
+    assert sink.skipped_audio_fraction < 1.0
+
+    # Coming back starts afresh, on the pooled recognizer
+    speak(sink, pool, FakeUser(1))
+    assert (recognizers.hits, recognizers.misses) == (1, 1)
+
+
+def test_idle_eviction_skips_speakers_still_talking(make_sink, fake_pool):
+    sink, pool = make_sink(recognizer_pool=fake_pool(max_resident=4))
+    for packet in stereo_packets(0.2, 3000):
+        sink.write(FakeUser(1), voice_data(packet))
+    pool.run()
+    sink._evict_idle(time.monotonic() + sink.recognizer_idle_timeout)
+    assert "1" in sink.user_decoders and "1" in sink.user_queues
+
+
+def test_full_pool_evicts_the_least_recently_heard_speaker(make_sink, fake_pool):
+    recognizers = fake_pool(max_resident=2)
+    sink, pool = make_sink(recognizer_pool=recognizers)
+    speak(sink, pool, FakeUser(1))
+    speak(sink, pool, FakeUser(2))
+    speak(sink, pool, FakeUser(3))
+
+    assert set(sink.user_decoders) == {"2", "3"}
+    assert "1" not in sink.user_queues and "1" not in sink.user_names
+    assert recognizers.resident == 2
+    assert (recognizers.hits, recognizers.misses) == (1, 2)
+
+
+def test_turning_transcripts_off_is_saved_for_crash_recovery(make_sink):
+    sink, _ = make_sink(enable_file_creation=True)
+    sink.set_file_creation(False)
+    with open(os.path.join(sink.transcript.directory, "session.json"), encoding="utf-8") as f:
+        assert json.load(f)["enable_file_creation"] is False
+    assert not sink.enable_file_creation
+
+
+def test_speaker_cap_sheds_newcomers_and_counts_them_per_user(make_sink):
+    sink, pool = make_sink()
+    recording_decoder(sink)
+    sink.speaker_cap = 1
+    sink.write(FakeUser(1), voice_data(b"\x01" * 4))
+    for _ in range(3):
+        sink.write(FakeUser(2), voice_data(b"\x02" * 4))
+    assert sink.dropped_packets == {"1": 0, "2": 3}
+    assert sink.total_dropped_packets == 3
+    assert not sink.user_queues["2"]
+
+    # Once the first speaker's utterance ends the newcomer gets the slot
+    sink.user_unfinished.discard("1")
+    sink.write(FakeUser(2), voice_data(b"\x02" * 4))
+    assert len(sink.user_queues["2"]) == 1
+
+
+class SlowRecognizer(FakeRecognizer):
+    def AcceptWaveform(self, data):
+        time.sleep(0.02)  # Decoding lags behind, so stop finds audio still queued
+        return super().AcceptWaveform(data)
+
+
+class RecordingChannel:
+    id = 1
+    guild = None
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+        return SimpleNamespace(content=content)
+
+
+def test_stop_decodes_queued_audio_and_sends_the_last_finals_before_the_deadline(make_sink, monkeypatch):
+    monkeypatch.setattr(recognizer_pool.vosk, "KaldiRecognizer", lambda model, rate: SlowRecognizer())
+    channel = RecordingChannel()
+    decode_pool = ThreadPoolExecutor(max_workers=2)
+    sink, _ = make_sink(
+        recognizer_pool=RecognizerPool(None), decode_pool=decode_pool, text_channel=channel,
+        max_updates_per_second=100,
+    )
+    sink.drain_batch = 5
+    timeouts = metrics.STOP_TIMEOUTS.labels("flush").value
+    for user in (FakeUser(1), FakeUser(2)):
+        for packet in stereo_packets(1.0, 3000, seed=user.id):
+            sink.write(user, voice_data(packet))
+
+    seconds = sink.stop().result(timeout=30)
+    decode_pool.shutdown()
+    assert seconds < sink.stop_timeout
+    assert metrics.STOP_TIMEOUTS.labels("flush").value == timeouts
+    # Both speakers were mid-utterance; their finals went out before stop returned
+    assert sorted(line for message in channel.sent for line in message.split("\n")) == [
+        "🎤 **user1**: word", "🎤 **user2**: word",
+    ]
@@ -0,0 +1,42 @@
+"""EnergyVAD gating, hangover and end detection"""
+import numpy as np
+
+from vad import EnergyVAD
+
+RATE = 16000
+
+
+def frames_of(amplitude, seconds, seed=0):
+    samples = int(seconds * RATE)
+    return (np.random.default_rng(seed).standard_normal(samples) * amplitude).astype(np.int16)
+
+
+def test_vad_drops_silence_and_keeps_speech():
+    vad = EnergyVAD(RATE, hangover_ms=0)
+    _, keep, ended = vad.process(np.zeros(RATE, dtype=np.int16))
+    assert not keep.any() and not ended
+    _, keep, _ = vad.process(frames_of(3000, 0.5))
+    assert keep.all()
+    assert vad.frames_total == 75
+    assert vad.frames_skipped == 50
+
+
+def test_vad_hangover_keeps_frames_after_speech():
+    vad = EnergyVAD(RATE, hangover_ms=100)  # 5 frames
+    audio = np.concatenate([frames_of(3000, 0.2), np.zeros(RATE // 2, dtype=np.int16)])
+    _, keep, _ = vad.process(audio)
+    np.testing.assert_array_equal(keep[:15], True)
+    np.testing.assert_array_equal(keep[15:], False)
+
+
+def test_vad_end_detection_carries_across_calls_and_partial_frames():
+    vad = EnergyVAD(RATE, end_silence=0.2)  # 10 frames
+    _, _, ended = vad.process(frames_of(3000, 0.1))
+    assert not ended and vad.in_utterance
+    silence = np.zeros(int(0.19 * RATE) + 7, dtype=np.int16)  # Leaves a partial frame behind
+    frames, _, ended = vad.process(silence)
+    assert len(frames) == 9 and not ended
+    _, _, ended = vad.process(np.zeros(320, dtype=np.int16))
+    assert ended and not vad.in_utterance
+    _, _, ended = vad.process(np.zeros(RATE, dtype=np.int16))
+    assert not ended  # Only reported once
@@ -0,0 +1,192 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    guild_id INTEGER,
+    channel_id INTEGER,
+    speaker_id TEXT NOT NULL,
+    speaker_name TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_guild_start ON segments (guild_id, start);
+CREATE INDEX IF NOT EXISTS segments_guild_speaker_start ON segments (guild_id, speaker_id, start);
+CREATE VIRTUAL TABLE IF NOT EXISTS segments_fts USING fts5(
+    text, content='segments', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS segments_ai AFTER INSERT ON segments BEGIN
+    INSERT INTO segments_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS segments_ad AFTER DELETE ON segments BEGIN
+    INSERT INTO segments_fts (segments_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS segments_au AFTER UPDATE OF text ON segments BEGIN
+    INSERT INTO segments_fts (segments_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    INSERT INTO segments_fts (rowid, text) VALUES (new.id, new.text);
+END;
+"""
+
+_INSERT = """
+INSERT INTO segments (guild_id, channel_id, speaker_id, speaker_name, start, end, text)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+_DELETE_REVISED = """
+DELETE FROM segments WHERE guild_id IS ? AND speaker_id = ? AND start >= ? AND start <= ?
+"""
+
+_REVISION_SLACK = 0.01  # Seconds of float noise allowed when matching segments to a revision
+
+
+def _match_query(terms):
+    """Quote each term so user input can't trip FTS5 query syntax; terms are ANDed"""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms.split())
+
+
+class TranscriptArchive:
+    """SQLite archive of every final segment, full-text indexed with FTS5.
+
+    Decode threads call ``add`` without touching the database: segments go
+    on a queue and one writer thread inserts them in batched transactions.
+    Once a segment arrives the writer keeps collecting for up to
+    ``flush_interval`` seconds (or until ``batch_size`` rows), so a steady
+    trickle of finals costs one commit per interval rather than one per
+    final, and nothing waits longer than that to become searchable. Reads use their own connection; the database runs
+    in WAL mode so searches never wait on the writer. ``revise`` goes
+    through the same queue, so it always lands after the segments it
+    replaces.
+    """
+
+    def __init__(self, path="transcripts/archive.db", batch_size=500, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+        self._pending = queue.SimpleQueue()
+        self.commits = 0  # Write transactions so far
+        self._reader = self._connect(check_same_thread=False)
+        self._read_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_loop, name="subby-archive", daemon=True)
+        self._writer.start()
+
+    def _connect(self, **kwargs):
+        db = sqlite3.connect(self.path, **kwargs)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")  # Durable at checkpoints; WAL keeps it consistent
+        db.row_factory = sqlite3.Row
+        return db
+
+    def add(self, guild_id, channel_id, speaker_id, speaker_name, start, end, text):
+        """Queue a final segment for the writer thread; never blocks"""
+        self._pending.put((False, (guild_id, channel_id, speaker_id, speaker_name, start, end, text)))
+
+    def revise(self, guild_id, channel_id, speaker_id, speaker_name, start, end, text):
+        """Queue replacing a speaker's segments starting within ``start``..``end`` by one with ``text``"""
+        self._pending.put((True, (guild_id, channel_id, speaker_id, speaker_name, start, end, text)))
+
+    def _write_loop(self):
+        db = self._connect()
+        closing = False
+        while not closing:
+            item = self._pending.get()
+            # Collect from the first segment until the interval is up or the batch is full
+            deadline = time.monotonic() + self.flush_interval
+            batch = []
+            while True:
+                if item is None:
+                    closing = True
+                else:
+                    batch.append(item)
+                if closing or len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if not batch:
+                continue
+            started = time.perf_counter()
+            added = 0
+            try:
+                with db:
+                    rows = []
+                    for revision, row in batch:
+                        if not revision:
+                            rows.append(row)
+                            continue
+                        # Keep order: segments queued before a revision are inserted first
+                        if rows:
+                            db.executemany(_INSERT, rows)
+                            added += len(rows)
+                            rows = []
+                        guild_id, _, speaker_id, _, start, end, _ = row
+                        db.execute(_DELETE_REVISED, (guild_id, speaker_id, start - _REVISION_SLACK, end))
+                        db.execute(_INSERT, row)
+                    if rows:
+                        db.executemany(_INSERT, rows)
+                        added += len(rows)
+            except sqlite3.Error as e:
+                logger.error(f"Error archiving {len(batch)} segments: {e}")
+                continue
+            self.commits += 1
+            metrics.STAGE_SECONDS.labels("archive").observe(time.perf_counter() - started)
+            metrics.ARCHIVED_SEGMENTS.inc(added)
+        db.close()
+
+    def _query(self, sql, params):
+        with self._read_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    def search(self, guild_id, terms, limit=5, offset=0):
+        """Best-ranked segments in a guild matching every term (blocking; run in an executor)"""
+        match = _match_query(terms)
+        if not match:
+            return []
+        return self._query(
+            """
+            SELECT s.speaker_name, s.channel_id, s.start,
+                   highlight(segments_fts, 0, '**', '**') AS text
+            FROM segments_fts JOIN segments s ON s.id = segments_fts.rowid
+            WHERE segments_fts MATCH ? AND s.guild_id = ?
+            ORDER BY bm25(segments_fts)
+            LIMIT ? OFFSET ?
+            """,
+            (match, guild_id, limit, offset),
+        )
+
+    def history(self, guild_id, speaker_id=None, limit=5, offset=0):
+        """Most recent segments in a guild, newest first (blocking; run in an executor)"""
+        if speaker_id is None:
+            sql = "SELECT speaker_name, channel_id, start, text FROM segments WHERE guild_id = ?"
+            params = (guild_id,)
+        else:
+            sql = ("SELECT speaker_name, channel_id, start, text FROM segments "
+                   "WHERE guild_id = ? AND speaker_id = ?")
+            params = (guild_id, speaker_id)
+        return self._query(sql + " ORDER BY start DESC LIMIT ? OFFSET ?", params + (limit, offset))
+
+    def close(self):
+        """Write out everything queued, then stop the writer thread"""
+        self._pending.put(None)
+        self._writer.join(timeout=10)
+        with self._read_lock:
+            self._reader.close()
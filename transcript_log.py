@@ -0,0 +1,271 @@
+import datetime
+import heapq
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+_META_FILE = "session.json"
+_CLOSED_FILE = "closed"
+_REVISIONS = ".rev.jsonl"
+_REVISION_SLACK = 0.01  # Seconds of float noise allowed when matching segments to a revision
+
+
+class TranscriptLog:
+    """Append-only, on-disk log of one session's final results.
+
+    Every speaker gets a JSON-lines file in the session directory, one
+    segment per line (wall-clock start and end, speaker id and name, text,
+    and whether it starts a new sentence). A speaker's segments are written
+    in order, so each file is sorted by start time and the exports merge
+    them into one conversation with a k-way heap merge that only ever
+    holds one segment per speaker. Lines are flushed as they are written so
+    the OS has them even if the bot dies; ``sync`` fsyncs the open files
+    for power-loss safety. Nothing is accumulated in memory.
+
+    The second pass (see ``SecondPass``) re-transcribes whole utterances;
+    ``revise`` appends its text to a separate per-speaker revisions file,
+    and ``segments`` replays it over the original segments it covers, so
+    the first-pass lines are never rewritten in place.
+
+    A session directory without a ``closed`` marker belongs to a session
+    that never stopped cleanly; ``orphans`` finds those after a restart.
+    """
+
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.meta = meta
+        self._files = {}  # path -> open append handle
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, root, **meta):
+        """Start a new session directory under ``root``"""
+        started = datetime.datetime.now()
+        directory = os.path.join(root, f"{started.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}")
+        os.makedirs(directory)
+        meta = dict(meta, started=started.isoformat(timespec="seconds"), started_at=started.timestamp())
+        log = cls(directory, meta)
+        log._write_meta()
+        return log
+
+    def update_meta(self, **changes):
+        """Change session settings that recovery after a crash must honour"""
+        self.meta.update(changes)
+        self._write_meta()
+
+    def _write_meta(self):
+        # Replaced in one step, so a crash mid-write leaves the old settings
+        path = os.path.join(self.directory, _META_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def orphans(cls, root):
+        """Logs of sessions that were still open when the bot last exited"""
+        if not os.path.isdir(root):
+            return []
+        logs = []
+        for name in sorted(os.listdir(root)):
+            directory = os.path.join(root, name)
+            if not os.path.isdir(directory) or os.path.exists(os.path.join(directory, _CLOSED_FILE)):
+                continue
+            try:
+                with open(os.path.join(directory, _META_FILE), encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            logs.append(cls(directory, meta))
+        return logs
+
+    def append(self, user_id, name, text, new_sentence, start=None, end=None):
+        """Record one final result (called from decode threads).
+
+        ``start`` and ``end`` are the wall-clock times of its first and last
+        word; without them the segment is stamped with the current time.
+        """
+        now = time.time()
+        self._write(self._speaker_path(user_id), {
+            "start": start if start is not None else now,
+            "end": end if end is not None else now,
+            "speaker": user_id,
+            "name": name,
+            "text": text,
+            "new_sentence": new_sentence,
+        })
+
+    def revise(self, user_id, name, start, end, text):
+        """Replace a speaker's segments starting within ``start``..``end`` with ``text``.
+
+        Revisions must arrive in time order per speaker, as the second pass
+        delivers them.
+        """
+        self._write(self._revisions_path(user_id), {
+            "start": start,
+            "end": end,
+            "speaker": user_id,
+            "name": name,
+            "text": text,
+            "new_sentence": True,
+        })
+
+    def _write(self, path, segment):
+        line = json.dumps(segment, ensure_ascii=False)
+        with self._lock:
+            f = self._files.get(path)
+            if f is None:
+                f = self._files[path] = open(path, "a", encoding="utf-8")
+            f.write(line + "\n")
+            f.flush()
+            self._dirty.add(path)
+
+    def sync(self):
+        """fsync files written since the last sync"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            for path in dirty:
+                f = self._files.get(path)
+                if f is not None:
+                    os.fsync(f.fileno())
+
+    def close(self):
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+            self._files.clear()
+
+    def _speaker_path(self, user_id):
+        return os.path.join(self.directory, f"{user_id}.jsonl")
+
+    def _revisions_path(self, user_id):
+        return os.path.join(self.directory, f"{user_id}{_REVISIONS}")
+
+    def speakers(self):
+        """Ids of every speaker with a segment file"""
+        return [
+            name[:-len(".jsonl")] for name in sorted(os.listdir(self.directory))
+            if name.endswith(".jsonl") and not name.endswith(_REVISIONS)
+        ]
+
+    def segments(self, user_id):
+        """Stream a speaker's segments with revisions applied, in start order"""
+        segments = _read(self._speaker_path(user_id))
+        path = self._revisions_path(user_id)
+        if not os.path.exists(path):
+            yield from segments
+            return
+        revisions = _read(path)
+        revision = next(revisions, None)
+        for segment in segments:
+            # Revisions wholly before this segment are due first
+            while revision is not None and revision["end"] < segment["start"]:
+                yield revision
+                revision = next(revisions, None)
+            if revision is not None and revision["start"] - _REVISION_SLACK <= segment["start"] <= revision["end"]:
+                continue  # Covered by the revision, which is yielded after its last segment
+            yield segment
+        if revision is not None:
+            yield revision
+        yield from revisions
+
+    def merged(self):
+        """Every speaker's segments interleaved by start time"""
+        return heapq.merge(*(self.segments(user_id) for user_id in self.speakers()), key=lambda s: s["start"])
+
+    def _offset(self, segment, key="start"):
+        return max(0.0, segment[key] - self.meta.get("started_at", 0.0))
+
+    def export_text(self, path):
+        """Write the chronological transcript; returns False if nothing was said"""
+        wrote = False
+        speaker = None
+        with open(path, "w", encoding="utf-8") as out:
+            out.write("DISCORD VOICE TRANSCRIPT\n")
+            out.write(f"Generated: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            out.write("=" * 50 + "\n\n")
+            for segment in self.merged():
+                text = segment["text"].strip()
+                if segment["speaker"] == speaker and not segment["new_sentence"]:
+                    out.write(" " + text)  # Same speaker, same sentence: keep the line going
+                    continue
+                if wrote:
+                    out.write("\n")
+                speaker = segment["speaker"]
+                out.write(f"[{_clock(self._offset(segment))}] {segment['name']}: {text}")
+                wrote = True
+            if wrote:
+                out.write("\n")
+        return wrote
+
+    def export_subtitles(self, path, fmt="srt"):
+        """Write SRT or WebVTT cues, one per segment; returns False if nothing was said"""
+        separator = "," if fmt == "srt" else "."
+        wrote = False
+        with open(path, "w", encoding="utf-8") as out:
+            if fmt == "vtt":
+                out.write("WEBVTT\n\n")
+            for number, segment in enumerate(self.merged(), 1):
+                start = self._offset(segment)
+                end = self._offset(segment, "end")
+                if end <= start:
+                    end = start + 1.0  # Finals without word times get a short cue, not a zero-length one
+                if fmt == "srt":
+                    out.write(f"{number}\n")
+                out.write(f"{_clock(start, separator)} --> {_clock(end, separator)}\n")
+                out.write(f"{segment['name']}: {segment['text'].strip()}\n\n")
+                wrote = True
+        return wrote
+
+    def export(self, subtitle_format=None):
+        """Write the transcript (and optional ``"srt"``/``"vtt"`` subtitles) into the session directory.
+
+        Returns ``(path, upload_name)`` pairs, empty if nothing was said.
+        """
+        path = os.path.join(self.directory, "transcript.txt")
+        if not self.export_text(path):
+            return []
+        files = [(path, "transcript.txt")]
+        if subtitle_format is not None:
+            path = os.path.join(self.directory, f"transcript.{subtitle_format}")
+            self.export_subtitles(path, subtitle_format)
+            files.append((path, f"transcript.{subtitle_format}"))
+        return files
+
+    def mark_closed(self):
+        self.close()
+        with open(os.path.join(self.directory, _CLOSED_FILE), "w"):
+            pass
+
+    def remove(self):
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _read(path):
+    """Stream segments from a JSON-lines file; a torn last line from a crash is skipped"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                segment = json.loads(line)
+            except ValueError:
+                continue
+            if segment.get("text", "").strip():
+                yield segment
+
+
+def _clock(seconds, separator=None):
+    """HH:MM:SS, with milliseconds after ``separator`` for subtitle cues"""
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3_600_000)
+    minutes, millis = divmod(millis, 60_000)
+    secs, millis = divmod(millis, 1000)
+    clock = f"{hours:02d}:{minutes:02d}:{secs:02d}"
+    return clock if separator is None else f"{clock}{separator}{millis:03d}"
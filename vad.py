@@ -0,0 +1,88 @@
+import numpy as np
+
+
+class EnergyVAD:
+    """Frame-energy voice activity detector with hangover.
+
+    Audio is cut into fixed frames and each frame's RMS level (dBFS) is
+    compared to ``threshold_db`` in one vectorized pass. Frames within
+    ``hangover_ms`` after speech are kept too, so word endings and short
+    pauses are not clipped. Once an utterance has been followed by
+    ``end_silence`` seconds of silence, ``process`` reports it as ended.
+    """
+
+    def __init__(self, sample_rate=16000, frame_ms=20, threshold_db=-50.0,
+                 hangover_ms=300, end_silence=1.0):
+        self.frame_size = int(sample_rate * frame_ms / 1000)
+        self.frame_duration = frame_ms / 1000
+        self.threshold_db = threshold_db
+        self.hangover_frames = int(hangover_ms / frame_ms)
+        self.end_silence = end_silence
+        self.end_frames = max(1, int(end_silence * 1000 / frame_ms))
+        # Mean-square energy threshold in int16 units, so no log per frame
+        self._threshold = (10 ** (threshold_db / 10)) * 32768.0 ** 2
+
+        self._work = np.zeros(self.frame_size * 64, dtype=np.int16)
+        self._carry = np.zeros(self.frame_size, dtype=np.int16)  # Partial frame from the last call
+        self._carry_len = 0
+        # Frames since the last speech frame, capped so it never grows unbounded
+        self._max_since = max(self.end_frames, self.hangover_frames) + 1
+        self._since_speech = self._max_since
+        self.in_utterance = False
+        self.frames_total = 0
+        self.frames_skipped = 0
+
+    @property
+    def skipped_fraction(self):
+        return self.frames_skipped / self.frames_total if self.frames_total else 0.0
+
+    def process(self, samples):
+        """Classify 16kHz int16 samples.
+
+        Returns ``(frames, keep, ended)``: a (n, frame_size) view of the
+        complete frames, a boolean mask of frames to pass to the recognizer,
+        and whether an utterance ended in this audio. Views stay valid until
+        the next call; a partial trailing frame is carried over.
+        """
+        carry = self._carry_len
+        total = carry + len(samples)
+        if total > len(self._work):
+            self._work = np.zeros(total * 2, dtype=np.int16)
+        self._work[:carry] = self._carry[:carry]
+        self._work[carry:total] = samples
+
+        n = total // self.frame_size
+        used = n * self.frame_size
+        frames = self._work[:used].reshape(n, self.frame_size)
+        self._carry_len = total - used
+        self._carry[:self._carry_len] = self._work[used:total]
+        if n == 0:
+            return frames, np.zeros(0, dtype=bool), False
+
+        energy = np.einsum("ij,ij->i", frames, frames, dtype=np.float64) / self.frame_size
+        speech = energy > self._threshold
+
+        # Distance from each frame back to the most recent speech frame,
+        # continuing the count from the previous call
+        index = np.arange(n)
+        last = np.where(speech, index, -1 - self._since_speech)
+        np.maximum.accumulate(last, out=last)
+        since = index - last
+        keep = since <= self.hangover_frames
+
+        ended = False
+        if speech.any():
+            self.in_utterance = True
+        if self.in_utterance and since[-1] >= self.end_frames:
+            ended = True
+            self.in_utterance = False
+        self._since_speech = min(int(since[-1]), self._max_since)
+
+        self.frames_total += n
+        self.frames_skipped += n - int(np.count_nonzero(keep))
+        return frames, keep, ended
+
+    def end_utterance(self):
+        """Force the current utterance closed (e.g. when packets stop arriving)"""
+        self.in_utterance = False
+        self._since_speech = self._max_since